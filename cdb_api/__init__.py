@@ -17,13 +17,19 @@
 
 from starlette.requests import Request
 from starlette.responses import JSONResponse
-from starlette.status import HTTP_404_NOT_FOUND, HTTP_403_FORBIDDEN
+from starlette.status import (
+    HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_403_FORBIDDEN,
+)
 from starlette.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
 
-from . import settings, db, user, collection, item, field
+from . import (
+    settings, db, user, collection, item, field, transfer, purge,
+)
 
-from cdb_database.error import NotFoundError, AlreadyExistsError
+from cdb_database.error import (
+    NotFoundError, AlreadyExistsError, InvalidQueryError,
+)
 
 
 app = FastAPI(
@@ -38,6 +44,7 @@ app.include_router(user.router)
 app.include_router(collection.router)
 app.include_router(item.router)
 app.include_router(field.router)
+app.include_router(transfer.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,6 +52,11 @@ app.add_middleware(
     allow_credentials = True,
     allow_methods = ["*"],
     allow_headers = ["*"],
+    expose_headers = [
+        item.NEXT_CURSOR_HEADER,
+        "ETag",
+        db.CONSISTENCY_TOKEN_HEADER,
+    ],
 )
 # test_transaction = None
 
@@ -53,9 +65,15 @@ app.add_middleware(
 async def connect_to_database():
     await db.setup_database()
 
+    if settings.purge_interval_in_minutes and not settings.test:
+        purge.start_purge_task()
+
 
 @app.on_event("shutdown")
 async def disconnect_from_database():
+    await purge.stop_purge_task()
+    transfer.shutdown_export_pool()
+
     await db.teardown_database()
 
 
@@ -77,3 +95,10 @@ async def convert_db_exceptions(request: Request, call_next):
                 detail = f"Ressource already exists",
             )
         )
+    except InvalidQueryError as error:
+        return JSONResponse(
+            status_code = HTTP_400_BAD_REQUEST,
+            content = dict(
+                detail = str(error),
+            )
+        )
@@ -37,6 +37,23 @@ def init(args):
     print("Done.")
 
 
+def upgrade(args):
+    from sqlalchemy import create_engine
+    from cdb_database.migration import upgrade_tables
+
+    db_url = os.getenv("CDB_DATABASE")
+
+    print("Connect to database...")
+    engine = create_engine(db_url)
+
+    print("Upgrade tables...")
+    with engine.begin() as connection:
+        for statement in upgrade_tables(connection):
+            print(f"  {statement}")
+
+    print("Done.")
+
+
 async def test_db(args):
     from sqlalchemy import create_engine
     from databases import Database
@@ -61,6 +78,179 @@ async def test_db(args):
     print("Done.")
 
 
+async def get_collection(database, username, collection_name):
+    from cdb_database import (
+        user as user_db,
+        collection as collection_db,
+    )
+
+    user = await user_db.get_user(
+        database,
+        username = username,
+        include_disabled = True,
+    )
+    return await collection_db.get_collection(
+        database,
+        logged_user = user,
+        user_id = user.id,
+        collection_name = collection_name,
+        include_private = True,
+    )
+
+
+async def sort_index(args):
+    from cdb_database import (
+        Database,
+        field as field_db,
+        item as item_db,
+    )
+
+    db_url = os.getenv("CDB_DATABASE")
+
+    print("Connect to database...")
+    async with Database(db_url) as database:
+        collection = await get_collection(
+            database,
+            args.username,
+            args.collection,
+        )
+        field = await field_db.get_field(database, collection.id, args.field)
+
+        print(f"Create index on {field.field!r} ({field.type})...")
+        await item_db.create_sort_index(database, field, concurrently=True)
+
+    print("Done.")
+
+
+def file_format(path, format):
+    """Returns `format`, or the format given by the extension of `path`."""
+
+    if format is not None:
+        return format
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".ndjson", ".jsonl"):
+        return "ndjson"
+    raise SystemExit(f"Unknown format for {path!r}, use --format.")
+
+
+async def import_items(args):
+    from cdb_database import Database, transfer as transfer_db
+    from cdb_api.transfer import import_rows
+
+    format = file_format(args.file, args.format)
+
+    async def chunks(file):
+        while True:
+            chunk = file.read(64 * 1024)
+            if not chunk:
+                break
+            yield chunk
+
+    db_url = os.getenv("CDB_DATABASE")
+
+    print("Connect to database...")
+    async with Database(db_url) as database:
+        collection = await get_collection(
+            database,
+            args.username,
+            args.collection,
+        )
+
+        print(f"Import {args.file!r} ({format})...")
+        with open(args.file, "rb") as file:
+            result = await transfer_db.import_items(
+                database,
+                collection.id,
+                import_rows(format, chunks(file)),
+                from_text = format == "csv",
+            )
+
+    print(f"{result.created} items created, {result.updated} updated.")
+    print("Done.")
+
+
+async def export_items(args):
+    import sys
+    from concurrent.futures import ProcessPoolExecutor
+    from cdb_database import Database, transfer as transfer_db
+    from cdb_api.transfer import export_stream
+
+    output = args.file
+    format = file_format(output, args.format) if output else args.format
+    format = format or "csv"
+
+    pool = None
+    if args.processes > 0:
+        pool = ProcessPoolExecutor(args.processes)
+
+    db_url = os.getenv("CDB_DATABASE")
+
+    async with Database(db_url) as database:
+        collection = await get_collection(
+            database,
+            args.username,
+            args.collection,
+        )
+
+        columns, rows = await transfer_db.export_items(
+            database,
+            collection.id,
+        )
+
+        file = open(output, "wb") if output else sys.stdout.buffer
+        try:
+            async for chunk in export_stream(format, columns, rows, pool=pool):
+                file.write(chunk)
+        finally:
+            if output:
+                file.close()
+            if pool is not None:
+                pool.shutdown()
+
+
+def parse_duration(value):
+    """Parses durations like `30d`, `12h` or `90m`. Plain numbers are days.
+    """
+
+    from datetime import timedelta
+
+    units = dict(d="days", h="hours", m="minutes", s="seconds")
+    unit = units.get(value[-1:], None)
+    number = value[:-1] if unit is not None else value
+    try:
+        return timedelta(**{unit or "days": float(number)})
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value!r}")
+
+
+async def purge(args):
+    from cdb_database import Database
+    from cdb_database.purge import purge
+
+    db_url = os.getenv("CDB_DATABASE")
+
+    def progress(table, count):
+        print(f"  {table}: {count} rows deleted...")
+
+    print("Connect to database...")
+    async with Database(db_url) as database:
+        print(f"Purge rows deleted more than {args.older_than} ago...")
+        counts = await purge(
+            database,
+            args.older_than,
+            batch_size = args.batch_size,
+            pause = args.pause,
+            progress = progress,
+        )
+
+    for table, count in counts.items():
+        print(f"{table}: {count} rows purged.")
+
+    print("Done.")
+
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description = "CDB api command-line tools.",
@@ -80,12 +270,95 @@ def parse_args():
     )
     init_parser.set_defaults(cmd=init)
 
+    upgrade_parser = subparsers.add_parser(
+        "upgrade",
+        help = "Upgrade the tables of an existing database to the current "
+            "schema.",
+    )
+    upgrade_parser.set_defaults(cmd=upgrade)
+
     test_db_parser = subparsers.add_parser(
         "test_db",
         help = "Clear the db and fill it with test data.",
     )
     test_db_parser.set_defaults(cmd=test_db)
 
+    sort_index_parser = subparsers.add_parser(
+        "sort_index",
+        help = "Create the index used to sort the items of a collection by "
+            "a given field.",
+    )
+    sort_index_parser.add_argument("username")
+    sort_index_parser.add_argument("collection")
+    sort_index_parser.add_argument("field")
+    sort_index_parser.set_defaults(cmd=sort_index)
+
+    import_parser = subparsers.add_parser(
+        "import",
+        help = "Create or update the items of a collection from a CSV or "
+            "NDJSON file.",
+    )
+    import_parser.add_argument("username")
+    import_parser.add_argument("collection")
+    import_parser.add_argument("file")
+    import_parser.add_argument(
+        "--format",
+        choices = ["csv", "ndjson"],
+        help = "Format of the file (default: given by its extension).",
+    )
+    import_parser.set_defaults(cmd=import_items)
+
+    export_parser = subparsers.add_parser(
+        "export",
+        help = "Export the items of a collection to a CSV or NDJSON file.",
+    )
+    export_parser.add_argument("username")
+    export_parser.add_argument("collection")
+    export_parser.add_argument(
+        "file",
+        nargs = "?",
+        help = "Output file (default: standard output).",
+    )
+    export_parser.add_argument(
+        "--format",
+        choices = ["csv", "ndjson"],
+        help = "Format of the export (default: given by the extension of "
+            "the file, or csv).",
+    )
+    export_parser.add_argument(
+        "--processes",
+        type = int,
+        default = 2,
+        help = "Number of processes encoding the rows of large collections, "
+            "0 to encode them in the main process (default: 2).",
+    )
+    export_parser.set_defaults(cmd=export_items)
+
+    purge_parser = subparsers.add_parser(
+        "purge",
+        help = "Delete the rows that have been soft-deleted for some time.",
+    )
+    purge_parser.add_argument(
+        "--older-than",
+        type = parse_duration,
+        default = "30d",
+        help = "Only purge rows deleted before this long ago, like 30d, 12h "
+            "or 90m (default: 30d).",
+    )
+    purge_parser.add_argument(
+        "--batch-size",
+        type = int,
+        default = 1000,
+        help = "Number of rows deleted by each statement (default: 1000).",
+    )
+    purge_parser.add_argument(
+        "--pause",
+        type = float,
+        default = 0.1,
+        help = "Seconds to wait between two batches (default: 0.1).",
+    )
+    purge_parser.set_defaults(cmd=purge)
+
     return parser.parse_args()
 
 
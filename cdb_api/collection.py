@@ -17,19 +17,64 @@
 
 from typing import List
 
-from starlette.status import HTTP_403_FORBIDDEN
+from starlette.requests import Request
+from starlette.responses import Response, JSONResponse
+from starlette.status import HTTP_403_FORBIDDEN, HTTP_304_NOT_MODIFIED
 from fastapi import APIRouter, HTTPException
 
 from cdb_database import (
     user as user_db,
-    collection as collection_db
+    collection as collection_db,
 )
 
-from .db import Database, transaction
+from .db import Database, transaction, DatabaseRoute
 from .user import current_user
 
 
-router = APIRouter()
+router = APIRouter(route_class=DatabaseRoute)
+
+
+def collection_etag(
+    collection_id: int,
+    version: int,
+    logged_user: user_db.UserDb,
+) -> str:
+    """Returns the ETag of the responses derived from a collection at
+    `version` (see `cdb_database.resolver.resolve_path`).
+
+    It changes whenever the collection, its fields or its items change. The
+    logged user is part of it as responses depend on their rights.
+    """
+
+    return f'"{collection_id}-{version}-{logged_user.id}"'
+
+
+def etag_headers(etag: str) -> dict:
+    return {
+        "ETag": etag,
+        "Vary": "Authorization",
+    }
+
+
+def not_modified(request: Request, etag: str) -> Response:
+    """Returns a 304 response if the `If-None-Match` header of `request`
+    matches `etag`, None otherwise."""
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return None
+
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag or tag == "*":
+            return Response(
+                status_code = HTTP_304_NOT_MODIFIED,
+                headers = etag_headers(etag),
+            )
+
+    return None
 
 
 @router.get(
@@ -37,18 +82,31 @@ router = APIRouter()
     response_model = List[collection_db.Collection],
     tags = ["collection"],
     summary = "Get the (visible) collections owned by a user",
+    description =
+        "`fields` restricts the returned values to a comma-separated list "
+        "of fields, like `name,title`.",
 )
 async def get_collections(
     username: str,
+    fields: str = None,
     logged_user: user_db.UserDb = current_user,
     db: Database = transaction,
 ):
-    user = await user_db.get_user(
-        db,
-        username = username,
+    user = await db.loader.user_by_name(
+        username,
         include_disabled = logged_user.is_admin,
     )
 
+    if fields is not None:
+        return JSONResponse(await collection_db.get_projected_collections(
+            db,
+            logged_user = logged_user,
+            user_id = user.id,
+            projection = fields.split(","),
+            include_private = user.id == logged_user.id or logged_user.is_admin,
+            include_deleted = logged_user.is_admin,
+        ))
+
     return await collection_db.get_collections(
         db,
         logged_user = logged_user,
@@ -63,27 +121,35 @@ async def get_collections(
     response_model = collection_db.Collection,
     tags = ["collection"],
     summary = "Get a collection along with its items",
+    description =
+        "The response has an `ETag`, that changes whenever the collection, "
+        "its fields or its items change. A request with a matching "
+        "`If-None-Match` header gets an empty 304 response.",
 )
 async def get_collection(
     username: str,
     collection_name: str,
     logged_user: user_db.UserDb = current_user,
     db: Database = transaction,
+    request: Request = None,
+    response: Response = None,
 ):
-    user = await user_db.get_user(
-        db,
-        username = username,
-        include_disabled = logged_user.is_admin,
+    # This is also called directly by the other routes, without request.
+    resolved = await db.loader.resolve_path(
+        logged_user,
+        username,
+        collection_name,
     )
+    collection = resolved.collection
 
-    return await collection_db.get_collection(
-        db,
-        logged_user = logged_user,
-        user_id = user.id,
-        collection_name = collection_name,
-        include_private = user.id == logged_user.id or logged_user.is_admin,
-        include_deleted = logged_user.is_admin,
-    )
+    if request is not None:
+        etag = collection_etag(collection.id, resolved.version, logged_user)
+        response_304 = not_modified(request, etag)
+        if response_304 is not None:
+            return response_304
+        response.headers.update(etag_headers(etag))
+
+    return collection
 
 
 @router.post(
@@ -99,9 +165,8 @@ async def create_collection(
     logged_user: user_db.UserDb = current_user,
     db: Database = transaction,
 ):
-    user = await user_db.get_user(
-        db,
-        username = username,
+    user = await db.loader.user_by_name(
+        username,
         include_disabled = logged_user.is_admin,
     )
 
@@ -139,19 +204,11 @@ async def update_collection(
     logged_user: user_db.UserDb = current_user,
     db: Database = transaction,
 ):
-    user = await user_db.get_user(
+    collection = await get_collection(
+        username,
+        collection_name,
+        logged_user,
         db,
-        username = username,
-        include_disabled = logged_user.is_admin,
-    )
-
-    collection = await collection_db.get_collection(
-        db,
-        logged_user = logged_user,
-        user_id = user.id,
-        collection_name = collection_name,
-        include_private = user.id == logged_user.id or logged_user.is_admin,
-        include_deleted = logged_user.is_admin,
     )
 
     if not collection.can_edit:
@@ -178,19 +235,11 @@ async def delete_collection(
     logged_user: user_db.UserDb = current_user,
     db: Database = transaction,
 ):
-    user = await user_db.get_user(
-        db,
-        username = username,
-        include_disabled = logged_user.is_admin,
-    )
-
-    collection = await collection_db.get_collection(
+    collection = await get_collection(
+        username,
+        collection_name,
+        logged_user,
         db,
-        logged_user = logged_user,
-        user_id = user.id,
-        collection_name = collection_name,
-        include_private = user.id == logged_user.id or logged_user.is_admin,
-        include_deleted = logged_user.is_admin,
     )
 
     if logged_user.id != collection.owner and not logged_user.is_admin:
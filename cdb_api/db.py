@@ -15,9 +15,22 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from contextvars import ContextVar
+from typing import List, Optional
+import asyncio
+import functools
+import itertools
+import re
+
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
 from fastapi import Depends
+from fastapi.routing import APIRoute
 
 from cdb_database import Database
+from cdb_database.error import InvalidQueryError
+from cdb_database.loader import Loader
+from cdb_database.statements import statement_cache
 
 from . import settings
 from .utils import logger
@@ -26,9 +39,13 @@ from .utils import logger
 database_url = None
 database = None
 
+# Read replicas of `database`, used in turn by the read-only requests.
+replicas = []  # type: List[Database]
+_next_replica = None
+
 
 async def setup_database():
-    global database, database_url
+    global database, database_url, _next_replica
 
     assert database is None
 
@@ -43,23 +60,385 @@ async def setup_database():
 
     await database.connect()
 
+    if not settings.test:
+        for replica_url in settings.replica_urls:
+            logger.info(f"Connect to replica {replica_url!r}...")
+            replica = Database(replica_url)
+            await replica.connect()
+            replicas.append(replica)
+
+    _next_replica = itertools.cycle(replicas)
+
 
 async def teardown_database():
-    global database
+    global database, _next_replica
 
     assert database is not None
 
+    for replica in replicas:
+        await replica.disconnect()
+    replicas.clear()
+    _next_replica = None
+
     await database.disconnect()
 
+    stats = statement_cache.stats()
+    logger.info(
+        f"Statement cache: {stats['size']} statements, {stats['hits']} hits, "
+        f"{stats['misses']} misses."
+    )
+
     database = None
 
 
-async def get_db_transaction():
-    if not settings.test:
-        async with database.transaction():
-            yield database
+def next_replica() -> Optional[Database]:
+    """Returns the replica the next read-only request should use, or None if
+    there are no replicas."""
+
+    return next(_next_replica) if replicas else None
+
+
+# HTTP methods of the requests that are read only by default.
+READ_ONLY_METHODS = frozenset(["GET", "HEAD"])
+
+# Consistent snapshot that never waits for locks nor aborts because of
+# serialization failures, see the documentation of SET TRANSACTION.
+READ_ONLY_SNAPSHOT = (
+    "SET TRANSACTION ISOLATION LEVEL SERIALIZABLE, READ ONLY, DEFERRABLE"
+)
+
+ISOLATION_LEVELS = frozenset([
+    "READ COMMITTED",
+    "REPEATABLE READ",
+    "SERIALIZABLE",
+])
+
+# Hot standbys do not support serializable transactions.
+REPLICA_SNAPSHOT = "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"
+
+# Responses to the requests that wrote to the primary have this header, with
+# the position in the WAL of their commit. Clients sending it back with their
+# next requests are sure to read their writes: replicas are only used once
+# they have replayed the WAL up to this position.
+CONSISTENCY_TOKEN_HEADER = "X-Consistency-Token"
+
+CONSISTENCY_TOKEN_REGEX = re.compile(r"^[0-9A-Fa-f]{1,8}/[0-9A-Fa-f]{1,8}$")
+
+COMMIT_LSN_QUERY = "SELECT pg_current_wal_insert_lsn()::text AS lsn"
+
+REPLAYED_LSN_QUERY = """
+    SELECT
+        CASE WHEN pg_is_in_recovery()
+            THEN pg_last_wal_replay_lsn()
+            ELSE pg_current_wal_lsn()
+        END >= CAST(CAST(:lsn AS text) AS pg_lsn) AS replayed
+"""
+
+
+_request_database = ContextVar("request_database", default=None)
+
+
+def _begin_first(name: str):
+    """Returns a method forwarding `name` to the database once the
+    transaction of the request is started."""
+
+    async def method(self, *args, **kwargs):
+        await self.begin()
+        return await getattr(self._database, name)(*args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+class RequestDatabase:
+    """The database as used by a request: forwards everything to `database`,
+    and has a `loader` memoizing the lookups of users and collections for the
+    life of the request.
+
+    No connection is checked out of the pool until the first query, which
+    starts the transaction of the request, at the `isolation` level if set.
+    If `read_only` is set, it is a read-only snapshot (see
+    READ_ONLY_SNAPSHOT), on `replica` if set. The primary is used instead if
+    the replica has not replayed the WAL up to `min_lsn` yet.
+
+    `release` ends the transaction; queries after that run in their own
+    transaction. If `track_lsn` is set, committing a transaction of the
+    primary sets `consistency_token`, and its header in `response`.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        *,
+        replica: Database = None,
+        read_only: bool = False,
+        isolation: str = None,
+        min_lsn: str = None,
+        track_lsn: bool = False,
+        use_transaction: bool = True,
+        response: Response = None,
+    ):
+        self._primary = database
+        self._database = replica if replica is not None else database
+        # Not acquired yet. Gets the connections of the task now, so that the
+        # tasks started by the request share them.
+        self._primary_connection = database.connection()
+        self._connection = self._database.connection()
+        self._read_only = read_only
+        self._isolation = isolation
+        self._min_lsn = min_lsn
+        self._track_lsn = track_lsn
+        self._use_transaction = use_transaction
+        self._response = response
+        self._transaction = None
+        self._released = False
+        self._lock = asyncio.Lock()
+        self.consistency_token = None  # type: Optional[str]
+        self.loader = Loader(self)
+
+    @property
+    def read_only(self) -> bool:
+        return self._read_only
+
+    @property
+    def on_replica(self) -> bool:
+        return self._database is not self._primary
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._transaction is not None
+
+    async def _start(self, snapshot: Optional[str], min_lsn: str = None):
+        """Starts a transaction with `snapshot`. Returns None, without a
+        transaction, if the database has not replayed the WAL up to
+        `min_lsn`."""
+
+        async with self._connection:
+            # Checked before the transaction: its snapshot is taken by its
+            # first statement, and must come after the replay of `min_lsn`.
+            if min_lsn is not None and not await self._replayed(min_lsn):
+                return None
+
+            transaction = await self._connection.transaction().start()
+            try:
+                if snapshot is not None:
+                    await self._connection.execute(snapshot)
+            except BaseException:
+                await transaction.rollback()
+                raise
+
+        return transaction
+
+    async def _replayed(self, lsn: str) -> bool:
+        row = await self._connection.fetch_one(
+            REPLAYED_LSN_QUERY,
+            dict(lsn=lsn),
+        )
+        return row["replayed"]
+
+    async def begin(self):
+        """Checks out a connection and starts the transaction of the request,
+        unless already done or released."""
+
+        async with self._lock:
+            if (
+                not self._use_transaction
+                or self._released
+                or self._transaction is not None
+            ):
+                return
+
+            if self.on_replica:
+                self._transaction = await self._start(
+                    REPLICA_SNAPSHOT,
+                    self._min_lsn,
+                )
+                if self._transaction is not None:
+                    return
+
+                # The replica is behind the last write of the client.
+                self._database = self._primary
+                self._connection = self._primary_connection
+
+            self._transaction = await self._start(self._snapshot())
+
+    def _snapshot(self) -> Optional[str]:
+        """Returns the SET TRANSACTION statement of the primary, if any."""
+
+        if self._isolation is None:
+            return READ_ONLY_SNAPSHOT if self._read_only else None
+
+        snapshot = f"SET TRANSACTION ISOLATION LEVEL {self._isolation}"
+        if self._read_only:
+            snapshot += ", READ ONLY"
+        return snapshot
+
+    async def release(self, *, commit: bool = True):
+        """Commits (or rolls back) the transaction of the request and returns
+        its connection to the pool."""
+
+        async with self._lock:
+            self._released = True
+            transaction, self._transaction = self._transaction, None
+
+            if transaction is None:
+                return
+            if not commit:
+                await transaction.rollback()
+            elif self._track_lsn and not self._read_only:
+                # Keeps the connection to read the position of the commit.
+                async with self._connection:
+                    await transaction.commit()
+                    row = await self._connection.fetch_one(COMMIT_LSN_QUERY)
+                self.consistency_token = row["lsn"]
+                if self._response is not None:
+                    self._response.headers[CONSISTENCY_TOKEN_HEADER] = (
+                        self.consistency_token
+                    )
+            else:
+                await transaction.commit()
+
+    fetch_all = _begin_first("fetch_all")
+    fetch_one = _begin_first("fetch_one")
+    fetch_val = _begin_first("fetch_val")
+    execute = _begin_first("execute")
+    execute_many = _begin_first("execute_many")
+    all = _begin_first("all")
+    one = _begin_first("one")
+    fetch_cached = _begin_first("fetch_cached")
+    one_cached = _begin_first("one_cached")
+    all_cached = _begin_first("all_cached")
+
+    async def stream(self, *args, **kwargs):
+        await self.begin()
+        async for row in self._database.stream(*args, **kwargs):
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+
+def transaction_policy(*, read_only: bool, isolation: str = None):
+    """Decorator setting the transaction policy of an endpoint, instead of
+    the default one based on the method of the request (READ_ONLY_METHODS).
+    `isolation` is one of ISOLATION_LEVELS.
+
+    Must be applied before (below) the route decorator.
+    """
+
+    if isolation is not None and isolation not in ISOLATION_LEVELS:
+        raise ValueError(f"Invalid isolation level: {isolation!r}")
+
+    def decorator(endpoint):
+        endpoint.read_only = read_only
+        endpoint.isolation = isolation
+        return endpoint
+
+    return decorator
+
+
+async def _release_after_stream(body, request_database: RequestDatabase):
+    try:
+        async for chunk in body:
+            yield chunk
+    except BaseException:
+        await request_database.release(commit=False)
+        raise
+    else:
+        await request_database.release()
+
+
+def release_after(endpoint):
+    """Wraps `endpoint` so that the database of the request is released as
+    soon as it returns, before its response is serialized and sent.
+
+    The body of a StreamingResponse may still read the database, so it is
+    released once the body is sent instead. The consistency token of such a
+    response is not sent, as its headers are sent before.
+    """
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        request_database = _request_database.get()
+
+        try:
+            response = await endpoint(*args, **kwargs)
+        except BaseException:
+            if request_database is not None:
+                await request_database.release(commit=False)
+            raise
+
+        if request_database is None:
+            return response
+
+        if isinstance(response, StreamingResponse):
+            response.body_iterator = _release_after_stream(
+                response.body_iterator,
+                request_database,
+            )
+            return response
+
+        await request_database.release()
+
+        token = request_database.consistency_token
+        if token is not None and isinstance(response, Response):
+            # Returned as is, without the headers of the dependencies.
+            response.headers[CONSISTENCY_TOKEN_HEADER] = token
+
+        return response
+
+    return wrapper
+
+
+class DatabaseRoute(APIRoute):
+    """Route class releasing the database of the request when the endpoint
+    returns, see `release_after`."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, release_after(endpoint), **kwargs)
+
+
+def _consistency_token(request: Request) -> Optional[str]:
+    token = request.headers.get(CONSISTENCY_TOKEN_HEADER)
+    if token is not None and not CONSISTENCY_TOKEN_REGEX.match(token):
+        raise InvalidQueryError(
+            f"Invalid {CONSISTENCY_TOKEN_HEADER} header: {token!r}"
+        )
+    return token
+
+
+async def get_db_transaction(request: Request, response: Response):
+    # FastAPI caches dependencies for the life of a request, so all the
+    # dependencies of a request share the same RequestDatabase.
+    endpoint = request.scope.get("endpoint")
+    read_only = getattr(
+        endpoint,
+        "read_only",
+        request.method in READ_ONLY_METHODS,
+    )
+    isolation = getattr(endpoint, "isolation", None)
+    use_replica = read_only and isolation != "SERIALIZABLE"
+
+    request_database = RequestDatabase(
+        database,
+        replica = next_replica() if use_replica else None,
+        read_only = read_only,
+        isolation = isolation,
+        min_lsn = _consistency_token(request),
+        track_lsn = bool(replicas),
+        use_transaction = not settings.test,
+        response = response,
+    )
+    _request_database.set(request_database)
+
+    try:
+        yield request_database
+    except BaseException:
+        await request_database.release(commit=False)
+        raise
     else:
-        yield database
+        # Usually already released by the route, see DatabaseRoute.
+        await request_database.release()
 
 
 transaction = Depends(get_db_transaction)
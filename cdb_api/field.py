@@ -17,8 +17,10 @@
 
 from typing import List
 
+from starlette.requests import Request
+from starlette.responses import Response, JSONResponse
 from starlette.status import HTTP_403_FORBIDDEN
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 
 from cdb_database import (
     user as user_db,
@@ -26,12 +28,17 @@ from cdb_database import (
     field as field_db,
 )
 
-from .db import Database, transaction
+from .db import Database, transaction, DatabaseRoute
 from .user import current_user
-from .collection import get_collection
+from .collection import (
+    get_collection,
+    collection_etag,
+    etag_headers,
+    not_modified,
+)
 
 
-router = APIRouter()
+router = APIRouter(route_class=DatabaseRoute)
 
 
 @router.get(
@@ -39,19 +46,41 @@ router = APIRouter()
     response_model = List[field_db.FieldDb],
     tags = ["field"],
     summary = "Get the fields of a collection",
+    description =
+        "With `since`, only the fields created, updated or deleted after "
+        "that revision are returned, as `{revision, fields}`: `revision` is "
+        "the value of `since` to use for the next request.",
 )
 async def get_fields(
     username: str,
     collection_name: str,
+    request: Request,
+    response: Response,
+    since: int = Query(None, ge=0),
     logged_user: user_db.UserDb = current_user,
     db: Database = transaction,
 ):
-    collection = await get_collection(
+    resolved = await db.loader.resolve_path(
+        logged_user,
         username,
         collection_name,
-        logged_user,
-        db,
     )
+    collection = resolved.collection
+
+    etag = collection_etag(collection.id, resolved.version, logged_user)
+    response_304 = not_modified(request, etag)
+    if response_304 is not None:
+        return response_304
+    response.headers.update(etag_headers(etag))
+
+    if since is not None:
+        delta = await field_db.get_field_delta(db, collection.id, since)
+
+        # The response model does not apply to deltas.
+        return JSONResponse(
+            delta.dict(by_alias=True),
+            headers = etag_headers(etag),
+        )
 
     return await field_db.get_fields(
         db,
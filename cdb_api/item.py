@@ -15,23 +15,112 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from typing import List
+from typing import AsyncIterator, List, Optional, Tuple
+import json
 
-from starlette.status import HTTP_403_FORBIDDEN
-from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Schema, ValidationError
+from starlette.requests import Request
+from starlette.responses import Response, JSONResponse, StreamingResponse
+from starlette.status import HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN
+from fastapi import APIRouter, HTTPException, Query
 
 from cdb_database import (
     user as user_db,
     collection as collection_db,
-    item as item_db
+    field as field_db,
+    item as item_db,
+    history as history_db,
 )
 
-from .db import Database, transaction
+from .db import Database, transaction, transaction_policy, DatabaseRoute
 from .user import current_user
-from .collection import get_collection
+from .collection import (
+    get_collection,
+    collection_etag,
+    etag_headers,
+    not_modified,
+)
+from .stream import (
+    NDJSON_MEDIA_TYPE,
+    encode_stream,
+    formats_regex,
+    ndjson_lines,
+)
+
+
+router = APIRouter(route_class=DatabaseRoute)
+
+
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Number of items inserted by each statement of a bulk creation.
+BULK_BATCH_SIZE = 1000
+
+
+class CollectionSnapshot(BaseModel):
+    collection: collection_db.Collection
+    # `fields` is a BaseModel attribute.
+    fields_: List[field_db.FieldDb] = Schema(..., alias="fields")
+    items: List[item_db.ItemDb]
+    next_cursor: str = None
+
+
+class BulkItemError(BaseModel):
+    index: int
+    name: str = None
+    detail: str
+
+
+class BulkCreateResult(BaseModel):
+    created: int
+    errors: List[BulkItemError]
+
+
+class BulkDeleteResult(BaseModel):
+    deleted: int
+
 
+def _parse_bulk_item(value) -> Tuple[Optional[item_db.ItemIn], Optional[str]]:
+    try:
+        return item_db.ItemIn.parse_obj(value), None
+    except ValidationError as error:
+        return None, str(error)
 
-router = APIRouter()
+
+async def _read_bulk_items(
+    request: Request,
+) -> AsyncIterator[Tuple[object, Optional[item_db.ItemIn], Optional[str]]]:
+    """Yields the raw value, the parsed item and the error message of each
+    item of a bulk request body."""
+
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith(NDJSON_MEDIA_TYPE):
+        async for line in ndjson_lines(request.stream()):
+            try:
+                value = json.loads(line)
+            except ValueError as error:
+                yield None, None, f"Invalid JSON: {error}"
+                continue
+            yield (value, *_parse_bulk_item(value))
+
+    else:
+        try:
+            values = await request.json()
+        except ValueError:
+            raise HTTPException(
+                status_code = HTTP_400_BAD_REQUEST,
+                detail = "The request body is not valid JSON.",
+            )
+
+        if not isinstance(values, list):
+            raise HTTPException(
+                status_code = HTTP_400_BAD_REQUEST,
+                detail = "The request body must be an array of items.",
+            )
+
+        for value in values:
+            yield (value, *_parse_bulk_item(value))
 
 
 @router.get(
@@ -39,24 +128,243 @@ router = APIRouter()
     response_model = List[item_db.ItemDb],
     tags = ["item"],
     summary = "Get the items of a collection",
+    description =
+        "Items are ordered by title, or by relevance if a search query `q` "
+        "is given. `filter` restricts the items to the ones matching a "
+        "filter expression on the collection fields, like "
+        "`index > 5 and title ~ \"foo\"`. `sort` is a comma-separated list "
+        "of field names, prefixed by `-` for descending order. `fields` "
+        "restricts the returned values to a comma-separated list of paths, "
+        "like `name,title,properties.index`. If `limit` is set, the cursor "
+        "of the next page (if any) is returned in the `X-Next-Cursor` "
+        "header. With `stream=ndjson` or `stream=json`, all the items are "
+        "streamed as newline-delimited JSON or as a JSON array. With "
+        "`since`, only the items created, updated or deleted after that "
+        "revision are returned, as `{revision, items}`: `revision` is the "
+        "value of `since` to use for the next request. The "
+        "response has the `ETag` of the collection, see "
+        "`GET /users/{username}/collections/{collection_name}`.",
 )
 async def get_items(
     username: str,
     collection_name: str,
+    request: Request,
+    response: Response,
+    q: str = None,
+    filter_: str = Query(None, alias="filter"),
+    sort: str = None,
+    fields: str = None,
+    cursor: str = None,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: str = Query(None, regex=formats_regex),
+    since: int = Query(None, ge=0),
     logged_user: user_db.UserDb = current_user,
     db: Database = transaction,
 ):
-    collection = await get_collection(
+    resolved = await db.loader.resolve_path(
+        logged_user,
         username,
         collection_name,
+    )
+    collection = resolved.collection
+
+    etag = collection_etag(collection.id, resolved.version, logged_user)
+    response_304 = not_modified(request, etag)
+    if response_304 is not None:
+        return response_304
+
+    if since is not None:
+        if any(param is not None for param in (q, filter_, sort, fields,
+                                                cursor, stream)):
+            raise HTTPException(
+                status_code = HTTP_400_BAD_REQUEST,
+                detail = "`since` can only be combined with `limit`.",
+            )
+
+        delta = await item_db.get_item_delta(
+            db,
+            collection.id,
+            since,
+            limit = limit,
+            redact_deleted = not logged_user.is_admin,
+        )
+
+        # The response model does not apply to deltas.
+        return JSONResponse(delta.dict(), headers=etag_headers(etag))
+
+    if stream is not None:
+        if limit is not None:
+            raise HTTPException(
+                status_code = HTTP_400_BAD_REQUEST,
+                detail = "Streamed listings can not be paginated.",
+            )
+
+        rows = await item_db.iterate_items(
+            db,
+            collection.id,
+            projection = fields.split(",") if fields is not None else None,
+            search = q,
+            filter = filter_,
+            sort = sort,
+            cursor = cursor,
+            include_deleted = logged_user.is_admin,
+        )
+        content, media_type = encode_stream(stream, rows)
+
+        return StreamingResponse(
+            content,
+            media_type = media_type,
+            headers = etag_headers(etag),
+        )
+
+    if fields is None:
+        page = await item_db.get_item_page(
+            db,
+            collection.id,
+            search = q,
+            filter = filter_,
+            sort = sort,
+            cursor = cursor,
+            limit = limit,
+            include_deleted = logged_user.is_admin,
+        )
+
+        response.headers.update(etag_headers(etag))
+        if page.next_cursor is not None:
+            response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+
+        return page.items
+
+    page = await item_db.get_projected_item_page(
+        db,
+        collection.id,
+        fields.split(","),
+        search = q,
+        filter = filter_,
+        sort = sort,
+        cursor = cursor,
+        limit = limit,
+        include_deleted = logged_user.is_admin,
+    )
+
+    # Partial items are returned as is, the response model does not apply.
+    response = JSONResponse(page.items, headers=etag_headers(etag))
+    if page.next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+
+    return response
+
+
+@router.get(
+    "/users/{username}/collections/{collection_name}/snapshot",
+    response_model = CollectionSnapshot,
+    tags = ["collection"],
+    summary = "Get a collection along with its fields and items",
+    description =
+        "Returns in a single request what a collection page needs: the "
+        "collection, its ordered fields and a page of its items. `q`, "
+        "`filter`, `sort`, `cursor` and `limit` select the items like for "
+        "the items listing. The response has the `ETag` of the collection.",
+)
+# The collection, fields and items are read from the same snapshot.
+@transaction_policy(read_only=True, isolation="REPEATABLE READ")
+async def get_collection_snapshot(
+    username: str,
+    collection_name: str,
+    request: Request,
+    response: Response,
+    q: str = None,
+    filter_: str = Query(None, alias="filter"),
+    sort: str = None,
+    cursor: str = None,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    logged_user: user_db.UserDb = current_user,
+    db: Database = transaction,
+):
+    resolved = await db.loader.resolve_path(
         logged_user,
+        username,
+        collection_name,
+    )
+    collection = resolved.collection
+
+    etag = collection_etag(collection.id, resolved.version, logged_user)
+    response_304 = not_modified(request, etag)
+    if response_304 is not None:
+        return response_304
+    response.headers.update(etag_headers(etag))
+
+    fields = await field_db.get_fields(
+        db,
+        collection.id,
+        include_deleted = logged_user.is_admin,
+    )
+
+    page = await item_db.get_item_page(
         db,
+        collection.id,
+        search = q,
+        filter = filter_,
+        sort = sort,
+        cursor = cursor,
+        limit = limit,
+        include_deleted = logged_user.is_admin,
+    )
+
+    return dict(
+        collection = collection,
+        fields = fields,
+        items = page.items,
+        next_cursor = page.next_cursor,
     )
 
-    return await item_db.get_items(
+
+@router.get(
+    "/users/{username}/collections/{collection_name}/items:facets",
+    response_model = List[item_db.Facet],
+    tags = ["item"],
+    summary = "Get the distribution of field values among items",
+    description =
+        "Returns a facet for each `field`: numeric fields get their count, "
+        "min, max, average and an histogram of `buckets` buckets, other "
+        "fields get the `size` most common values with their count. `q` "
+        "and `filter` select the items like for the items listing.",
+)
+async def get_item_facets(
+    username: str,
+    collection_name: str,
+    request: Request,
+    response: Response,
+    field: List[str] = Query(...),
+    q: str = None,
+    filter_: str = Query(None, alias="filter"),
+    size: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    buckets: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    logged_user: user_db.UserDb = current_user,
+    db: Database = transaction,
+):
+    resolved = await db.loader.resolve_path(
+        logged_user,
+        username,
+        collection_name,
+    )
+    collection = resolved.collection
+
+    etag = collection_etag(collection.id, resolved.version, logged_user)
+    response_304 = not_modified(request, etag)
+    if response_304 is not None:
+        return response_304
+    response.headers.update(etag_headers(etag))
+
+    return await item_db.get_item_facets(
         db,
         collection.id,
+        field,
+        search = q,
+        filter = filter_,
         include_deleted = logged_user.is_admin,
+        size = size,
+        buckets = buckets,
     )
 
 
@@ -70,21 +378,90 @@ async def get_item(
     username: str,
     collection_name: str,
     item_name: str,
+    request: Request,
+    response: Response,
     logged_user: user_db.UserDb = current_user,
     db: Database = transaction,
 ):
-    collection = await get_collection(
+    resolved = await db.loader.resolve_path(
+        logged_user,
         username,
         collection_name,
+        item_name = item_name,
+    )
+    collection = resolved.collection
+
+    etag = collection_etag(collection.id, resolved.version, logged_user)
+    response_304 = not_modified(request, etag)
+    if response_304 is not None:
+        return response_304
+    response.headers.update(etag_headers(etag))
+
+    return resolved.item
+
+
+@router.get(
+    "/users/{username}/collections/{collection_name}/items/{item_name}/history",
+    response_model = List[history_db.ItemRevision],
+    tags = ["item"],
+    summary = "List the revisions of an item",
+    description =
+        "Returns the revisions of the item, most recent first. The first one "
+        "is the current revision. Pass the last revision of a page as "
+        "`before` to get the next one.",
+)
+async def get_item_history(
+    username: str,
+    collection_name: str,
+    item_name: str,
+    before: int = None,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    logged_user: user_db.UserDb = current_user,
+    db: Database = transaction,
+):
+    resolved = await db.loader.resolve_path(
         logged_user,
+        username,
+        collection_name,
+        item_name = item_name,
+    )
+    item = resolved.item
+
+    return await history_db.get_item_history(
         db,
+        item.id,
+        before = before,
+        limit = limit,
+    )
+
+
+@router.get(
+    "/users/{username}/collections/{collection_name}/items/{item_name}"
+    "/history/{revision}",
+    response_model = item_db.ItemDb,
+    tags = ["item"],
+    summary = "Get a past version of an item",
+)
+async def get_item_version(
+    username: str,
+    collection_name: str,
+    item_name: str,
+    revision: int,
+    logged_user: user_db.UserDb = current_user,
+    db: Database = transaction,
+):
+    resolved = await db.loader.resolve_path(
+        logged_user,
+        username,
+        collection_name,
+        item_name = item_name,
     )
+    item = resolved.item
 
-    return await item_db.get_item(
+    return await history_db.get_item_version(
         db,
-        collection.id,
-        item_name,
-        include_deleted = logged_user.is_admin,
+        item.id,
+        revision,
     )
 
 
@@ -122,6 +499,116 @@ async def create_item(
     )
 
 
+@router.post(
+    "/users/{username}/collections/{collection_name}/items:bulk",
+    response_model = BulkCreateResult,
+    tags = ["item"],
+    summary = "Create many items",
+    description =
+        "The body is either a JSON array of items or, with the "
+        "`application/x-ndjson` content type, one item per line. Valid "
+        "items are created in the same transaction. Items that are invalid "
+        "or whose name is already used are skipped and reported in "
+        "`errors`, by index in the body.",
+)
+async def create_items(
+    username: str,
+    collection_name: str,
+    request: Request,
+    logged_user: user_db.UserDb = current_user,
+    db: Database = transaction,
+):
+    collection = await get_collection(
+        username,
+        collection_name,
+        logged_user,
+        db,
+    )
+
+    if not collection.can_edit and not logged_user.is_admin:
+        raise HTTPException(HTTP_403_FORBIDDEN,
+            "You don't have create rights on this collection.")
+
+    result = BulkCreateResult(created=0, errors=[])
+    batch = []
+
+    async def insert_batch():
+        ids = await item_db.create_items(
+            db,
+            collection.id,
+            [item for _, item in batch],
+        )
+        for (index, item), item_id in zip(batch, ids):
+            if item_id is None:
+                result.errors.append(BulkItemError(
+                    index = index,
+                    name = item.name,
+                    detail = "An item with this name already exists.",
+                ))
+            else:
+                result.created += 1
+        batch.clear()
+
+    index = 0
+    async for value, item, error in _read_bulk_items(request):
+        if error is not None:
+            name = value.get("name") if isinstance(value, dict) else None
+            result.errors.append(BulkItemError(
+                index = index,
+                name = name if isinstance(name, str) else None,
+                detail = error,
+            ))
+        else:
+            batch.append((index, item))
+            if len(batch) >= BULK_BATCH_SIZE:
+                await insert_batch()
+        index += 1
+
+    if batch:
+        await insert_batch()
+
+    result.errors.sort(key=lambda error: error.index)
+    return result
+
+
+@router.patch(
+    "/users/{username}/collections/{collection_name}/items:bulk",
+    response_model = List[item_db.ItemDb],
+    tags = ["item"],
+    summary = "Update many items",
+    description =
+        "Applies a list of `{name, changes}` entries in a single statement "
+        "and returns the updated items. Unset values in `changes` are left "
+        "unchanged and unknown item names are ignored.",
+)
+async def update_items(
+    username: str,
+    collection_name: str,
+    updates: List[item_db.ItemBatchUpdate],
+    logged_user: user_db.UserDb = current_user,
+    db: Database = transaction,
+):
+    collection = await get_collection(
+        username,
+        collection_name,
+        logged_user,
+        db,
+    )
+
+    if not collection.can_edit:
+        raise HTTPException(
+            status_code = HTTP_403_FORBIDDEN,
+            detail = "You don't have edit rights on these items."
+        )
+
+    return await item_db.update_items(
+        db,
+        collection.id,
+        updates,
+        include_deleted = logged_user.is_admin,
+    )
+
+
 @router.put(
     "/users/{username}/collections/{collection_name}/items/{item_name}",
     response_model = item_db.ItemDb,
@@ -136,12 +623,13 @@ async def update_item(
     logged_user: user_db.UserDb = current_user,
     db: Database = transaction,
 ):
-    collection = await get_collection(
+    resolved = await db.loader.resolve_path(
+        logged_user,
         username,
         collection_name,
-        logged_user,
-        db,
+        item_name = item_name,
     )
+    collection = resolved.collection
 
     if not collection.can_edit:
         raise HTTPException(
@@ -149,12 +637,7 @@ async def update_item(
             detail = "You don't have edit rights on this item."
         )
 
-    item = await item_db.get_item(
-        db,
-        collection.id,
-        item_name,
-        include_deleted = logged_user.is_admin,
-    )
+    item = resolved.item
 
     return await item_db.update_item(
         db,
@@ -163,15 +646,21 @@ async def update_item(
     )
 
 
-@router.delete(
+@router.patch(
     "/users/{username}/collections/{collection_name}/items/{item_name}",
+    response_model = item_db.ItemDb,
     tags = ["item"],
-    summary = "Delete an item",
+    summary = "Patch an item",
+    description =
+        "Applies a JSON Merge Patch to the item, without reading it first: "
+        "`properties` is merged into the current properties, `null` values "
+        "removing keys. Unset name and title are left unchanged.",
 )
-async def delete_item(
+async def patch_item(
     username: str,
     collection_name: str,
     item_name: str,
+    patch: item_db.ItemPatch,
     logged_user: user_db.UserDb = current_user,
     db: Database = transaction,
 ):
@@ -185,16 +674,46 @@ async def delete_item(
     if not collection.can_edit:
         raise HTTPException(
             status_code = HTTP_403_FORBIDDEN,
-            detail = "You don't have delete rights on this item."
+            detail = "You don't have edit rights on this item."
         )
 
-    item = await item_db.get_item(
+    return await item_db.patch_item(
         db,
         collection.id,
         item_name,
+        patch,
         include_deleted = logged_user.is_admin,
     )
 
+
+@router.delete(
+    "/users/{username}/collections/{collection_name}/items/{item_name}",
+    tags = ["item"],
+    summary = "Delete an item",
+)
+async def delete_item(
+    username: str,
+    collection_name: str,
+    item_name: str,
+    logged_user: user_db.UserDb = current_user,
+    db: Database = transaction,
+):
+    resolved = await db.loader.resolve_path(
+        logged_user,
+        username,
+        collection_name,
+        item_name = item_name,
+    )
+    collection = resolved.collection
+
+    if not collection.can_edit:
+        raise HTTPException(
+            status_code = HTTP_403_FORBIDDEN,
+            detail = "You don't have delete rights on this item."
+        )
+
+    item = resolved.item
+
     await item_db.delete_item(
         db,
         item.id,
@@ -203,3 +722,42 @@ async def delete_item(
     return dict(
         detail = "Item deleted successfully."
     )
+
+
+@router.post(
+    "/users/{username}/collections/{collection_name}/items:delete",
+    response_model = BulkDeleteResult,
+    tags = ["item"],
+    summary = "Delete many items",
+    description =
+        "Deletes the items whose name is in `names` and/or that match the "
+        "filter expression `filter`, in a single statement. At least one "
+        "of them must be set. Returns the number of deleted items.",
+)
+async def delete_items(
+    username: str,
+    collection_name: str,
+    selection: item_db.ItemSelection,
+    logged_user: user_db.UserDb = current_user,
+    db: Database = transaction,
+):
+    collection = await get_collection(
+        username,
+        collection_name,
+        logged_user,
+        db,
+    )
+
+    if not collection.can_edit:
+        raise HTTPException(
+            status_code = HTTP_403_FORBIDDEN,
+            detail = "You don't have delete rights on these items."
+        )
+
+    deleted = await item_db.delete_items(
+        db,
+        collection.id,
+        selection,
+    )
+
+    return BulkDeleteResult(deleted=deleted)
@@ -0,0 +1,94 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import timedelta
+import asyncio
+
+from cdb_database.purge import purge
+
+from . import settings, db
+from .utils import logger
+
+
+# Pause between two purge batches, in seconds.
+PURGE_PAUSE = 0.1
+
+# Key of the advisory lock that prevents several API processes from purging
+# at the same time.
+PURGE_LOCK_KEY = 0x63646270
+
+_purge_task = None
+
+
+async def purge_once():
+    database = db.database
+
+    async with database.connection() as connection:
+        locked = await connection.fetch_val(
+            f"SELECT pg_try_advisory_lock({PURGE_LOCK_KEY}) AS locked",
+            column = "locked",
+        )
+        if not locked:
+            logger.info("Purge skipped, another process is purging.")
+            return
+
+        try:
+            counts = await purge(
+                database,
+                timedelta(days=settings.purge_delay_in_days),
+                pause = PURGE_PAUSE,
+            )
+        finally:
+            await connection.execute(
+                f"SELECT pg_advisory_unlock({PURGE_LOCK_KEY})")
+
+    logger.info("Purged " + ", ".join(
+        f"{count} {table}"
+        for table, count in counts.items()
+    ))
+
+
+async def run_purges():
+    while True:
+        await asyncio.sleep(settings.purge_interval_in_minutes * 60)
+        try:
+            await purge_once()
+        except Exception:
+            logger.exception("Purge failed.")
+
+
+def start_purge_task():
+    global _purge_task
+
+    assert _purge_task is None
+
+    _purge_task = asyncio.ensure_future(run_purges())
+
+
+async def stop_purge_task():
+    global _purge_task
+
+    if _purge_task is None:
+        return
+
+    _purge_task.cancel()
+    try:
+        await _purge_task
+    except asyncio.CancelledError:
+        pass
+
+    _purge_task = None
@@ -16,7 +16,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import databases
-from starlette.datastructures import Secret
+from starlette.datastructures import Secret, CommaSeparatedStrings
 from starlette.config import Config
 
 
@@ -45,6 +45,17 @@ database_url = config(
     cast = databases.DatabaseURL,
 )
 
+# Comma-separated URLs of read replicas of CDB_DATABASE. Read-only requests
+# are sent to them, except in test mode.
+replica_urls = [
+    databases.DatabaseURL(url)
+    for url in config(
+        "CDB_REPLICA_DATABASES",
+        cast = CommaSeparatedStrings,
+        default = "",
+    )
+]
+
 test_database_url = config(
     "CDB_TEST_DATABASE",
     cast = databases.DatabaseURL,
@@ -66,3 +77,26 @@ token_algorithm = config(
     cast = str,
     default = "HS256",
 )
+
+# Soft-deleted rows are purged this many days after their deletion.
+purge_delay_in_days = config(
+    "CDB_PURGE_DELAY_IN_DAYS",
+    cast = int,
+    default = 30,
+)
+
+# The API purges soft-deleted rows every this many minutes. 0 disables it,
+# in which case `python -m cdb_api purge` should be run periodically.
+purge_interval_in_minutes = config(
+    "CDB_PURGE_INTERVAL_IN_MINUTES",
+    cast = int,
+    default = 0,
+)
+
+# Number of processes encoding large exports. 0 encodes them in the API
+# process.
+export_processes = config(
+    "CDB_EXPORT_PROCESSES",
+    cast = int,
+    default = 2,
+)
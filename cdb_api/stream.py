@@ -0,0 +1,183 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from typing import AsyncIterable, AsyncIterator, List, Sequence
+import codecs
+import csv
+import io
+import json
+
+
+# Encoded rows are buffered up to this size before being sent, to avoid
+# sending one tiny chunk per row.
+CHUNK_SIZE = 64 * 1024
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+JSON_MEDIA_TYPE = "application/json"
+CSV_MEDIA_TYPE = "text/csv"
+
+
+def _encode(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+async def _chunks(parts: AsyncIterable[str]) -> AsyncIterator[bytes]:
+    buffer = []
+    size = 0
+    async for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer).encode("utf-8")
+            buffer = []
+            size = 0
+
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+async def _ndjson_parts(rows: AsyncIterable) -> AsyncIterator[str]:
+    async for row in rows:
+        yield _encode(row) + "\n"
+
+
+async def _json_array_parts(rows: AsyncIterable) -> AsyncIterator[str]:
+    separator = "["
+    async for row in rows:
+        yield separator + _encode(row)
+        separator = ",\n"
+
+    yield "[]" if separator == "[" else "]"
+
+
+def ndjson_stream(rows: AsyncIterable) -> AsyncIterator[bytes]:
+    """Encodes `rows` as newline-delimited JSON, incrementally."""
+
+    return _chunks(_ndjson_parts(rows))
+
+
+def json_array_stream(rows: AsyncIterable) -> AsyncIterator[bytes]:
+    """Encodes `rows` as a JSON array, incrementally."""
+
+    return _chunks(_json_array_parts(rows))
+
+
+_formats = {
+    "ndjson": (ndjson_stream, NDJSON_MEDIA_TYPE),
+    "json": (json_array_stream, JSON_MEDIA_TYPE),
+}
+
+formats_regex = "^({})$".format("|".join(_formats))
+
+
+def encode_stream(format: str, rows: AsyncIterable):
+    """Returns the encoded stream of `rows` in `format`, and its media type.
+    """
+
+    encoder, media_type = _formats[format]
+    return encoder(rows), media_type
+
+
+async def ndjson_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """Splits a newline-delimited JSON byte stream into lines, skipping blank
+    lines. Lines are not decoded, so that invalid ones can be reported
+    individually."""
+
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line.decode("utf-8", errors="replace")
+
+    if buffer.strip():
+        yield buffer.decode("utf-8", errors="replace")
+
+
+async def csv_records(
+    chunks: AsyncIterable[bytes],
+) -> AsyncIterator[List[str]]:
+    """Splits a CSV byte stream into records, incrementally, skipping blank
+    lines.
+
+    A record ends at the first line break outside of quotes, so that quoted
+    values can contain line breaks. Raises csv.Error for malformed records.
+    """
+
+    # utf-8-sig skips the byte order mark spreadsheets often write.
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+
+    buffer = ""
+    lines = []
+    quotes = 0
+
+    def parse():
+        return next(csv.reader(line + "\n" for line in lines))
+
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *complete, buffer = buffer.split("\n")
+        for line in complete:
+            lines.append(line)
+            quotes += line.count('"')
+            if quotes % 2 == 0:
+                if any(line.strip() for line in lines):
+                    yield parse()
+                lines = []
+
+    lines.append(buffer + decoder.decode(b"", final=True))
+    if any(line.strip() for line in lines):
+        yield parse()
+
+
+def _csv_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (str, int, float)):
+        return str(value)
+    return _encode(value)
+
+
+def encode_csv_rows(rows: Sequence[Sequence]) -> bytes:
+    """Encodes `rows` as CSV records. Objects and arrays are encoded as
+    JSON."""
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+    return output.getvalue().encode("utf-8")
+
+
+def encode_ndjson_rows(
+    columns: Sequence[str],
+    rows: Sequence[Sequence],
+) -> bytes:
+    """Encodes `rows` as newline-delimited JSON objects, keyed by `columns`.
+    Null values are omitted."""
+
+    return "".join(
+        _encode({
+            column: value
+            for column, value in zip(columns, row)
+            if value is not None
+        }) + "\n"
+        for row in rows
+    ).encode("utf-8")
@@ -0,0 +1,325 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from typing import (
+    Any, AsyncIterable, AsyncIterator, List, Mapping, Optional, Sequence,
+)
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from urllib.parse import quote
+import asyncio
+import csv
+import json
+
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+from starlette.status import HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN
+from fastapi import APIRouter, HTTPException, Query
+
+from cdb_database import (
+    user as user_db,
+    transfer as transfer_db,
+)
+from cdb_database.error import InvalidQueryError
+
+from . import settings
+from .db import Database, transaction, DatabaseRoute
+from .user import current_user
+from .collection import get_collection
+from .stream import (
+    CSV_MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    csv_records,
+    encode_csv_rows,
+    encode_ndjson_rows,
+    ndjson_lines,
+)
+
+
+router = APIRouter(route_class=DatabaseRoute)
+
+
+# Number of rows encoded at once by exports. Rows are ordered by id, so each
+# batch is a range of ids.
+EXPORT_BATCH_SIZE = 10000
+
+# Maximum number of batches being encoded by the export pool at once.
+EXPORT_PENDING_BATCHES = 8
+
+_export_pool = None
+
+
+_media_types = {
+    "csv": CSV_MEDIA_TYPE,
+    "ndjson": NDJSON_MEDIA_TYPE,
+}
+
+transfer_formats_regex = "^({})$".format("|".join(_media_types))
+
+
+def format_from_media_type(content_type: str) -> str:
+    """Returns the format of a Content-Type header, or None."""
+
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    for format, format_media_type in _media_types.items():
+        if media_type == format_media_type:
+            return format
+    return None
+
+
+async def _csv_rows(
+    chunks: AsyncIterable[bytes],
+) -> AsyncIterator[Mapping[str, str]]:
+    records = csv_records(chunks)
+    try:
+        columns = None
+        line = 1
+        async for record in records:
+            if columns is None:
+                columns = record
+                continue
+            line += 1
+            if len(record) != len(columns):
+                raise InvalidQueryError(
+                    f"Line {line}: expected {len(columns)} values, "
+                    f"got {len(record)}."
+                )
+            yield dict(zip(columns, record))
+    except csv.Error as error:
+        raise InvalidQueryError(f"Invalid CSV: {error}.")
+
+
+async def _ndjson_rows(
+    chunks: AsyncIterable[bytes],
+) -> AsyncIterator[Mapping[str, Any]]:
+    line = 0
+    async for text in ndjson_lines(chunks):
+        line += 1
+        try:
+            row = json.loads(text)
+        except ValueError:
+            raise InvalidQueryError(f"Line {line}: invalid JSON.")
+        if not isinstance(row, dict):
+            raise InvalidQueryError(f"Line {line}: expected an object.")
+        yield row
+
+
+def import_rows(
+    format: str,
+    chunks: AsyncIterable[bytes],
+) -> AsyncIterator[Mapping[str, Any]]:
+    """Parses the rows of an import in `format`, incrementally.
+
+    The first CSV record is the header. NDJSON rows are objects.
+    """
+
+    if format == "csv":
+        return _csv_rows(chunks)
+    return _ndjson_rows(chunks)
+
+
+@router.post(
+    "/users/{username}/collections/{collection_name}/import",
+    response_model = transfer_db.ImportResult,
+    tags = ["item"],
+    summary = "Import items",
+    description =
+        "Creates or updates items from a CSV file (with a header) or from "
+        "NDJSON objects, streamed in the request body. The format is given "
+        "by `format` or by the Content-Type. Columns named like a field are "
+        "stored at the path of the field, `name` and `title` are the item "
+        "columns and other columns are stored as properties. Existing items "
+        "are updated, their properties being merged with the imported ones, "
+        "and deleted items are restored with the imported properties only. "
+        "The import is atomic: an invalid row fails it entirely.",
+)
+async def import_items(
+    username: str,
+    collection_name: str,
+    request: Request,
+    format: str = Query(None, regex=transfer_formats_regex),
+    logged_user: user_db.UserDb = current_user,
+    db: Database = transaction,
+):
+    collection = await get_collection(
+        username,
+        collection_name,
+        logged_user,
+        db,
+    )
+
+    if not collection.can_edit:
+        raise HTTPException(
+            status_code = HTTP_403_FORBIDDEN,
+            detail = "You don't have edit rights on this collection."
+        )
+
+    if format is None:
+        format = format_from_media_type(request.headers.get("Content-Type"))
+    if format is None:
+        raise HTTPException(
+            status_code = HTTP_400_BAD_REQUEST,
+            detail = "Unknown import format.",
+        )
+
+    return await transfer_db.import_items(
+        db,
+        collection.id,
+        import_rows(format, request.stream()),
+        from_text = format == "csv",
+    )
+
+
+def get_export_pool() -> Optional[ProcessPoolExecutor]:
+    """Returns the process pool encoding large exports, or None if it is
+    disabled (see `settings.export_processes`)."""
+
+    global _export_pool
+
+    if _export_pool is None and settings.export_processes > 0:
+        _export_pool = ProcessPoolExecutor(settings.export_processes)
+
+    return _export_pool
+
+
+def shutdown_export_pool():
+    global _export_pool
+
+    if _export_pool is not None:
+        _export_pool.shutdown()
+        _export_pool = None
+
+
+def encode_rows(
+    format: str,
+    columns: Sequence[str],
+    rows: Sequence[Sequence],
+) -> bytes:
+    if format == "csv":
+        return encode_csv_rows(rows)
+    return encode_ndjson_rows(columns, rows)
+
+
+async def export_stream(
+    format: str,
+    columns: List[str],
+    rows: AsyncIterable[tuple],
+    *,
+    pool: Executor = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> AsyncIterator[bytes]:
+    """Encodes the rows of an export in `format`, batch by batch.
+
+    The first batch is encoded in the event loop. If there are more (large
+    collections) and `pool` is set, the next ones are encoded by the
+    processes of `pool`, several at once, while the following rows are
+    fetched. Batches are yielded in order.
+    """
+
+    loop = asyncio.get_event_loop()
+
+    if format == "csv":
+        yield encode_csv_rows([columns])
+
+    pending = deque()
+    batch = []
+    first = True
+
+    async def flush(batch):
+        nonlocal first
+
+        if pool is None or first:
+            first = False
+            return [encode_rows(format, columns, batch)]
+
+        pending.append(loop.run_in_executor(
+            pool,
+            encode_rows,
+            format,
+            columns,
+            batch,
+        ))
+        encoded = []
+        while len(pending) >= EXPORT_PENDING_BATCHES:
+            encoded.append(await pending.popleft())
+        return encoded
+
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            for chunk in await flush(batch):
+                yield chunk
+            batch = []
+
+    if batch:
+        for chunk in await flush(batch):
+            yield chunk
+
+    while pending:
+        yield await pending.popleft()
+
+
+def attachment_disposition(filename: str) -> str:
+    """Returns the Content-Disposition of an attachment named `filename`.
+
+    Headers are latin-1, so the name is given as UTF-8 in `filename*`
+    (RFC 6266), with an ASCII fallback for older clients.
+    """
+
+    fallback = "".join(
+        char if " " <= char <= "~" and char not in '"\\' else "_"
+        for char in filename
+    )
+    return (
+        f'attachment; filename="{fallback}"; '
+        f"filename*=UTF-8''{quote(filename, safe='')}"
+    )
+
+
+@router.get(
+    "/users/{username}/collections/{collection_name}/export",
+    tags = ["item"],
+    summary = "Export items",
+    description =
+        "Streams the items of the collection as CSV (with a header) or as "
+        "NDJSON objects. The columns are the name and the title of the "
+        "items, then the fields of the collection. Exports can be imported "
+        "back.",
+)
+async def export_items(
+    username: str,
+    collection_name: str,
+    format: str = Query("csv", regex=transfer_formats_regex),
+    logged_user: user_db.UserDb = current_user,
+    db: Database = transaction,
+):
+    collection = await get_collection(
+        username,
+        collection_name,
+        logged_user,
+        db,
+    )
+
+    columns, rows = await transfer_db.export_items(db, collection.id)
+
+    return StreamingResponse(
+        export_stream(format, columns, rows, pool=get_export_pool()),
+        media_type = _media_types[format],
+        headers = {
+            "Content-Disposition":
+                attachment_disposition(f"{collection.name}.{format}"),
+        },
+    )
@@ -30,14 +30,14 @@ from cdb_database import user as user_db
 from cdb_database.error import NotFoundError
 
 from . import settings
-from .db import Database, transaction
+from .db import Database, transaction, DatabaseRoute
 
 
 password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=settings.api_prefix + "/token")
 
-router = APIRouter()
+router = APIRouter(route_class=DatabaseRoute)
 
 
 class Token(BaseModel):
@@ -110,7 +110,7 @@ async def get_current_user_unchecked(
         user_id = None
 
     if user_id is not None:
-        user = await user_db.get_user(db, user_id=user_id)
+        user = await db.loader.user(user_id)
     else:
         user = None
 
@@ -240,13 +240,14 @@ async def get_user(
     logged_user: user_db.UserDb = current_user,
     db: Database = transaction,
 ):
-    target_user = await user_db.get_user(
-        db,
-        username = username,
+    target_user = await db.loader.user_by_name(
+        username,
         include_disabled = logged_user.is_admin,
     )
 
     if target_user.id == logged_user.id:
+        # The user is shared with the other lookups of the request.
+        target_user = target_user.copy()
         del target_user.disabled
     elif not logged_user.is_admin:
         target_user = strip_user_info(target_user)
@@ -24,6 +24,7 @@ from . import (
     item,
 )
 from .error import NotFoundError
+from .statements import statement_cache
 
 
 def _identity(row):
@@ -52,6 +53,50 @@ class Database(databases.Database):
             for row in rows
         ]
 
+    async def fetch_cached(self, key, build, values: dict) -> list:
+        """Like `fetch_all(build(), values)`, but the query is built and
+        compiled once per `key` (see `cdb_database.statements`)."""
+
+        statement = statement_cache.get(key, build, self._backend._dialect)
+        arguments = statement.arguments(values)
+
+        async with self.connection() as connection:
+            async with connection._query_lock:
+                rows = await connection.raw_connection.fetch(
+                    statement.sql,
+                    *arguments,
+                )
+
+        return [statement.record(row) for row in rows]
+
+    async def one_cached(self, key, build, values: dict, wrapper=_identity):
+        """Like `one`, with a cached query (see `fetch_cached`)."""
+
+        rows = await self.fetch_cached(key, build, values)
+
+        assert len(rows) < 2
+
+        if not rows:
+            raise NotFoundError("Collection does not exist.")
+
+        return wrapper(rows[0])
+
+    async def all_cached(self, key, build, values: dict, wrapper=_identity):
+        """Like `all`, with a cached query (see `fetch_cached`)."""
+
+        return [
+            wrapper(row)
+            for row in await self.fetch_cached(key, build, values)
+        ]
+
+    async def stream(self, query, wrapper=_identity):
+        """Like `all`, but yields the rows one by one as they are fetched
+        through a server-side cursor, so memory usage does not depend on the
+        number of rows."""
+
+        async for row in super().iterate(query):
+            yield wrapper(row)
+
 
 def create_tables(engine):
     schema.metadata.create_all(engine)
@@ -19,17 +19,20 @@ from typing import List, Union
 from pydantic import BaseModel
 
 from sqlalchemy import (
-    select, and_, or_,
+    select, and_, or_, func, literal, bindparam,
+    Boolean,
 )
+from sqlalchemy.sql import ClauseElement
 from databases import Database
 
 from .tables import (
     UserDb, CollectionDb,
     users, collections, user_collections,
 )
-from .error import convert_error, ForbiddenError
+from .error import convert_error, ForbiddenError, NotFoundError
 from .user import get_user_query
 from .utils import raise_if_all_none
+from .expression import parse_projection, projection_columns, project_row
 
 
 class CollectionIn(BaseModel):
@@ -112,7 +115,7 @@ async def link_user_to_collection(
     collection_id = int,
     can_edit = True,
 ) -> int:
-    return await database.execute(
+    result = await database.execute(
         user_collections.insert(),
         dict(
             user_id = user_id,
@@ -121,9 +124,69 @@ async def link_user_to_collection(
         ),
     )
 
+    await bump_collection_version(database, collection_id)
+
+    return result
+
+
+async def lock_collection(
+    database: Database,
+    collection_id: Union[int, ClauseElement],
+):
+    """Locks a collection until the end of the transaction. `collection_id`
+    may be an SQL expression, like the collection of an item.
+
+    Writes stamping fields or items with a revision must call it first, in
+    the same transaction: the revisions of a collection are then taken in
+    commit order, so that a delta never skips a revision committed after it
+    was read (see `get_item_delta`).
+    """
+
+    query = (
+        select([collections.c.id])
+        .where(collections.c.id == collection_id)
+        .with_for_update(key_share=True)
+    )
+
+    await database.execute(query)
+
+
+async def bump_collection_version(
+    database: Database,
+    collection_id: int,
+):
+    """Increments the version of a collection. Must be called by every write
+    to a collection, its fields or its items."""
+
+    query = (
+        collections.update()
+        .where(collections.c.id == collection_id)
+        .values(version = collections.c.version + 1)
+    )
+
+    await database.execute(query)
+
+
+async def get_collection_version(
+    database: Database,
+    collection_id: int,
+) -> int:
+    """Returns the current version of a collection."""
+
+    query = (
+        select([collections.c.version])
+        .where(collections.c.id == collection_id)
+    )
+
+    version = await database.fetch_val(query)
+    if version is None:
+        raise NotFoundError("Collection does not exist.")
+
+    return version
+
 
 def get_user_collections_query(
-    logged_user: UserDb,
+    logged_user_id: int,
     user_id: int,
     *,
     collection_name: str = None,
@@ -138,7 +201,7 @@ def get_user_collections_query(
                 user_collections,
                 and_(
                     collections.c.id == user_collections.c.collection_id,
-                    user_collections.c.user_id == logged_user.id,
+                    user_collections.c.user_id == logged_user_id,
                 )
             )
         )
@@ -177,16 +240,26 @@ async def get_collection(
     include_deleted: bool = False,
 ) -> Collection:
 
-    query = get_user_collections_query(
-        logged_user = logged_user,
-        user_id = user_id,
-        collection_name = collection_name,
-        only_owned = only_owned,
-        include_private = include_private,
-        include_deleted = include_deleted,
-    )
+    def build():
+        return get_user_collections_query(
+            logged_user_id = bindparam("logged_user_id"),
+            user_id = bindparam("user_id"),
+            collection_name = bindparam("collection_name"),
+            only_owned = only_owned,
+            include_private = include_private,
+            include_deleted = include_deleted,
+        )
 
-    return await database.one(query, Collection.wrapper(logged_user))
+    return await database.one_cached(
+        ("get_collection", only_owned, include_private, include_deleted),
+        build,
+        dict(
+            logged_user_id = logged_user.id,
+            user_id = user_id,
+            collection_name = collection_name,
+        ),
+        Collection.wrapper(logged_user),
+    )
 
 
 async def get_collections(
@@ -200,18 +273,78 @@ async def get_collections(
     order_by_title: bool = True,
 ) -> List[Collection]:
 
-    query = get_user_collections_query(
-        logged_user,
-        user_id = user_id,
-        only_owned = only_owned,
-        include_private = include_private,
-        include_deleted = include_deleted,
+    def build():
+        query = get_user_collections_query(
+            logged_user_id = bindparam("logged_user_id"),
+            user_id = bindparam("user_id"),
+            only_owned = only_owned,
+            include_private = include_private,
+            include_deleted = include_deleted,
+        )
+
+        if order_by_title:
+            query = query.order_by(collections.c.title)
+
+        return query
+
+    return await database.all_cached(
+        (
+            "get_collections",
+            only_owned,
+            include_private,
+            include_deleted,
+            order_by_title,
+        ),
+        build,
+        dict(
+            logged_user_id = logged_user.id,
+            user_id = user_id,
+        ),
+        Collection.wrapper(logged_user),
+    )
+
+
+async def get_projected_collections(
+    database: Database,
+    logged_user: UserDb,
+    user_id: int,
+    projection: List[str],
+    *,
+    only_owned: bool = True,
+    include_private: bool = False,
+    include_deleted: bool = False,
+    order_by_title: bool = True,
+) -> List[dict]:
+    """Like `get_collections`, but only returns the collection fields in
+    `projection`."""
+
+    projection = parse_projection(projection)
+
+    can_edit = func.coalesce(
+        user_collections.c.can_edit,
+        literal(logged_user.is_admin, Boolean),
+    )
+
+    query = (
+        get_user_collections_query(
+            logged_user.id,
+            user_id = user_id,
+            only_owned = only_owned,
+            include_private = include_private,
+            include_deleted = include_deleted,
+        )
+        .with_only_columns(projection_columns(
+            collections,
+            projection,
+            set(Collection.__fields__) - {"can_edit"},
+            dict(can_edit=can_edit),
+        ))
     )
 
     if order_by_title:
         query = query.order_by(collections.c.title)
 
-    return await database.all(query, Collection.wrapper(logged_user))
+    return await database.all(query, lambda row: project_row(row, projection))
 
 
 def update_collection_query(
@@ -222,6 +355,7 @@ def update_collection_query(
         collections.update()
         .returning(collections)
         .where(collections.c.id == collection_id)
+        .values(version = collections.c.version + 1)
     )
 
 
@@ -250,7 +384,10 @@ async def delete_collection(
             database,
             collection_id = collection_id,
         )
-        .values(deleted = True)
+        .values(
+            deleted = True,
+            deleted_at = func.now(),
+        )
     )
 
     await database.one(query)
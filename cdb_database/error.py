@@ -42,6 +42,11 @@ class ForbiddenError(CdbDatabaseError):
         super().__init__(*args)
 
 
+class InvalidQueryError(CdbDatabaseError):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
 def convert_error(func: Callable):
     if iscoroutinefunction(func):
         @wraps(func)
@@ -0,0 +1,310 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from typing import Any, Iterable, List, Mapping, Sequence
+import json
+
+from sqlalchemy import (
+    case, cast, literal, literal_column, func, null,
+    Boolean, BigInteger, Float, Numeric, UnicodeText, JSON,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+
+from .tables import FieldDb
+from .error import InvalidQueryError
+
+
+# Maps FieldDb.type to the SQL type values are cast to, and to the JSON type
+# a value must have to be cast.
+_field_type_map = {
+    "string": (UnicodeText, None),
+    "text": (UnicodeText, None),
+    "int": (BigInteger, "number"),
+    "integer": (BigInteger, "number"),
+    "float": (Float, "number"),
+    "number": (Float, "number"),
+    "bool": (Boolean, "boolean"),
+    "boolean": (Boolean, "boolean"),
+}
+
+# The item columns that can be referenced directly by a field path.
+item_path_columns = {"id", "name", "title"}
+
+
+def sql_string(value: str):
+    """Returns `value` as an inline SQL string literal.
+
+    Paths are rendered inline instead of as bound parameters so that the
+    expressions can be matched against expression indexes.
+    """
+
+    return literal_column("'{}'".format(value.replace("'", "''")))
+
+
+def field_sql_type(type_name: str):
+    """Returns the SQL type used for fields of type `type_name`."""
+
+    return _field_type_map.get(type_name, (UnicodeText, None))[0]
+
+
+def field_is_numeric(type_name: str) -> bool:
+    """Returns True if fields of type `type_name` hold numbers."""
+
+    return field_sql_type(type_name) in (BigInteger, Float)
+
+
+def json_path(column, keys: Sequence[str], *, as_text: bool = False):
+    """Returns the expression extracting the value at `keys` in the JSON
+    `column`, as JSON or as text."""
+
+    expression = column
+    for index, key in enumerate(keys):
+        if as_text and index == len(keys) - 1:
+            expression = expression.op("->>", return_type=UnicodeText)(
+                sql_string(key))
+        else:
+            expression = expression.op("->", return_type=column.type)(
+                sql_string(key))
+    return expression
+
+
+def json_typeof(column, expression):
+    if isinstance(column.type, JSONB):
+        return func.jsonb_typeof(expression, type_=UnicodeText)
+    return func.json_typeof(expression, type_=UnicodeText)
+
+
+def split_path(table, path: str, allowed_columns=item_path_columns):
+    """Splits `path` in a column of `table` and a list of keys inside this
+    column.
+
+    Only the columns in `allowed_columns` can be referenced directly.
+    """
+
+    column_name, *keys = path.split(".")
+
+    if keys:
+        if column_name not in table.c or any(not key for key in keys):
+            raise InvalidQueryError(f"Invalid field path {path!r}.")
+        column = table.c[column_name]
+        if not isinstance(column.type, JSON):
+            raise InvalidQueryError(f"Invalid field path {path!r}.")
+    else:
+        if column_name not in allowed_columns:
+            raise InvalidQueryError(f"Invalid field path {path!r}.")
+        column = table.c[column_name]
+
+    return column, keys
+
+
+def parse_projection(paths: Iterable[str]) -> List[str]:
+    """Normalizes a list of paths to project: removes duplicates and the
+    paths already included in another one (like `properties.a` and
+    `properties`)."""
+
+    paths = [path.strip() for path in paths if path.strip()]
+    if not paths:
+        raise InvalidQueryError("At least one field must be selected.")
+
+    result = []
+    for path in paths:
+        if path in result:
+            continue
+        if any(path.startswith(other + ".") for other in paths):
+            continue
+        result.append(path)
+
+    return result
+
+
+def _projection_label(index: int) -> str:
+    return f"_field_{index}"
+
+
+def projection_columns(
+    table,
+    paths: List[str],
+    allowed_columns,
+    extra_columns: Mapping[str, Any] = None,
+) -> list:
+    """Returns the columns to select to get the values at `paths` in a row
+    of `table`.
+
+    `allowed_columns` are the columns (or column names) that can be
+    selected. `extra_columns` maps other names to the expression to select.
+    JSON sub-paths are extracted by Postgres, so that only the requested
+    values are transferred.
+    """
+
+    extra_columns = extra_columns or {}
+    allowed_names = {
+        getattr(column, "name", column)
+        for column in allowed_columns
+    }
+
+    columns = []
+    for index, path in enumerate(paths):
+        if path in extra_columns:
+            expression = extra_columns[path]
+        else:
+            column, keys = split_path(table, path, allowed_names)
+            expression = json_path(column, keys) if keys else column
+        columns.append(expression.label(_projection_label(index)))
+
+    return columns
+
+
+def project_row(row: Mapping, paths: List[str]) -> dict:
+    """Builds a (nested) dict from a row selected with `projection_columns`.
+    """
+
+    result = {}
+    for index, path in enumerate(paths):
+        *parents, key = path.split(".")
+        target = result
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[key] = row[_projection_label(index)]
+
+    return result
+
+
+def path_expression(table, path: str, type_name: str = None):
+    """Returns the expression of the value at `path` in a row of `table`,
+    cast to the SQL type of `type_name`.
+
+    Values of an unexpected JSON type evaluate to NULL instead of making the
+    whole query fail.
+    """
+
+    column, keys = split_path(table, path)
+    if not keys:
+        return column
+
+    sql_type, json_type = _field_type_map.get(type_name, (UnicodeText, None))
+
+    text = json_path(column, keys, as_text=True)
+    if json_type is None:
+        return text
+
+    if sql_type is BigInteger:
+        value = cast(cast(text, Numeric), BigInteger)
+    else:
+        value = cast(text, sql_type)
+
+    return case(
+        [(
+            json_typeof(column, json_path(column, keys))
+                == literal_column(f"'{json_type}'"),
+            value,
+        )],
+        else_ = null(),
+    )
+
+
+def path_contains(table, path: str, value: Any):
+    """Returns the condition `column @> {...: value}` testing that the JSONB
+    value at `path` in a row of `table` is `value`, or None if `path` is not
+    in a JSONB column.
+
+    This condition can use GIN indexes, unlike the equivalent comparison on
+    `path_expression`.
+    """
+
+    column, keys = split_path(table, path)
+    if not keys or not isinstance(column.type, JSONB):
+        return None
+
+    document = value
+    for key in reversed(keys):
+        document = {key: document}
+
+    return column.contains(literal(document, JSONB))
+
+
+def field_expression(table, field: FieldDb):
+    """Returns the typed expression of `field` in a row of `table`."""
+
+    return path_expression(table, field.field, field.type)
+
+
+def find_field(fields: List[FieldDb], name: str) -> FieldDb:
+    """Returns the field called `name`.
+
+    The item columns (`name`, `title`...) are always available, even if the
+    collection does not declare a field for them.
+    """
+
+    for field in fields:
+        if field.name == name:
+            return field
+
+    if name in item_path_columns:
+        return FieldDb(
+            id = 0,
+            collection = 0,
+            name = name,
+            field = name,
+            label = name,
+            type = "int" if name == "id" else "string",
+            sort_index = -1,
+        )
+
+    raise InvalidQueryError(f"Unknown field {name!r}.")
+
+
+def merge_patch_expression(target, patch: Any):
+    """Returns the JSONB expression applying the JSON Merge Patch (RFC 7396)
+    `patch` to the JSONB expression `target`.
+
+    The patch is known when the query is built, so it is unrolled into plain
+    `-` and `||` operations: only the patched keys are read and written.
+    """
+
+    if not isinstance(patch, dict):
+        return cast(literal(json.dumps(patch), UnicodeText), JSONB)
+
+    expression = case(
+        [(func.jsonb_typeof(target) == "object", target)],
+        else_ = cast(literal_column("'{}'"), JSONB),
+    )
+
+    removed = [key for key, value in patch.items() if value is None]
+    if removed:
+        expression = expression.op("-", return_type=JSONB)(
+            cast(literal(removed, ARRAY(UnicodeText)), ARRAY(UnicodeText)))
+
+    updated = [
+        (key, value)
+        for key, value in patch.items()
+        if value is not None
+    ]
+    if updated:
+        arguments = []
+        for key, value in updated:
+            # Keys are typed explicitly, `->` and jsonb_build_object accept
+            # several types.
+            key = cast(literal(key, UnicodeText), UnicodeText)
+            arguments.append(key)
+            arguments.append(merge_patch_expression(
+                target.op("->", return_type=JSONB)(key),
+                value,
+            ))
+        expression = expression.op("||", return_type=JSONB)(
+            func.jsonb_build_object(*arguments, type_=JSONB))
+
+    return expression
@@ -16,19 +16,20 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from typing import List, Union
-from pydantic import BaseModel
+from pydantic import BaseModel, Schema
 
 from sqlalchemy import (
-    select, and_, or_,
+    select, and_, or_, func, bindparam,
     ForeignKey, PrimaryKeyConstraint, UniqueConstraint,
 )
 from databases import Database
 
 from .tables import (
     FieldDb,
-    fields,
+    fields, revision_sequence,
 )
 from .error import convert_error
+from .collection import lock_collection, bump_collection_version
 
 
 class FieldIn(BaseModel):
@@ -59,6 +60,26 @@ class FieldUpdate(BaseModel):
     width: float
 
 
+class FieldDelta(BaseModel):
+    """The fields changed since a revision, and the revision to ask for
+    next."""
+
+    revision: int
+    # `fields` is a BaseModel attribute.
+    fields_: List[FieldDb] = Schema(..., alias="fields")
+
+
+def field_collection(field_id: int):
+    """Returns the collection of the field `field_id`, as an SQL
+    expression."""
+
+    return (
+        select([fields.c.collection])
+        .where(fields.c.id == field_id)
+        .as_scalar()
+    )
+
+
 @convert_error
 async def create_field(
     database: Database,
@@ -67,8 +88,12 @@ async def create_field(
     params = field.dict(exclude={"id"})
     params.setdefault("deleted", False)
 
+    await lock_collection(database, params["collection"])
+
     id = await database.execute(fields.insert(), params)
 
+    await bump_collection_version(database, params["collection"])
+
     return FieldDb(
         id = id,
         **params,
@@ -103,9 +128,44 @@ async def get_fields(
     order_by_title: bool = True,
 ) -> List[FieldDb]:
 
-    query = get_field_query(collection_id, include_deleted=include_deleted)
+    def build():
+        return get_field_query(
+            bindparam("collection_id"),
+            include_deleted = include_deleted,
+        )
+
+    return await database.all_cached(
+        ("get_fields", include_deleted),
+        build,
+        dict(collection_id=collection_id),
+        FieldDb.from_row,
+    )
 
-    return await database.all(query, FieldDb.from_row)
+
+async def get_field_delta(
+    database: Database,
+    collection_id: int,
+    since: int,
+) -> FieldDelta:
+    """Returns the fields created, updated or deleted after the revision
+    `since`, ordered by revision."""
+
+    query = (
+        get_field_query(
+            collection_id,
+            include_deleted = True,
+            order_by_title = False,
+        )
+        .where(fields.c.revision > since)
+        .order_by(fields.c.revision)
+    )
+
+    rows = await database.fetch_all(query)
+
+    return FieldDelta(
+        revision = rows[-1]["revision"] if rows else since,
+        fields = [FieldDb.from_row(row) for row in rows],
+    )
 
 
 async def get_field(
@@ -116,13 +176,22 @@ async def get_field(
     include_deleted: bool = False,
 ) -> List[FieldDb]:
 
-    query = (
-        get_field_query(collection_id, include_deleted=include_deleted)
-        .where(fields.c.name == field_name)
+    def build():
+        return (
+            get_field_query(
+                bindparam("collection_id"),
+                include_deleted = include_deleted,
+            )
+            .where(fields.c.name == bindparam("field_name"))
+        )
+
+    return await database.one_cached(
+        ("get_field", include_deleted),
+        build,
+        dict(collection_id=collection_id, field_name=field_name),
+        FieldDb.from_row,
     )
 
-    return await database.one(query, FieldDb.from_row)
-
 
 async def update_field(
     database: Database,
@@ -130,26 +199,43 @@ async def update_field(
     value: FieldUpdate,
 ) -> FieldDb:
 
+    await lock_collection(database, field_collection(field_id))
+
     query = (
         fields.update()
         .returning(fields)
         .where(fields.c.id == field_id)
-        .values(**value.dict(include={"name", "field", "label", "type", "sort_index", "width"}))
+        .values(
+            **value.dict(include={"name", "field", "label", "type", "sort_index", "width"}),
+            revision = revision_sequence.next_value(),
+        )
     )
 
-    return await database.one(query, FieldDb.from_row)
+    field = await database.one(query, FieldDb.from_row)
+
+    await bump_collection_version(database, field.collection)
 
+    return field
 
-async def delete_item(
+
+async def delete_field(
     database: Database,
     field_id: int,
 ) -> FieldDb:
 
+    await lock_collection(database, field_collection(field_id))
+
     query = (
         fields.update()
         .returning(fields)
         .where(fields.c.id == field_id)
-        .values(deleted = True)
+        .values(
+            deleted = True,
+            deleted_at = func.now(),
+            revision = revision_sequence.next_value(),
+        )
     )
 
-    await database.one(query)
+    field = await database.one(query)
+
+    await bump_collection_version(database, field["collection"])
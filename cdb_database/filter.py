@@ -0,0 +1,282 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""A small query language to filter items on their fields.
+
+Examples:
+
+    index > 5 and title ~ "foo"
+    not (publisher = "Foo" or year <= 1980)
+    cover != null
+
+A condition compares a field (resolved through the collection fields) with a
+literal: a number, a double-quoted string, `true`, `false` or `null`. Bare
+words are considered as strings. `~` tests if a field contains a string,
+case-insensitively.
+"""
+
+from typing import Any, List, NamedTuple
+import json
+import re
+
+from sqlalchemy import (
+    and_, or_, not_, cast, literal,
+    Boolean, BigInteger, Float, UnicodeText,
+)
+
+from .tables import FieldDb
+from .error import InvalidQueryError
+from .expression import (
+    field_expression,
+    field_sql_type,
+    find_field,
+    path_contains,
+)
+
+
+class Token(NamedTuple):
+    kind: str
+    value: Any
+    position: int
+
+
+_token_re = re.compile(r"""
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*")
+      | (?P<number>-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)
+      | (?P<operator><=|>=|!=|!~|==|=|<|>|~)
+      | (?P<paren>[()])
+      | (?P<word>[A-Za-z_]\w*)
+    )
+""", re.VERBOSE)
+
+_keywords = {"and", "or", "not", "true", "false", "null"}
+
+
+def tokenize(source: str) -> List[Token]:
+    tokens = []
+    position = 0
+    end = len(source.rstrip())
+
+    while position < end:
+        match = _token_re.match(source, position)
+        if match is None:
+            raise InvalidQueryError(
+                f"Invalid filter: unexpected character at {position}.")
+
+        kind = match.lastgroup
+        text = match.group(kind)
+        start = match.start(kind)
+
+        if kind == "string":
+            try:
+                value = json.loads(text)
+            except ValueError:
+                raise InvalidQueryError(
+                    f"Invalid filter: invalid string at {start}.")
+        elif kind == "number":
+            value = float(text) if re.search(r"[.eE]", text) else int(text)
+        elif kind == "paren":
+            kind = text
+            value = text
+        elif kind == "word" and text.lower() in _keywords:
+            kind = text.lower()
+            value = text
+        else:
+            value = text
+
+        tokens.append(Token(kind, value, start))
+        position = match.end()
+
+    tokens.append(Token("end", None, len(source)))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, source: str, table, fields: List[FieldDb]):
+        self.tokens = tokenize(source)
+        self.index = 0
+        self.table = table
+        self.fields = fields
+
+    @property
+    def token(self) -> Token:
+        return self.tokens[self.index]
+
+    def error(self, message: str):
+        return InvalidQueryError(
+            f"Invalid filter: {message} at {self.token.position}.")
+
+    def accept(self, *kinds: str) -> Token:
+        token = self.token
+        if token.kind in kinds:
+            self.index += 1
+            return token
+        return None
+
+    def expect(self, *kinds: str) -> Token:
+        token = self.accept(*kinds)
+        if token is None:
+            raise self.error(f"expected {' or '.join(kinds)}")
+        return token
+
+    def parse(self):
+        clause = self.parse_or()
+        self.expect("end")
+        return clause
+
+    def parse_or(self):
+        clauses = [self.parse_and()]
+        while self.accept("or"):
+            clauses.append(self.parse_and())
+        return clauses[0] if len(clauses) == 1 else or_(*clauses)
+
+    def parse_and(self):
+        clauses = [self.parse_not()]
+        while self.accept("and"):
+            clauses.append(self.parse_not())
+        return clauses[0] if len(clauses) == 1 else and_(*clauses)
+
+    def parse_not(self):
+        if self.accept("not"):
+            return not_(self.parse_not())
+        if self.accept("("):
+            clause = self.parse_or()
+            self.expect(")")
+            return clause
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        name = self.expect("word")
+        operator = self.expect("operator")
+        value = self.expect("string", "number", "true", "false", "null", "word")
+
+        field = find_field(self.fields, name.value)
+        return compile_comparison(
+            self.table,
+            field,
+            operator.value,
+            _token_value(value),
+        )
+
+
+def _token_value(token: Token):
+    if token.kind == "true":
+        return True
+    if token.kind == "false":
+        return False
+    if token.kind == "null":
+        return None
+    return token.value
+
+
+def _escape_like(value: str) -> str:
+    return (
+        value
+        .replace("\\", "\\\\")
+        .replace("%", "\\%")
+        .replace("_", "\\_")
+    )
+
+
+def compile_comparison(table, field: FieldDb, operator: str, value):
+    """Returns the condition `field <operator> value`."""
+
+    expression = field_expression(table, field)
+    sql_type = field_sql_type(field.type)
+
+    if operator in ("~", "!~"):
+        if not isinstance(value, str):
+            raise InvalidQueryError(
+                f"Invalid filter: {operator} expects a string.")
+        text = expression
+        if not isinstance(expression.type, UnicodeText):
+            text = cast(expression, UnicodeText)
+        clause = text.ilike(f"%{_escape_like(value)}%", escape="\\")
+        return not_(clause) if operator == "!~" else clause
+
+    if value is None:
+        if operator in ("=", "=="):
+            return expression.is_(None)
+        if operator == "!=":
+            return expression.isnot(None)
+        raise InvalidQueryError(
+            f"Invalid filter: null can not be compared with {operator}.")
+
+    if sql_type in (BigInteger, Float):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise InvalidQueryError(
+                f"Invalid filter: field {field.name!r} expects a number.")
+        if sql_type is BigInteger and isinstance(value, float):
+            if value.is_integer():
+                value = int(value)
+            else:
+                expression = cast(expression, Float)
+                sql_type = Float
+    elif sql_type is Boolean:
+        if not isinstance(value, bool):
+            raise InvalidQueryError(
+                f"Invalid filter: field {field.name!r} expects a boolean.")
+    else:
+        value = _string_value(value)
+
+    bound = literal(value, sql_type)
+
+    if operator in ("=", "=="):
+        condition = expression == bound
+        # The JSON value is an exact match if it is a number or a boolean, or
+        # a string that can not be mistaken for another JSON value.
+        if sql_type is not UnicodeText or not _is_json_scalar(value):
+            containment = path_contains(table, field.field, value)
+            if containment is not None:
+                condition = and_(containment, condition)
+        return condition
+    if operator == "!=":
+        return expression != bound
+    if operator == "<":
+        return expression < bound
+    if operator == "<=":
+        return expression <= bound
+    if operator == ">":
+        return expression > bound
+    return expression >= bound
+
+
+def _is_json_scalar(value: str) -> bool:
+    """Returns True if `value` is the text of a JSON value other than a
+    string (the `->>` operator can not tell them apart)."""
+
+    try:
+        return not isinstance(json.loads(value), str)
+    except ValueError:
+        return False
+
+
+def _string_value(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def compile_filter(source: str, table, fields: List[FieldDb]):
+    """Compiles the filter `source` to a condition on the rows of `table`.
+
+    Field names are resolved through `fields`. Raises `InvalidQueryError` if
+    `source` is not a valid filter.
+    """
+
+    return _Parser(source, table, fields).parse()
@@ -0,0 +1,337 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""The history of items.
+
+Each write to an item records the version it replaces in `item_history`.
+Most versions are stored as a reverse delta, the changes that turn the next
+version back into it, which is about the size of the change rather than the
+size of the item. Every `KEYFRAME_INTERVAL` versions (or when the delta would
+not be smaller) the full version is stored instead, as a keyframe, so that
+reconstructing a version never applies more than `KEYFRAME_INTERVAL - 1`
+deltas.
+
+A delta is a dict with `set`, mapping JSON pointers (RFC 6901) to the values
+to set, and `unset`, the list of JSON pointers to remove. Only objects are
+diffed recursively, other values are replaced as a whole.
+"""
+
+from typing import Any, List, Mapping, Optional
+from datetime import datetime
+import copy
+import json
+
+from pydantic import BaseModel
+from sqlalchemy import (
+    select, and_, or_, func, cast,
+    BigInteger, Boolean, Integer, UnicodeText,
+)
+from sqlalchemy.dialects.postgresql import insert
+from databases import Database
+
+from .tables import ItemDb, items, item_history
+from .error import NotFoundError
+from .utils import unnest
+
+
+KEYFRAME_INTERVAL = 16
+
+# The parts of an item that are versioned.
+SNAPSHOT_KEYS = ["name", "title", "properties", "deleted"]
+
+
+class ItemRevision(BaseModel):
+    """A version of an item. `replaced_at` is None for the current one."""
+
+    revision: int = ...
+    replaced_at: Optional[datetime] = None
+
+
+def item_snapshot(row: Mapping, prefix: str = "") -> dict:
+    return {
+        key: row[prefix + key]
+        for key in SNAPSHOT_KEYS
+    }
+
+
+def previous_columns(old) -> list:
+    """Returns the columns of the subquery `old` to return from an update so
+    that `record_item_history` can record the versions it replaced.
+
+    `old` must select the rows to update from `items`, with `FOR UPDATE` so
+    that they are the versions actually replaced under concurrent writes.
+    """
+
+    return [
+        old.c[key].label("old_" + key)
+        for key in SNAPSHOT_KEYS + ["revision"]
+    ]
+
+
+def locked_items(condition):
+    """Returns a subquery selecting and locking the items that match
+    `condition`, to update from (see `previous_columns`)."""
+
+    return (
+        select([items.c.id] + [
+            items.c[key]
+            for key in SNAPSHOT_KEYS + ["revision"]
+        ])
+        .where(condition)
+        .with_for_update()
+        .alias("old")
+    )
+
+
+def _escape(key: str) -> str:
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def json_diff(source: Any, target: Any) -> dict:
+    """Returns the delta that turns `source` into `target`."""
+
+    delta = {"set": {}, "unset": []}
+
+    def diff(source, target, path):
+        if isinstance(source, dict) and isinstance(target, dict):
+            for key, value in target.items():
+                child = f"{path}/{_escape(key)}"
+                if key not in source:
+                    delta["set"][child] = value
+                else:
+                    diff(source[key], value, child)
+            for key in source:
+                if key not in target:
+                    delta["unset"].append(f"{path}/{_escape(key)}")
+        elif source != target or type(source) != type(target):
+            delta["set"][path] = target
+
+    diff(source, target, "")
+
+    return delta
+
+
+def apply_delta(document: Any, delta: dict) -> Any:
+    """Returns a copy of `document` with `delta` applied."""
+
+    document = copy.deepcopy(document)
+
+    def parent(path):
+        tokens = [_unescape(token) for token in path.split("/")[1:]]
+        node = document
+        for token in tokens[:-1]:
+            node = node[token]
+        return node, tokens[-1]
+
+    for path in delta["unset"]:
+        node, key = parent(path)
+        del node[key]
+
+    for path, value in delta["set"].items():
+        if not path:
+            document = copy.deepcopy(value)
+            continue
+        node, key = parent(path)
+        node[key] = copy.deepcopy(value)
+
+    return document
+
+
+async def record_item_history(database: Database, rows: List[Mapping]):
+    """Records the versions replaced by an update of items.
+
+    `rows` are the rows returned by the update, with the columns of ItemDb
+    and the `previous_columns`.
+    """
+
+    if not rows:
+        return
+
+    item_ids = [row["id"] for row in rows]
+
+    # The number of deltas recorded since the last keyframe of each item.
+    history = item_history.alias("history")
+    keyframes = item_history.alias("keyframes")
+    last_keyframe = (
+        select([func.max(keyframes.c.revision)])
+        .where(and_(
+            keyframes.c.item == history.c.item,
+            keyframes.c.keyframe,
+        ))
+        .as_scalar()
+    )
+    query = (
+        select([history.c.item, func.count().label("count")])
+        .where(and_(
+            history.c.item.in_(item_ids),
+            history.c.revision > func.coalesce(last_keyframe, 0),
+        ))
+        .group_by(history.c.item)
+    )
+    deltas = {
+        row["item"]: row["count"]
+        for row in await database.fetch_all(query)
+    }
+
+    keyframe_flags = []
+    data = []
+    for row in rows:
+        previous = item_snapshot(row, "old_")
+        snapshot = json.dumps(previous)
+        delta = json.dumps(json_diff(item_snapshot(row), previous))
+        keyframe = (
+            deltas.get(row["id"], 0) >= KEYFRAME_INTERVAL - 1
+            or len(delta) >= len(snapshot)
+        )
+        keyframe_flags.append(keyframe)
+        data.append(snapshot if keyframe else delta)
+
+    values = unnest("versions", dict(
+        item = (Integer, item_ids),
+        revision = (BigInteger, [row["old_revision"] for row in rows]),
+        keyframe = (Boolean, keyframe_flags),
+        data = (UnicodeText, data),
+    ))
+
+    query = (
+        insert(item_history)
+        .from_select(
+            ["item", "revision", "keyframe", "data"],
+            select([
+                values.c.item,
+                values.c.revision,
+                values.c.keyframe,
+                cast(values.c.data, item_history.c.data.type),
+            ]),
+        )
+    )
+
+    await database.execute(query)
+
+
+async def get_item_history(
+    database: Database,
+    item_id: int,
+    *,
+    before: int = None,
+    limit: int = None,
+) -> List[ItemRevision]:
+    """Returns the revisions of an item, most recent first.
+
+    `before` only returns the revisions older than it, to fetch the next
+    page after the last revision of the previous one.
+    """
+
+    current = await database.one(
+        select([items.c.revision]).where(items.c.id == item_id)
+    )
+
+    query = (
+        select([item_history.c.revision, item_history.c.replaced_at])
+        .where(item_history.c.item == item_id)
+        .order_by(item_history.c.revision.desc())
+        .limit(limit)
+    )
+
+    revisions = []
+    if before is None or current["revision"] < before:
+        revisions.append(ItemRevision(revision=current["revision"]))
+        if limit is not None:
+            query = query.limit(limit - 1)
+    if before is not None:
+        query = query.where(item_history.c.revision < before)
+
+    revisions += await database.all(query, lambda row: ItemRevision(**row))
+
+    return revisions
+
+
+async def get_item_version(
+    database: Database,
+    item_id: int,
+    revision: int,
+) -> ItemDb:
+    """Returns the item as it was at `revision`.
+
+    Starts from the first keyframe after `revision` (or the current item if
+    there is none) and applies the deltas back to `revision`.
+    """
+
+    current = await database.one(
+        select([
+            items.c.id,
+            items.c.collection,
+            items.c.revision,
+        ] + [
+            items.c[key]
+            for key in SNAPSHOT_KEYS
+        ])
+        .where(items.c.id == item_id)
+    )
+
+    if current["revision"] == revision:
+        return ItemDb.from_row(current)
+
+    keyframe = (
+        select([func.min(item_history.c.revision)])
+        .where(and_(
+            item_history.c.item == item_id,
+            item_history.c.keyframe,
+            item_history.c.revision >= revision,
+        ))
+        .as_scalar()
+    )
+
+    query = (
+        select([
+            item_history.c.revision,
+            item_history.c.keyframe,
+            item_history.c.data,
+        ])
+        .where(and_(
+            item_history.c.item == item_id,
+            item_history.c.revision >= revision,
+            or_(
+                keyframe.is_(None),
+                item_history.c.revision <= keyframe,
+            ),
+        ))
+        .order_by(item_history.c.revision.desc())
+    )
+
+    versions = await database.fetch_all(query)
+
+    if not versions or versions[-1]["revision"] != revision:
+        raise NotFoundError("Revision does not exist.")
+
+    if versions[0]["keyframe"]:
+        snapshot = versions[0]["data"]
+        versions = versions[1:]
+    else:
+        snapshot = item_snapshot(current)
+
+    for version in versions:
+        snapshot = apply_delta(snapshot, version["data"])
+
+    return ItemDb(
+        id = current["id"],
+        collection = current["collection"],
+        **snapshot,
+    )
@@ -15,20 +15,54 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from typing import List, Union
+from typing import Any, AsyncIterator, List, Optional, Tuple, Union
+import hashlib
+import json
+
 from pydantic import BaseModel
 
 from sqlalchemy import (
-    select, and_, or_,
-    ForeignKey, PrimaryKeyConstraint, UniqueConstraint,
+    select, and_, or_, func, cast, literal, literal_column,
+    Column, ForeignKey, PrimaryKeyConstraint, UniqueConstraint,
+    Float, Integer, UnicodeText, false, any_, bindparam,
 )
+from sqlalchemy.sql import Select, ClauseElement
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert, ARRAY, JSONB
 from databases import Database
 
 from .tables import (
-    ItemDb,
-    items,
+    ItemDb, FieldDb,
+    items, revision_sequence,
+)
+from .error import convert_error, InvalidQueryError
+from .pagination import SortKey, paginate, split_page
+from .filter import compile_filter
+from .expression import (
+    field_expression,
+    field_is_numeric,
+    find_field,
+    merge_patch_expression,
+    parse_projection,
+    projection_columns,
+    project_row,
 )
-from .error import convert_error
+from .field import get_fields
+from .collection import lock_collection, bump_collection_version
+from .history import locked_items, previous_columns, record_item_history
+from .utils import unnest
+
+
+# The text search configuration used to index items. `simple` does not stem
+# words, which is the safest choice as collections are not in any particular
+# language.
+SEARCH_CONFIG = literal_column("'simple'")
+
+# The columns of ItemDb, without the internal ones (like search_vector).
+item_columns = [
+    items.c[name]
+    for name in ItemDb.__fields__
+]
 
 
 class ItemIn(BaseModel):
@@ -48,6 +82,20 @@ class ItemCreate(BaseModel):
     properties: dict = ...
 
 
+class ItemPage(BaseModel):
+    """A page of items, along with the cursor of the next page."""
+
+    items: List[ItemDb] = ...
+    next_cursor: str = None
+
+
+class ProjectedItemPage(BaseModel):
+    """A page of partial items (see `get_projected_item_page`)."""
+
+    items: List[dict] = ...
+    next_cursor: str = None
+
+
 class ItemUpdate(BaseModel):
     """An item without id, suitable for creation."""
 
@@ -56,6 +104,217 @@ class ItemUpdate(BaseModel):
     properties: dict
 
 
+class ItemTombstone(BaseModel):
+    """A deleted item, without its content."""
+
+    id: int
+    collection: int
+    name: str
+    deleted: bool = True
+    revision: int
+
+
+class ItemDelta(BaseModel):
+    """The items changed since a revision, and the revision to ask for
+    next."""
+
+    revision: int
+    items: List[Union[ItemDb, ItemTombstone]]
+
+
+class FacetValue(BaseModel):
+    value: Any
+    count: int
+
+
+class FacetBucket(BaseModel):
+    """A histogram bucket, with `min` included and `max` excluded (except
+    for the last one)."""
+
+    min: float
+    max: float
+    count: int
+
+
+class Facet(BaseModel):
+    """The distribution of the values of a field among items.
+
+    Numeric fields get statistics and a histogram, other fields get the
+    count of their most common values.
+    """
+
+    field: str
+    count: int
+    values: List[FacetValue] = None
+    min: float = None
+    max: float = None
+    avg: float = None
+    histogram: List[FacetBucket] = None
+
+
+class ItemChanges(BaseModel):
+    """The changes to apply to an item. Unset values are left unchanged."""
+
+    name: str = None
+    title: str = None
+    properties: dict = None
+
+
+class ItemBatchUpdate(BaseModel):
+    """The changes to apply to the item called `name`."""
+
+    name: str
+    changes: ItemChanges
+
+
+class ItemPatch(BaseModel):
+    """A JSON Merge Patch of an item.
+
+    `properties` is merged into the current properties, null values removing
+    keys. Null or unset name and title are left unchanged.
+    """
+
+    name: str = None
+    title: str = None
+    properties: dict = None
+
+
+class ItemSelection(BaseModel):
+    """Selects items by name, by filter expression, or both."""
+
+    names: List[str] = None
+    filter: str = None
+
+
+def item_search_vector(name: str, title: str, properties: dict):
+    """Returns the expression of the full-text search document of an item.
+
+    The title is weighted over the name, which is weighted over the string
+    values found in properties. Arguments can be values or SQL expressions.
+    """
+
+    def weighted(value, type, weight):
+        if not isinstance(value, ClauseElement):
+            value = literal(value, type)
+        return func.setweight(
+            func.to_tsvector(SEARCH_CONFIG, cast(value, type)),
+            literal_column(f"'{weight}'"),
+        )
+
+    return (
+        weighted(title, UnicodeText, "A")
+        .op("||")(weighted(name, UnicodeText, "B"))
+        .op("||")(weighted(properties, items.c.properties.type, "C"))
+    )
+
+
+def search_query(search: str):
+    return func.plainto_tsquery(SEARCH_CONFIG, search)
+
+
+async def get_item_filter(
+    database: Database,
+    collection_id: int,
+    filter: str,
+):
+    """Compiles the filter expression `filter`, resolving field names through
+    the fields of the collection."""
+
+    fields = await get_fields(database, collection_id)
+    return compile_filter(filter, items, fields)
+
+
+def get_sort_keys(fields: List[FieldDb], sort: str) -> List[SortKey]:
+    """Returns the sort keys matching `sort`, a comma-separated list of field
+    names, optionally prefixed by `-` to sort in descending order.
+
+    Items are always sorted by id last, so the order is stable.
+    """
+
+    keys = []
+    for name in sort.split(","):
+        name = name.strip()
+        descending = name.startswith("-")
+        name = name.lstrip("+-").strip()
+        if not name:
+            raise InvalidQueryError(f"Invalid sort {sort!r}.")
+
+        expression = field_expression(items, find_field(fields, name))
+        keys.append(SortKey(
+            expression,
+            descending = descending,
+            nullable = not isinstance(expression, Column),
+        ))
+
+    keys.append(SortKey(items.c.id))
+
+    return keys
+
+
+def _sort_expression(field: FieldDb, table) -> str:
+    return str(
+        field_expression(table, field)
+        .compile(
+            dialect = postgresql.dialect(),
+            compile_kwargs = {"literal_binds": True},
+        )
+    )
+
+
+def sort_index_name(field: FieldDb, *, table=items) -> str:
+    """Returns the name of the index backing a sort on `field`. `table` is
+    the items table as declared when the index was created."""
+
+    expression = _sort_expression(field, table)
+    digest = hashlib.md5(expression.encode("utf-8")).hexdigest()[:16]
+    return f"ix_items_sort_{digest}"
+
+
+def sort_index_ddl(field: FieldDb, *, concurrently: bool = False) -> str:
+    """Returns the DDL creating the expression index backing a sort on
+    `field`.
+
+    The index is shared by all the collections with a field of the same path
+    and type.
+    """
+
+    return (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}"
+        f"IF NOT EXISTS {sort_index_name(field)} "
+        f"ON items (collection, ({_sort_expression(field, items)}), id)"
+    )
+
+
+async def create_sort_index(
+    database: Database,
+    field: FieldDb,
+    *,
+    concurrently: bool = False,
+):
+    """Creates the index backing a sort on `field`, if it does not exist.
+
+    `concurrently` avoids locking the items table while the index is built,
+    but can not be used inside a transaction.
+    """
+
+    # Executed on the raw connection as the statement has no parameters and
+    # may contain colons that SQLAlchemy would take for bind parameters.
+    async with database.connection() as connection:
+        await connection.raw_connection.execute(
+            sort_index_ddl(field, concurrently=concurrently)
+        )
+
+
+def item_collection(item_id: int):
+    """Returns the collection of the item `item_id`, as an SQL expression."""
+
+    return (
+        select([items.c.collection])
+        .where(items.c.id == item_id)
+        .as_scalar()
+    )
+
+
 @convert_error
 async def create_item(
     database: Database,
@@ -66,7 +325,23 @@ async def create_item(
     params = item.dict(exclude={"id"})
     params.setdefault("deleted", False)
 
-    id = await database.execute(items.insert(), params)
+    await lock_collection(database, params["collection"])
+
+    query = (
+        items.insert()
+        .values(
+            **params,
+            search_vector = item_search_vector(
+                params["name"],
+                params["title"],
+                params["properties"],
+            ),
+        )
+    )
+
+    id = await database.execute(query)
+
+    await bump_collection_version(database, params["collection"])
 
     return ItemDb(
         id = id,
@@ -74,6 +349,66 @@ async def create_item(
     )
 
 
+async def create_items(
+    database: Database,
+    collection_id: int,
+    new_items: List[ItemIn],
+) -> List[Optional[int]]:
+    """Creates many items in a single statement.
+
+    Returns the id of each created item, or None for the items that were not
+    created because an item with the same name already exists (or appears
+    earlier in `new_items`).
+    """
+
+    if not new_items:
+        return []
+
+    await lock_collection(database, collection_id)
+
+    values = unnest("new_items", dict(
+        name = (UnicodeText, [item.name for item in new_items]),
+        title = (UnicodeText, [item.title for item in new_items]),
+        properties = (UnicodeText, [
+            json.dumps(item.properties)
+            for item in new_items
+        ]),
+    ))
+    properties = cast(values.c.properties, items.c.properties.type)
+
+    query = (
+        insert(items)
+        .from_select(
+            ["collection", "name", "title", "properties", "deleted",
+             "search_vector"],
+            select([
+                literal(collection_id, Integer),
+                values.c.name,
+                values.c.title,
+                properties,
+                false(),
+                item_search_vector(values.c.name, values.c.title, properties),
+            ]),
+        )
+        .on_conflict_do_nothing(index_elements=["collection", "name"])
+        .returning(items.c.id, items.c.name)
+    )
+
+    created = {
+        row["name"]: row["id"]
+        for row in await database.fetch_all(query)
+    }
+
+    if created:
+        await bump_collection_version(database, collection_id)
+
+    # Only the first item with a given name may have been created.
+    return [
+        created.pop(item.name, None)
+        for item in new_items
+    ]
+
+
 def get_item_query(
     collection_id: int,
     *,
@@ -81,7 +416,7 @@ def get_item_query(
     order_by_title: bool = True,
 ):
     query = (
-        select([items])
+        select(item_columns)
         .where(items.c.collection == collection_id)
     )
 
@@ -102,9 +437,396 @@ async def get_items(
     order_by_title: bool = True,
 ) -> List[ItemDb]:
 
-    query = get_item_query(collection_id, include_deleted=include_deleted)
+    def build():
+        return get_item_query(
+            bindparam("collection_id"),
+            include_deleted = include_deleted,
+            order_by_title = order_by_title,
+        )
+
+    return await database.all_cached(
+        ("get_items", include_deleted, order_by_title),
+        build,
+        dict(collection_id=collection_id),
+        ItemDb.from_row,
+    )
+
+
+async def get_item_listing_query(
+    database: Database,
+    collection_id: int,
+    *,
+    columns: list = item_columns,
+    search: str = None,
+    filter: str = None,
+    sort: str = None,
+    include_deleted: bool = False,
+) -> Tuple[Select, List[SortKey]]:
+    """Returns the query listing the items of a collection, along with the
+    keys it should be sorted by.
+
+    If `search` is set, only the items matching it are returned, from the
+    most relevant to the least relevant. If `filter` is set, only the items
+    matching this filter expression are returned (see `cdb_database.filter`).
+    Items are sorted by title by default, `sort` overrides the order (see
+    `get_sort_keys`).
+    """
+
+    search = search.strip() if search else None
+    filter = filter.strip() if filter else None
+    sort = sort.strip() if sort else None
+
+    fields = []
+    if filter or sort:
+        fields = await get_fields(database, collection_id)
+
+    query = get_item_query(
+        collection_id,
+        include_deleted = include_deleted,
+        order_by_title = False,
+    ).with_only_columns(columns)
+
+    if filter:
+        query = query.where(compile_filter(filter, items, fields))
+
+    if search:
+        ts_query = search_query(search)
+        query = query.where(items.c.search_vector.op("@@")(ts_query))
+
+    if sort:
+        keys = get_sort_keys(fields, sort)
+    elif search:
+        rank = func.ts_rank(items.c.search_vector, ts_query, type_=Float)
+        keys = [
+            SortKey(rank, descending=True),
+            SortKey(items.c.id),
+        ]
+    else:
+        keys = [
+            SortKey(items.c.title),
+            SortKey(items.c.id),
+        ]
+
+    return query, keys
+
+
+async def get_item_page(
+    database: Database,
+    collection_id: int,
+    *,
+    search: str = None,
+    filter: str = None,
+    sort: str = None,
+    cursor: str = None,
+    limit: int = None,
+    include_deleted: bool = False,
+) -> ItemPage:
+    """Returns the items after `cursor` (see `get_item_listing_query`).
+
+    Seeking is done on the sort keys, so deep pages are as cheap as the
+    first one.
+    """
+
+    query, keys = await get_item_listing_query(
+        database,
+        collection_id,
+        search = search,
+        filter = filter,
+        sort = sort,
+        include_deleted = include_deleted,
+    )
+
+    query = paginate(query, keys, cursor=cursor, limit=limit)
+
+    rows = await database.fetch_all(query)
+    page_items, next_cursor = split_page(rows, keys, limit, ItemDb.from_row)
+
+    return ItemPage(
+        items = page_items,
+        next_cursor = next_cursor,
+    )
+
+
+async def get_projected_item_page(
+    database: Database,
+    collection_id: int,
+    projection: List[str],
+    *,
+    search: str = None,
+    filter: str = None,
+    sort: str = None,
+    cursor: str = None,
+    limit: int = None,
+    include_deleted: bool = False,
+) -> ProjectedItemPage:
+    """Like `get_item_page`, but only returns the item fields in
+    `projection`.
+
+    `projection` is a list of paths, like `title` or `properties.index`. Only
+    the requested values are selected, so it is cheaper than
+    `get_item_page` for items with many properties.
+    """
+
+    projection = parse_projection(projection)
+
+    query, keys = await get_item_listing_query(
+        database,
+        collection_id,
+        columns = projection_columns(items, projection, item_columns),
+        search = search,
+        filter = filter,
+        sort = sort,
+        include_deleted = include_deleted,
+    )
+
+    query = paginate(query, keys, cursor=cursor, limit=limit)
+
+    rows = await database.fetch_all(query)
+    page_items, next_cursor = split_page(
+        rows,
+        keys,
+        limit,
+        lambda row: project_row(row, projection),
+    )
+
+    return ProjectedItemPage(
+        items = page_items,
+        next_cursor = next_cursor,
+    )
+
+
+def item_row_dict(row) -> dict:
+    return {
+        name: row[name]
+        for name in ItemDb.__fields__
+    }
+
+
+async def iterate_items(
+    database: Database,
+    collection_id: int,
+    *,
+    projection: List[str] = None,
+    search: str = None,
+    filter: str = None,
+    sort: str = None,
+    cursor: str = None,
+    include_deleted: bool = False,
+) -> AsyncIterator[dict]:
+    """Returns an iterator over the items of a collection, as dicts (see
+    `get_item_listing_query`).
 
-    return await database.all(query, ItemDb.from_row)
+    Rows are fetched through a server-side cursor and are not validated as
+    ItemDb, so memory usage does not depend on the size of the collection.
+    If `projection` is set, only the given fields are returned (see
+    `get_projected_item_page`). Arguments are checked before returning, so
+    that errors are not raised in the middle of the iteration.
+    """
+
+    if projection is not None:
+        projection = parse_projection(projection)
+        columns = projection_columns(items, projection, item_columns)
+        def wrapper(row):
+            return project_row(row, projection)
+    else:
+        columns = item_columns
+        wrapper = item_row_dict
+
+    query, keys = await get_item_listing_query(
+        database,
+        collection_id,
+        columns = columns,
+        search = search,
+        filter = filter,
+        sort = sort,
+        include_deleted = include_deleted,
+    )
+
+    query = paginate(query, keys, cursor=cursor)
+
+    return database.stream(query, wrapper)
+
+
+async def get_item_delta(
+    database: Database,
+    collection_id: int,
+    since: int,
+    *,
+    limit: int = None,
+    redact_deleted: bool = False,
+) -> ItemDelta:
+    """Returns the items created, updated or deleted after the revision
+    `since`, ordered by revision.
+
+    Deleted items are included, so that clients can remove them. If
+    `redact_deleted` is set, they are returned as ItemTombstone, without
+    their content. If `limit` is set, the next revision only covers the
+    returned items and the rest can be fetched by asking again from it.
+    """
+
+    query = (
+        select(item_columns + [items.c.revision])
+        .where(and_(
+            items.c.collection == collection_id,
+            items.c.revision > since,
+        ))
+        .order_by(items.c.revision)
+    )
+
+    if limit is not None:
+        query = query.limit(limit)
+
+    rows = await database.fetch_all(query)
+
+    def delta_item(row):
+        if redact_deleted and row["deleted"]:
+            return ItemTombstone(**{
+                key: row[key]
+                for key in ItemTombstone.__fields__
+            })
+        return ItemDb.from_row(row)
+
+    return ItemDelta(
+        revision = rows[-1]["revision"] if rows else since,
+        items = [delta_item(row) for row in rows],
+    )
+
+
+async def get_item_facets(
+    database: Database,
+    collection_id: int,
+    field_names: List[str],
+    *,
+    search: str = None,
+    filter: str = None,
+    include_deleted: bool = False,
+    size: int = 20,
+    buckets: int = 10,
+) -> List[Facet]:
+    """Returns the facet of each field in `field_names` over the items
+    selected by `search` and `filter` (see `get_item_listing_query`).
+
+    Categorical facets have the `size` most common values (NULL included),
+    numeric ones have an histogram of `buckets` buckets of the same width.
+    """
+
+    fields = await get_fields(database, collection_id)
+    base_query, _ = await get_item_listing_query(
+        database,
+        collection_id,
+        search = search,
+        filter = filter,
+        include_deleted = include_deleted,
+    )
+
+    facets = []
+    for name in field_names:
+        field = find_field(fields, name)
+        value = field_expression(items, field)
+
+        if field_is_numeric(field.type):
+            facet = await _get_numeric_facet(
+                database,
+                base_query,
+                name,
+                cast(value, Float),
+                buckets,
+            )
+        else:
+            facet = await _get_categorical_facet(
+                database,
+                base_query,
+                name,
+                value,
+                size,
+            )
+        facets.append(facet)
+
+    return facets
+
+
+async def _get_categorical_facet(
+    database: Database,
+    base_query: Select,
+    name: str,
+    value,
+    size: int,
+) -> Facet:
+    count = func.count().label("count")
+    query = (
+        base_query
+        .with_only_columns([value.label("value"), count])
+        .group_by(value)
+        .order_by(count.desc(), value)
+        .limit(size)
+    )
+    values = await database.all(query, lambda row: FacetValue(**row))
+
+    total_query = base_query.with_only_columns([func.count()])
+    total = await database.fetch_val(total_query)
+
+    return Facet(
+        field = name,
+        count = total,
+        values = values,
+    )
+
+
+async def _get_numeric_facet(
+    database: Database,
+    base_query: Select,
+    name: str,
+    value,
+    buckets: int,
+) -> Facet:
+    stats_query = base_query.with_only_columns([
+        func.count(value).label("count"),
+        func.min(value).label("min"),
+        func.max(value).label("max"),
+        func.avg(value, type_=Float).label("avg"),
+    ])
+    stats = await database.fetch_one(stats_query)
+
+    facet = Facet(field=name, histogram=[], **stats)
+    if not facet.count:
+        return facet
+
+    if facet.min == facet.max:
+        facet.histogram.append(FacetBucket(
+            min = facet.min,
+            max = facet.max,
+            count = facet.count,
+        ))
+        return facet
+
+    # width_bucket puts the maximum in an extra bucket, merge it with the
+    # last one.
+    bucket = func.least(
+        func.width_bucket(value, facet.min, facet.max, buckets),
+        buckets,
+    ).label("bucket")
+    query = (
+        base_query
+        .with_only_columns([bucket, func.count().label("count")])
+        .where(value.isnot(None))
+        # Grouping by the expression would bind its parameters again, which
+        # Postgres would not recognize as the selected expression.
+        .group_by(literal_column("1"))
+    )
+    counts = {
+        row["bucket"]: row["count"]
+        for row in await database.fetch_all(query)
+    }
+
+    width = (facet.max - facet.min) / buckets
+    for index in range(buckets):
+        facet.histogram.append(FacetBucket(
+            min = facet.min + index * width,
+            max = facet.min + (index + 1) * width,
+            count = counts.get(index + 1, 0),
+        ))
+
+    return facet
 
 
 async def get_item(
@@ -115,12 +837,21 @@ async def get_item(
     include_deleted: bool = False,
 ) -> List[ItemDb]:
 
-    query = (
-        get_item_query(collection_id, include_deleted=include_deleted)
-        .where(items.c.name == item_name)
-    )
+    def build():
+        return (
+            get_item_query(
+                bindparam("collection_id"),
+                include_deleted = include_deleted,
+            )
+            .where(items.c.name == bindparam("item_name"))
+        )
 
-    return await database.one(query, ItemDb.from_row)
+    return await database.one_cached(
+        ("get_item", include_deleted),
+        build,
+        dict(collection_id=collection_id, item_name=item_name),
+        ItemDb.from_row,
+    )
 
 
 async def update_item(
@@ -129,14 +860,173 @@ async def update_item(
     value: ItemUpdate,
 ) -> ItemDb:
 
+    params = value.dict(include={"name", "title", "properties"})
+
+    await lock_collection(database, item_collection(item_id))
+
+    old = locked_items(items.c.id == item_id)
     query = (
         items.update()
-        .returning(items)
-        .where(items.c.id == item_id)
-        .values(**value.dict(include={"name", "title", "properties"}))
+        .returning(*item_columns, *previous_columns(old))
+        .where(items.c.id == old.c.id)
+        .values(
+            **params,
+            search_vector = item_search_vector(
+                params["name"],
+                params["title"],
+                params["properties"],
+            ),
+            revision = revision_sequence.next_value(),
+        )
     )
 
-    return await database.one(query, ItemDb.from_row)
+    row = await database.one(query)
+
+    await record_item_history(database, [row])
+    await bump_collection_version(database, row["collection"])
+
+    return ItemDb.from_row(row)
+
+
+@convert_error
+async def patch_item(
+    database: Database,
+    collection_id: int,
+    item_name: str,
+    patch: ItemPatch,
+    *,
+    include_deleted: bool = False,
+) -> ItemDb:
+    """Applies `patch` to an item in a single statement, returns the patched
+    item."""
+
+    name = items.c.name
+    if patch.name is not None:
+        name = literal(patch.name, UnicodeText)
+
+    title = items.c.title
+    if patch.title is not None:
+        title = literal(patch.title, UnicodeText)
+
+    properties = items.c.properties
+    if patch.properties is not None:
+        properties = cast(
+            merge_patch_expression(
+                cast(items.c.properties, JSONB),
+                patch.properties,
+            ),
+            items.c.properties.type,
+        )
+
+    conditions = [
+        items.c.collection == collection_id,
+        items.c.name == item_name,
+    ]
+    if not include_deleted:
+        conditions.append(~items.c.deleted)
+
+    await lock_collection(database, collection_id)
+
+    old = locked_items(and_(*conditions))
+    query = (
+        items.update()
+        .returning(*item_columns, *previous_columns(old))
+        .where(items.c.id == old.c.id)
+        .values(
+            name = name,
+            title = title,
+            properties = properties,
+            search_vector = item_search_vector(name, title, properties),
+            revision = revision_sequence.next_value(),
+        )
+    )
+
+    row = await database.one(query)
+
+    await record_item_history(database, [row])
+    await bump_collection_version(database, collection_id)
+
+    return ItemDb.from_row(row)
+
+
+@convert_error
+async def update_items(
+    database: Database,
+    collection_id: int,
+    updates: List[ItemBatchUpdate],
+    *,
+    include_deleted: bool = False,
+) -> List[ItemDb]:
+    """Applies many changes in a single statement, returns the updated items.
+
+    Items that do not exist are ignored, so the result may be shorter than
+    `updates`.
+    """
+
+    if not updates:
+        return []
+
+    names = [update.name for update in updates]
+    if len(set(names)) != len(names):
+        raise InvalidQueryError("Each item can only be updated once.")
+
+    values = unnest("changes", dict(
+        name = (UnicodeText, names),
+        new_name = (UnicodeText, [
+            update.changes.name
+            for update in updates
+        ]),
+        title = (UnicodeText, [
+            update.changes.title
+            for update in updates
+        ]),
+        properties = (UnicodeText, [
+            json.dumps(update.changes.properties)
+            if update.changes.properties is not None else None
+            for update in updates
+        ]),
+    ))
+
+    name = func.coalesce(values.c.new_name, items.c.name)
+    title = func.coalesce(values.c.title, items.c.title)
+    properties = func.coalesce(
+        cast(values.c.properties, items.c.properties.type),
+        items.c.properties,
+    )
+
+    conditions = [
+        items.c.collection == collection_id,
+        items.c.name == any_(literal(names, ARRAY(UnicodeText))),
+    ]
+    if not include_deleted:
+        conditions.append(~items.c.deleted)
+
+    await lock_collection(database, collection_id)
+
+    old = locked_items(and_(*conditions))
+    query = (
+        items.update()
+        .returning(*item_columns, *previous_columns(old))
+        .where(and_(
+            items.c.id == old.c.id,
+            old.c.name == values.c.name,
+        ))
+        .values(
+            name = name,
+            title = title,
+            properties = properties,
+            search_vector = item_search_vector(name, title, properties),
+            revision = revision_sequence.next_value(),
+        )
+    )
+
+    rows = await database.fetch_all(query)
+
+    if rows:
+        await record_item_history(database, rows)
+        await bump_collection_version(database, collection_id)
+
+    return [ItemDb.from_row(row) for row in rows]
 
 
 async def delete_item(
@@ -144,11 +1034,70 @@ async def delete_item(
     item_id: int,
 ) -> ItemDb:
 
+    await lock_collection(database, item_collection(item_id))
+
+    old = locked_items(items.c.id == item_id)
     query = (
         items.update()
-        .returning(items)
-        .where(items.c.id == item_id)
-        .values(deleted = True)
+        .returning(*item_columns, *previous_columns(old))
+        .where(items.c.id == old.c.id)
+        .values(
+            deleted = True,
+            deleted_at = func.now(),
+            revision = revision_sequence.next_value(),
+        )
     )
 
-    await database.one(query)
+    row = await database.one(query)
+
+    await record_item_history(database, [row])
+    await bump_collection_version(database, row["collection"])
+
+
+async def delete_items(
+    database: Database,
+    collection_id: int,
+    selection: ItemSelection,
+) -> int:
+    """Soft-deletes the selected items in a single statement, returns the
+    number of items deleted."""
+
+    if selection.names is None and selection.filter is None:
+        raise InvalidQueryError("Items must be selected by names or filter.")
+
+    conditions = [
+        items.c.collection == collection_id,
+        ~items.c.deleted,
+    ]
+    if selection.names is not None:
+        conditions.append(items.c.name == any_(
+            literal(selection.names, ARRAY(UnicodeText))
+        ))
+    if selection.filter is not None:
+        conditions.append(await get_item_filter(
+            database,
+            collection_id,
+            selection.filter,
+        ))
+
+    await lock_collection(database, collection_id)
+
+    old = locked_items(and_(*conditions))
+    query = (
+        items.update()
+        .returning(*item_columns, *previous_columns(old))
+        .where(items.c.id == old.c.id)
+        .values(
+            deleted = True,
+            deleted_at = func.now(),
+            revision = revision_sequence.next_value(),
+        )
+    )
+
+    rows = await database.fetch_all(query)
+
+    if rows:
+        await record_item_history(database, rows)
+        await bump_collection_version(database, collection_id)
+
+    return len(rows)
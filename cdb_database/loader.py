@@ -0,0 +1,211 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Request-scoped memoization of the lookups of users and collections.
+
+A Loader lives for one request (or any short unit of work): rows it loads
+are returned as is by later lookups, so it must not be used across writes to
+these rows.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, List
+import asyncio
+
+from sqlalchemy import literal, any_, Integer, UnicodeText
+from sqlalchemy.dialects.postgresql import ARRAY
+from databases import Database
+
+from .tables import UserDb, users
+from .error import NotFoundError
+from .user import get_user_query
+from .resolver import ResolvedPath, resolve_path
+
+
+class BatchLoader:
+    """Memoizes values by key, and loads the keys requested concurrently
+    with a single call of `load_many`.
+
+    `load_many` takes a list of keys and returns a dict of the values found.
+    Keys that are not found raise NotFoundError(`not_found`).
+    """
+
+    def __init__(
+        self,
+        load_many: Callable[[List[Any]], Awaitable[Dict[Any, Any]]],
+        not_found: str = "Resource does not exist.",
+    ):
+        self._load_many = load_many
+        self._not_found = not_found
+        self._futures = {}
+        self._batch = []
+
+    def prime(self, key, value):
+        """Memoizes `value` for `key`, unless `key` is already loaded."""
+
+        if key not in self._futures:
+            future = asyncio.get_event_loop().create_future()
+            future.set_result(value)
+            self._futures[key] = future
+
+    async def load(self, key):
+        while True:
+            future = self._futures.get(key)
+            if future is None:
+                future = asyncio.get_event_loop().create_future()
+                self._futures[key] = future
+                self._batch.append(key)
+                if len(self._batch) == 1:
+                    try:
+                        # Let the other concurrent loads join the batch.
+                        await asyncio.sleep(0)
+                    except asyncio.CancelledError:
+                        self._abandon()
+                        raise
+                    await self._dispatch()
+
+            try:
+                # Shielded as the future is shared with the other loads of
+                # `key`.
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The future is cancelled when the load dispatching its batch
+                # is, the other loads of the batch try again.
+                if not future.cancelled():
+                    raise
+
+    def _abandon(self):
+        keys, self._batch = self._batch, []
+        for key in keys:
+            self._futures.pop(key).cancel()
+
+    async def _dispatch(self):
+        keys, self._batch = self._batch, []
+
+        try:
+            values = await self._load_many(keys)
+        except asyncio.CancelledError:
+            for key in keys:
+                self._futures.pop(key).cancel()
+            raise
+        except Exception as error:
+            # Not memoized, the next load of these keys will try again.
+            for key in keys:
+                self._futures.pop(key).set_exception(error)
+            return
+
+        for key in keys:
+            if key in values:
+                self._futures[key].set_result(values[key])
+            else:
+                self._futures[key].set_exception(
+                    NotFoundError(self._not_found)
+                )
+
+
+class Loader:
+    """Memoizes the users and the resolved paths loaded through it, see the
+    module documentation."""
+
+    def __init__(self, database: Database):
+        self.database = database
+        self._users = BatchLoader(self._load_users, "User does not exist.")
+        self._usernames = BatchLoader(
+            self._load_usernames,
+            "User does not exist.",
+        )
+        self._paths = {}
+
+    async def _load_users_where(self, condition) -> List[UserDb]:
+        query = get_user_query(include_disabled=True).where(condition)
+        loaded = await self.database.all(query, UserDb.from_row)
+
+        for user in loaded:
+            self._users.prime(user.id, user)
+            self._usernames.prime(user.username, user)
+
+        return loaded
+
+    async def _load_users(self, user_ids: List[int]) -> Dict[int, UserDb]:
+        loaded = await self._load_users_where(
+            users.c.id == any_(literal(user_ids, ARRAY(Integer)))
+        )
+        return {user.id: user for user in loaded}
+
+    async def _load_usernames(
+        self,
+        usernames: List[str],
+    ) -> Dict[str, UserDb]:
+        loaded = await self._load_users_where(
+            users.c.username == any_(literal(usernames, ARRAY(UnicodeText)))
+        )
+        return {user.username: user for user in loaded}
+
+    @staticmethod
+    def _check_user(user: UserDb, include_disabled: bool) -> UserDb:
+        if user.disabled and not include_disabled:
+            raise NotFoundError("User does not exist.")
+        return user
+
+    async def user(
+        self,
+        user_id: int,
+        *,
+        include_disabled: bool = False,
+    ) -> UserDb:
+        """Like `cdb_database.user.get_user(user_id=...)`."""
+
+        user = await self._users.load(user_id)
+        return self._check_user(user, include_disabled)
+
+    async def user_by_name(
+        self,
+        username: str,
+        *,
+        include_disabled: bool = False,
+    ) -> UserDb:
+        """Like `cdb_database.user.get_user(username=...)`."""
+
+        user = await self._usernames.load(username)
+        return self._check_user(user, include_disabled)
+
+    async def resolve_path(
+        self,
+        logged_user: UserDb,
+        username: str,
+        collection_name: str,
+        *,
+        item_name: str = None,
+    ) -> ResolvedPath:
+        """Like `cdb_database.resolver.resolve_path`."""
+
+        key = (logged_user.id, username, collection_name, item_name)
+        resolved = self._paths.get(key)
+        if resolved is None:
+            resolved = await resolve_path(
+                self.database,
+                logged_user,
+                username,
+                collection_name,
+                item_name = item_name,
+            )
+            self._paths[key] = resolved
+            # Also resolves the collection alone.
+            self._paths.setdefault(
+                key[:-1] + (None,),
+                resolved.copy(update=dict(item=None)),
+            )
+
+        return resolved
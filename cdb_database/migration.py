@@ -0,0 +1,172 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Upgrades the schema of an existing database to the current one.
+
+`create_tables` only creates the missing tables. `upgrade_tables` also adds
+the columns and indexes declared since a table was created, drops obsolete
+indexes, converts JSON columns to JSONB (rebuilding the sort indexes that
+depend on them) and fills the derived columns. It is idempotent.
+"""
+
+from typing import List
+
+from sqlalchemy import inspect, select, func, JSON, MetaData
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateColumn, CreateIndex
+
+from .schema import metadata
+from .tables import FieldDb, items, fields, collections
+from .item import item_search_vector, sort_index_name, sort_index_ddl
+
+
+# Indexes that have been replaced by other ones.
+obsolete_indexes = {
+    "items": [
+        "ix_items_name",
+        "ix_items_name_partial",
+        "ix_items_collection_title_id",
+    ],
+}
+
+# Prefix of the sort indexes, see `item.sort_index_ddl`.
+SORT_INDEX_PREFIX = "ix_items_sort_"
+
+
+def json_items():
+    """Returns the items table as declared before `properties` was JSONB,
+    which the sort indexes created back then depend on."""
+
+    table = items.tometadata(MetaData())
+    table.c.properties.type = JSON()
+    return table
+
+
+def sort_index_names(connection: Connection) -> List[str]:
+    """Returns the names of the sort indexes, which SQLAlchemy does not
+    reflect as they are expression indexes."""
+
+    rows = connection.execute(
+        "SELECT indexname FROM pg_indexes "
+        "WHERE tablename = 'items' AND indexname LIKE %(pattern)s "
+        "ORDER BY indexname",
+        dict(pattern = SORT_INDEX_PREFIX.replace("_", "\\_") + "%"),
+    )
+    return [row[0] for row in rows]
+
+
+def upgrade_tables(connection: Connection) -> List[str]:
+    """Upgrades the tables through `connection`, returns the statements that
+    were executed.
+
+    The caller is responsible for the transaction. Converting columns and
+    creating indexes locks the tables, so this should run while the API is
+    stopped.
+    """
+
+    dialect = connection.dialect
+    applied = []
+
+    def execute(statement):
+        connection.execute(statement)
+        applied.append(str(
+            statement
+            if isinstance(statement, str)
+            else statement.compile(dialect=dialect)
+        ).strip())
+
+    metadata.create_all(connection)
+
+    dropped_sort_indexes = set()
+
+    inspector = inspect(connection)
+    for table in metadata.sorted_tables:
+        columns = {
+            column["name"]: column
+            for column in inspector.get_columns(table.name)
+        }
+        index_names = {
+            index["name"]
+            for index in inspector.get_indexes(table.name)
+        }
+
+        for column in table.columns:
+            existing = columns.get(column.name)
+            if existing is None:
+                spec = CreateColumn(column).compile(dialect=dialect)
+                execute(f"ALTER TABLE {table.name} ADD COLUMN {spec}")
+            elif (isinstance(column.type, JSONB)
+                    and isinstance(existing["type"], JSON)
+                    and not isinstance(existing["type"], JSONB)):
+                # Converting the column would rebuild the sort indexes,
+                # whose expressions are only valid on JSON.
+                if table is items:
+                    for index_name in sort_index_names(connection):
+                        execute(f"DROP INDEX {index_name}")
+                        dropped_sort_indexes.add(index_name)
+                execute(
+                    f"ALTER TABLE {table.name} ALTER COLUMN {column.name} "
+                    f"TYPE JSONB USING {column.name}::JSONB"
+                )
+
+        for index in table.indexes:
+            if index.name not in index_names:
+                execute(CreateIndex(index))
+        for index_name in obsolete_indexes.get(table.name, []):
+            if index_name in index_names:
+                execute(f"DROP INDEX {index_name}")
+
+    result = connection.execute(
+        items.update()
+        .where(items.c.search_vector.is_(None))
+        .values(search_vector=item_search_vector(
+            items.c.name,
+            items.c.title,
+            items.c.properties,
+        ))
+    )
+    if result.rowcount:
+        applied.append(f"-- Filled the search vector of {result.rowcount} items")
+
+    # Recreates the dropped sort indexes of the live fields, on JSONB.
+    if dropped_sort_indexes:
+        legacy_items = json_items()
+        rows = connection.execute(select([fields]).where(~fields.c.deleted))
+        for row in rows:
+            field = FieldDb.from_row(row)
+            index_name = sort_index_name(field, table=legacy_items)
+            if index_name in dropped_sort_indexes:
+                dropped_sort_indexes.remove(index_name)
+                execute(sort_index_ddl(field))
+        for index_name in sorted(dropped_sort_indexes):
+            applied.append(
+                f"-- Dropped the sort index {index_name}, used by no field")
+
+    # Tombstones from before deleted_at existed are purged as if they had
+    # been deleted now.
+    for table in (collections, fields, items):
+        result = connection.execute(
+            table.update()
+            .where(table.c.deleted & table.c.deleted_at.is_(None))
+            .values(deleted_at = func.now())
+        )
+        if result.rowcount:
+            applied.append(
+                f"-- Set the deletion time of {result.rowcount} {table.name}")
+
+    return applied
@@ -0,0 +1,154 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+import base64
+import json
+
+from sqlalchemy import and_, or_, tuple_, literal, false
+
+from .error import InvalidQueryError
+
+
+class SortKey(NamedTuple):
+    """An expression used to order (and paginate) a query.
+
+    `nullable` must be set for expressions that may be NULL, so that
+    pagination does not skip rows: Postgres sorts NULLs last in ascending
+    order and first in descending order.
+    """
+
+    expression: Any
+    descending: bool = False
+    nullable: bool = False
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """Encodes the sort key values of the last row of a page as an opaque
+    string."""
+
+    data = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, length: int) -> List[Any]:
+    """Decodes a cursor built by `encode_cursor`."""
+
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except ValueError:
+        raise InvalidQueryError("Invalid cursor.")
+
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidQueryError("Invalid cursor.")
+
+    return values
+
+
+def _cursor_label(index: int) -> str:
+    return f"_cursor_{index}"
+
+
+def after_cursor(keys: List[SortKey], values: List[Any]):
+    """Returns a condition matching the rows that come after `values` in the
+    order defined by `keys`."""
+
+    directions = {key.descending for key in keys}
+    if len(directions) == 1 and not any(key.nullable for key in keys):
+        # Row-value comparison, which Postgres can match against a composite
+        # index.
+        row = tuple_(*[key.expression for key in keys])
+        bound = tuple_(*[
+            literal(value, key.expression.type)
+            for key, value in zip(keys, values)
+        ])
+        return row < bound if keys[0].descending else row > bound
+
+    clauses = []
+    equals = []
+    for key, value in zip(keys, values):
+        expression = key.expression
+        if value is None:
+            after = expression.isnot(None) if key.descending else false()
+            equal = expression.is_(None)
+        else:
+            bound = literal(value, expression.type)
+            if key.descending:
+                after = expression < bound
+            else:
+                after = expression > bound
+                if key.nullable:
+                    after = or_(after, expression.is_(None))
+            equal = expression == bound
+        clauses.append(and_(*equals, after))
+        equals.append(equal)
+
+    return or_(*clauses)
+
+
+def paginate(
+    query,
+    keys: List[SortKey],
+    *,
+    cursor: str = None,
+    limit: int = None,
+):
+    """Orders `query` by `keys` and restricts it to the page starting after
+    `cursor`.
+
+    The last key must be unique (typically the primary key) for the order to
+    be stable. One extra row is fetched to know if there is a next page.
+    """
+
+    for index, key in enumerate(keys):
+        query = query.column(key.expression.label(_cursor_label(index)))
+
+    if cursor is not None:
+        values = decode_cursor(cursor, len(keys))
+        query = query.where(after_cursor(keys, values))
+
+    query = query.order_by(*[
+        key.expression.desc() if key.descending else key.expression
+        for key in keys
+    ])
+
+    if limit is not None:
+        query = query.limit(limit + 1)
+
+    return query
+
+
+def split_page(
+    rows: list,
+    keys: List[SortKey],
+    limit: Optional[int],
+    wrapper: Callable,
+) -> Tuple[list, Optional[str]]:
+    """Wraps the rows returned by a query built with `paginate`, and returns
+    them along with the cursor of the next page (if any)."""
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([
+            last[_cursor_label(index)]
+            for index in range(len(keys))
+        ])
+
+    return [wrapper(row) for row in rows], next_cursor
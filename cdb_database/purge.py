@@ -0,0 +1,204 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Hard-deletes the rows that have been soft-deleted for some time.
+
+Rows are deleted in small batches, each one in its own statement, so that
+locks are short and the WAL is written at a steady pace. Clients synchronized
+through revisions (see `cdb_database.item.get_item_delta`) that are older than
+the purge delay miss the deletion of the purged rows, and must resync.
+
+Each batch is selected through an index: the partial `deleted_at` indexes for
+tombstones and the `collection` indexes for the rows of purged collections.
+The two are separate steps, as an `OR` of both would be a sequential scan.
+"""
+
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple
+from datetime import datetime, timedelta, timezone
+import asyncio
+
+from sqlalchemy import select, and_, tuple_
+from databases import Database
+
+from .tables import (
+    collections, user_collections, items, fields, item_history,
+)
+
+
+PURGE_BATCH_SIZE = 1000
+
+
+class PurgeStep(NamedTuple):
+    """The rows of `table` matching `condition`, identified by `keys`.
+
+    `dependents` are `(table, column)` pairs of rows referencing `keys[0]`,
+    which are deleted along with each batch.
+    """
+
+    table: object
+    keys: list
+    condition: object
+    dependents: Sequence[Tuple[object, object]] = ()
+
+
+def _purged_collections(cutoff: datetime):
+    return (
+        select([collections.c.id])
+        .where(and_(
+            collections.c.deleted,
+            collections.c.deleted_at < cutoff,
+        ))
+    )
+
+
+def _tombstones(table, cutoff: datetime):
+    return and_(table.c.deleted, table.c.deleted_at < cutoff)
+
+
+def purge_steps(cutoff: datetime) -> List[PurgeStep]:
+    """Returns the steps of the purge, in an order compatible with the
+    foreign keys.
+
+    Rows deleted before `cutoff` are purged, along with all the rows of the
+    purged collections.
+    """
+
+    dead_collections = _purged_collections(cutoff)
+    history = [(item_history, item_history.c.item)]
+
+    return [
+        PurgeStep(
+            items,
+            [items.c.id],
+            _tombstones(items, cutoff),
+            history,
+        ),
+        PurgeStep(
+            items,
+            [items.c.id],
+            items.c.collection.in_(dead_collections),
+            history,
+        ),
+        PurgeStep(fields, [fields.c.id], _tombstones(fields, cutoff)),
+        PurgeStep(
+            fields,
+            [fields.c.id],
+            fields.c.collection.in_(dead_collections),
+        ),
+        PurgeStep(
+            user_collections,
+            [user_collections.c.user_id, user_collections.c.collection_id],
+            user_collections.c.collection_id.in_(dead_collections),
+        ),
+        PurgeStep(
+            collections,
+            [collections.c.id],
+            _tombstones(collections, cutoff),
+        ),
+    ]
+
+
+async def purge_batch(
+    database: Database,
+    step: PurgeStep,
+    batch_size: int = PURGE_BATCH_SIZE,
+) -> Dict[str, int]:
+    """Hard-deletes at most `batch_size` rows of `step`, along with their
+    dependents. Returns the number of rows deleted by table name."""
+
+    table, keys, condition, dependents = step
+    # Locks the batch, skipping the rows being written, like items revived
+    # by an import. The deletes check `condition` again all the same.
+    batch = (
+        select(keys)
+        .where(condition)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+
+    counts = {}
+    async with database.transaction():
+        rows = await database.fetch_all(batch)
+        if not rows:
+            return {table.name: 0}
+
+        selected = and_(
+            tuple_(*keys).in_([
+                tuple(row[key.name] for key in keys)
+                for row in rows
+            ]),
+            condition,
+        )
+        for dependent, column in dependents:
+            # SQLAlchemy 1.3 can not put a DELETE in a CTE to count the rows,
+            # so the deleted keys are returned instead.
+            deleted = await database.fetch_all(
+                dependent.delete()
+                .where(column.in_(select([keys[0]]).where(selected)))
+                .returning(column)
+            )
+            counts[dependent.name] = len(deleted)
+
+        deleted = await database.fetch_all(
+            table.delete()
+            .where(selected)
+            .returning(keys[0])
+        )
+        counts[table.name] = len(deleted)
+
+    return counts
+
+
+async def purge(
+    database: Database,
+    older_than: timedelta,
+    *,
+    batch_size: int = PURGE_BATCH_SIZE,
+    pause: float = 0.0,
+    progress: Callable[[str, int], None] = None,
+) -> Dict[str, int]:
+    """Hard-deletes the rows soft-deleted more than `older_than` ago.
+
+    Waits `pause` seconds between batches to throttle the purge. `progress`
+    is called after each batch with the table name and the number of rows
+    deleted from it so far. Returns the number of rows deleted by table.
+    """
+
+    cutoff = datetime.now(timezone.utc) - older_than
+    steps = purge_steps(cutoff)
+
+    counts = {}
+    for step in steps:
+        for dependent, _ in step.dependents:
+            counts.setdefault(dependent.name, 0)
+        counts.setdefault(step.table.name, 0)
+
+    for step in steps:
+        while True:
+            batch_counts = await purge_batch(database, step, batch_size)
+            for table_name, count in batch_counts.items():
+                counts[table_name] += count
+                if progress is not None and count:
+                    progress(table_name, counts[table_name])
+
+            if batch_counts[step.table.name] < batch_size:
+                break
+
+            if pause:
+                await asyncio.sleep(pause)
+
+    return counts
@@ -0,0 +1,164 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Resolution of the paths of the API, like
+`/users/{username}/collections/{collection_name}/items/{item_name}`, in a
+single query.
+"""
+
+from typing import Optional
+
+from pydantic import BaseModel
+from sqlalchemy import select, and_, or_, bindparam
+from databases import Database
+
+from .tables import (
+    UserDb, ItemDb,
+    users, collections, user_collections, items,
+)
+from .error import NotFoundError
+from .collection import Collection
+
+
+ITEM_PREFIX = "item_"
+
+
+class ResolvedPath(BaseModel):
+    """A collection seen by a user, its version and optionally one of its
+    items."""
+
+    collection: Collection = ...
+    version: int = ...
+    item: Optional[ItemDb] = None
+
+
+def resolve_path_query(
+    logged_user_id: int,
+    is_admin: bool,
+    username: str,
+    collection_name: str,
+    item_name: str = None,
+):
+    """Returns the query of `resolve_path` for a user `logged_user_id` that
+    is an admin if `is_admin` is set."""
+
+    columns = [
+        *collections.c,
+        *user_collections.c,
+    ]
+    from_ = (
+        users
+        .join(collections, collections.c.owner == users.c.id)
+        .outerjoin(
+            user_collections,
+            and_(
+                collections.c.id == user_collections.c.collection_id,
+                user_collections.c.user_id == logged_user_id,
+            ),
+        )
+    )
+    conditions = [
+        users.c.username == username,
+        collections.c.name == collection_name,
+    ]
+
+    if not is_admin:
+        conditions += [
+            ~users.c.disabled,
+            ~collections.c.deleted,
+            or_(
+                users.c.id == logged_user_id,
+                collections.c.public,
+                user_collections.c.user_id != None,
+            ),
+        ]
+
+    if item_name is not None:
+        item_condition = and_(
+            items.c.collection == collections.c.id,
+            items.c.name == item_name,
+        )
+        if not is_admin:
+            item_condition = and_(item_condition, ~items.c.deleted)
+        from_ = from_.outerjoin(items, item_condition)
+        columns += [
+            items.c[name].label(ITEM_PREFIX + name)
+            for name in ItemDb.__fields__
+        ]
+
+    return select(columns).select_from(from_).where(and_(*conditions))
+
+
+async def resolve_path(
+    database: Database,
+    logged_user: UserDb,
+    username: str,
+    collection_name: str,
+    *,
+    item_name: str = None,
+) -> ResolvedPath:
+    """Returns the collection `collection_name` of `username` as seen by
+    `logged_user`, and the item `item_name` if set, in a single query.
+
+    Follows the rules of the API: admins see everything, including disabled
+    users and deleted collections and items. Other users see the public
+    collections, the ones shared with them and all the collections they own.
+    Raises NotFoundError if the user, the collection or the item is not
+    visible.
+    """
+
+    with_item = item_name is not None
+
+    def build():
+        return resolve_path_query(
+            bindparam("logged_user_id"),
+            logged_user.is_admin,
+            bindparam("username"),
+            bindparam("collection_name"),
+            bindparam("item_name") if with_item else None,
+        )
+
+    values = dict(
+        logged_user_id = logged_user.id,
+        username = username,
+        collection_name = collection_name,
+    )
+    if with_item:
+        values["item_name"] = item_name
+
+    rows = await database.fetch_cached(
+        ("resolve_path", logged_user.is_admin, with_item),
+        build,
+        values,
+    )
+    if not rows:
+        raise NotFoundError("Collection does not exist.")
+    row = rows[0]
+
+    item = None
+    if item_name is not None:
+        if row[ITEM_PREFIX + "id"] is None:
+            raise NotFoundError("Item does not exist.")
+        item = ItemDb(**{
+            name: row[ITEM_PREFIX + name]
+            for name in ItemDb.__fields__
+        })
+
+    return ResolvedPath(
+        collection = Collection.from_row(logged_user, row),
+        version = row["version"],
+        item = item,
+    )
@@ -26,9 +26,10 @@ except ImportError:
     from pydantic import Schema as PydanticField
 
 from sqlalchemy import (
-    MetaData, Table, Column,
-    Boolean, Integer, Float, Unicode, UnicodeText, JSON
+    MetaData, Table, Column, Index, text,
+    Boolean, Integer, Float, Unicode, UnicodeText,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 
 
 metadata = MetaData()
@@ -42,7 +43,7 @@ _type_map = [
     (str, lambda f: UnicodeText),
     (float, lambda f: Float),
     (int, lambda f: Integer),
-    (dict, lambda f: JSON),
+    (dict, lambda f: JSONB),
 ]
 
 
@@ -109,11 +110,50 @@ def create_table(name, cls):
     columns = [
         create_column(field)
         for field in cls.__fields__.values()
+    ] + [
+        index
+        for field in cls.__fields__.values()
+        for index in create_column_indexes(name, field)
     ] + sa_args
 
     return Table(name, metadata, *columns)
 
 
+def partial_index(name, *columns, where: str, **kwargs):
+    """Returns an index that only covers the rows matching the SQL condition
+    `where`, like `NOT deleted`.
+
+    Postgres uses it for the queries whose condition implies `where`.
+    """
+
+    return Index(name, *columns, postgresql_where=text(where), **kwargs)
+
+
+def create_column_indexes(table_name, field):
+    """Returns the indexes declared by the extras of `field`, in addition to
+    the ones supported by Column.
+
+    `gin_index` declares a GIN index. It is either True or the name of the
+    operator class to use, like `jsonb_path_ops`.
+    """
+
+    indexes = []
+
+    gin_index = field.schema.extra.get("gin_index")
+    if gin_index:
+        ops = {}
+        if isinstance(gin_index, str):
+            ops[field.name] = gin_index
+        indexes.append(Index(
+            f"ix_{table_name}_{field.name}_gin",
+            field.name,
+            postgresql_using = "gin",
+            postgresql_ops = ops,
+        ))
+
+    return indexes
+
+
 def create_column(field):
     type = sa_type_from_field(field)
 
@@ -121,6 +161,7 @@ def create_column(field):
     extra = field.schema.extra
     kwargs = {**extra}
     args = kwargs.pop("args", [])
+    kwargs.pop("gin_index", None)
     if field.required or field.default is not None:
         kwargs["nullable"] = False
     if field.default is not None:
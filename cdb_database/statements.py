@@ -0,0 +1,113 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""A cache of compiled SQL statements.
+
+The query builders (`get_user_query`, `get_item_query`...) build a new
+SQLAlchemy query on every call, which is then compiled to SQL. Queries with
+the same structure only differ by the values of their parameters, so they
+are built and compiled once per combination of flags, with `bindparam()`
+placeholders for the values, and executed with the values of each call.
+
+The compiled SQL is executed directly by asyncpg, which keeps a prepared
+statement per connection for each SQL text it executes, so the statements
+are also parsed and planned once per connection.
+"""
+
+from typing import Any, Callable, Dict, Hashable, Mapping
+
+from sqlalchemy.engine.interfaces import Dialect
+from sqlalchemy.sql import ClauseElement
+from databases.backends.postgres import Record
+
+
+class CompiledStatement:
+    """A query compiled for asyncpg."""
+
+    def __init__(self, query: ClauseElement, dialect: Dialect):
+        # Like databases compiles queries, see PostgresConnection._compile.
+        compiled = query.compile(dialect=dialect)
+
+        self.dialect = dialect
+        self.keys = sorted(compiled.params)
+        self.defaults = compiled.params
+        self.processors = compiled._bind_processors
+        self.result_columns = compiled._result_columns
+        self.sql = compiled.string % {
+            key: f"${index}"
+            for index, key in enumerate(self.keys, start=1)
+        }
+
+    def arguments(self, values: Mapping[str, Any]) -> list:
+        """Returns the arguments of the statement: `values` for the bound
+        parameters, the literal values of the query for the others."""
+
+        arguments = []
+        for key in self.keys:
+            value = values.get(key, self.defaults[key])
+            processor = self.processors.get(key)
+            arguments.append(processor(value) if processor else value)
+        return arguments
+
+    def record(self, row) -> Record:
+        return Record(row, self.result_columns, self.dialect)
+
+
+class StatementCache:
+    """Compiled statements by key. `hits` and `misses` count the lookups.
+    """
+
+    def __init__(self):
+        self._statements = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        key: Hashable,
+        build: Callable[[], ClauseElement],
+        dialect: Dialect,
+    ) -> CompiledStatement:
+        """Returns the statement of `key`, built with `build` and compiled
+        if it is not in the cache.
+
+        `key` must identify the structure of the query, like the builder
+        and the flags it is called with.
+        """
+
+        statement = self._statements.get(key)
+        if statement is None:
+            self.misses += 1
+            statement = CompiledStatement(build(), dialect)
+            self._statements[key] = statement
+        else:
+            self.hits += 1
+        return statement
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            size = len(self._statements),
+            hits = self.hits,
+            misses = self.misses,
+        )
+
+    def clear(self):
+        self._statements.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+statement_cache = StatementCache()
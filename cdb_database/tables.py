@@ -17,10 +17,33 @@
 
 from pydantic import BaseModel, SecretStr
 from sqlalchemy import (
-    ForeignKey, PrimaryKeyConstraint, UniqueConstraint,
+    Column, ForeignKey, PrimaryKeyConstraint, UniqueConstraint, Index,
+    Sequence, BigInteger, DateTime, func,
 )
+from sqlalchemy.dialects.postgresql import TSVECTOR
 
-from .schema import Field, create_table
+from .schema import Field, create_table, partial_index, metadata
+
+
+# Stamps items and fields on every write (including soft deletes), so that
+# clients can fetch what changed since the last revision they saw.
+revision_sequence = Sequence("revision_seq", metadata=metadata)
+
+
+def deleted_at_column():
+    """When the row was soft-deleted. Tombstones are purged some time after
+    (see `cdb_database.purge`)."""
+
+    return Column("deleted_at", DateTime(timezone=True))
+
+
+def revision_column():
+    return Column(
+        "revision",
+        BigInteger,
+        nullable = False,
+        server_default = revision_sequence.next_value(),
+    )
 
 
 class UserDb(BaseModel):
@@ -53,6 +76,22 @@ class CollectionDb(BaseModel):
     class Config:
         sql_alchemy = [
             UniqueConstraint("owner", "name"),
+            # Backs the listing of the collections of a user.
+            partial_index(
+                "ix_collections_owner_title_live",
+                "owner", "title",
+                where = "NOT deleted",
+            ),
+            # Bumped by every write to the collection, its fields or its
+            # items. Backs the ETags of the API.
+            Column("version", BigInteger, nullable=False, server_default="0"),
+            deleted_at_column(),
+            # Backs the selection of the collections to purge.
+            partial_index(
+                "ix_collections_deleted_at",
+                "deleted_at",
+                where = "deleted",
+            ),
         ]
 
 
@@ -76,14 +115,44 @@ class ItemDb(BaseModel):
 
     id: int = Field(..., primary_key=True)
     collection: int = Field(..., ForeignKey("collections.id"), index=True)
-    name: str = Field(..., index=True)
+    name: str = ...
     title: str = ...
-    properties: dict = Field(...)
+    properties: dict = Field(..., gin_index="jsonb_path_ops")
     deleted: bool = False
 
     class Config:
         sql_alchemy = [
             UniqueConstraint("collection", "name"),
+            # Indexes on live items only, which is what almost every query
+            # selects, so that soft-deleted items do not bloat them.
+            partial_index(
+                "ix_items_collection_name_live",
+                "collection", "name",
+                where = "NOT deleted",
+            ),
+            # Backs the keyset pagination of item listings.
+            partial_index(
+                "ix_items_collection_title_id_live",
+                "collection", "title", "id",
+                where = "NOT deleted",
+            ),
+            # Full-text search document, maintained by create_item and
+            # update_item. Not part of the model as it is never returned.
+            Column("search_vector", TSVECTOR),
+            Index(
+                "ix_items_search_vector",
+                "search_vector",
+                postgresql_using = "gin",
+            ),
+            revision_column(),
+            Index("ix_items_collection_revision", "collection", "revision"),
+            deleted_at_column(),
+            # Backs the selection of the items to purge.
+            partial_index(
+                "ix_items_deleted_at",
+                "deleted_at",
+                where = "deleted",
+            ),
         ]
 
     @classmethod
@@ -105,6 +174,21 @@ class FieldDb(BaseModel):
     class Config:
         sql_alchemy = [
             UniqueConstraint("collection", "name"),
+            # Backs the listing of the fields of a collection.
+            partial_index(
+                "ix_fields_collection_sort_index_live",
+                "collection", "sort_index",
+                where = "NOT deleted",
+            ),
+            revision_column(),
+            Index("ix_fields_collection_revision", "collection", "revision"),
+            deleted_at_column(),
+            # Backs the selection of the fields to purge.
+            partial_index(
+                "ix_fields_deleted_at",
+                "deleted_at",
+                where = "deleted",
+            ),
         ]
 
     @classmethod
@@ -112,8 +196,37 @@ class FieldDb(BaseModel):
         return cls(**row)
 
 
+class ItemHistoryDb(BaseModel):
+    """A past version of an item, see `cdb_database.history`.
+    """
+
+    id: int = Field(..., primary_key=True)
+    item: int = Field(..., ForeignKey("items.id"))
+    keyframe: bool = False
+    data: dict = ...
+
+    class Config:
+        sql_alchemy = [
+            # The revision of the item this version was stamped with.
+            Column("revision", BigInteger, nullable=False),
+            # When this version was replaced by the next one.
+            Column(
+                "replaced_at",
+                DateTime(timezone=True),
+                nullable = False,
+                server_default = func.now(),
+            ),
+            Index(
+                "ix_item_history_item_revision",
+                "item", "revision",
+                unique = True,
+            ),
+        ]
+
+
 users = create_table("users", UserDb)
 collections = create_table("collections", CollectionDb)
 user_collections = create_table("user_collections", UserCollection)
 items = create_table("items", ItemDb)
 fields = create_table("fields", FieldDb)
+item_history = create_table("item_history", ItemHistoryDb)
@@ -0,0 +1,374 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Imports and exports of the items of a collection.
+
+Rows are flat: each column is mapped to an item path through the fields of
+the collection. A column named like a field is stored at the path of the
+field, `name` and `title` are the item columns and any other column is
+stored as a top-level property.
+"""
+
+from typing import (
+    Any, AsyncIterable, AsyncIterator, List, Mapping, Optional, Tuple,
+)
+import json
+
+from pydantic import BaseModel
+from sqlalchemy import (
+    select, and_, case, cast, literal, table, column,
+    BigInteger, Boolean, Float, Integer, UnicodeText, false, null,
+)
+from sqlalchemy.dialects.postgresql import insert
+from databases import Database
+
+from .tables import FieldDb, items, revision_sequence
+from .error import InvalidQueryError
+from .expression import field_sql_type, projection_columns
+from .field import get_fields
+from .collection import lock_collection, bump_collection_version
+from .history import record_item_history
+from .item import item_columns, item_search_vector
+
+
+IMPORT_TABLE = "item_import"
+
+# The number of imported rows copied to the staging table at once.
+IMPORT_BATCH_SIZE = 10000
+
+# The staging table the imported rows are copied into. It is a temporary
+# table, so it is private to the connection and not WAL-logged.
+import_table = table(
+    IMPORT_TABLE,
+    column("line", BigInteger),
+    column("name", UnicodeText),
+    column("title", UnicodeText),
+    column("properties", UnicodeText),
+)
+
+_true_strings = {"true", "yes", "1"}
+_false_strings = {"false", "no", "0"}
+
+
+class ImportResult(BaseModel):
+    """The number of items created and updated by an import."""
+
+    created: int = 0
+    updated: int = 0
+
+
+def column_paths(
+    fields: List[FieldDb],
+    columns: List[str],
+) -> List[Tuple[str, Optional[FieldDb]]]:
+    """Returns the item path and the field (if any) of each column."""
+
+    by_name = {field.name: field for field in fields}
+
+    paths = []
+    for name in columns:
+        field = by_name.get(name)
+        if field is not None:
+            paths.append((field.field, field))
+        elif name in ("name", "title"):
+            paths.append((name, None))
+        else:
+            paths.append((f"properties.{name}", None))
+
+    return paths
+
+
+def parse_text_value(field: Optional[FieldDb], text: str) -> Any:
+    """Converts `text` to the type of `field`. Raises ValueError if it is
+    invalid."""
+
+    if field is None:
+        return text
+
+    sql_type = field_sql_type(field.type)
+    if sql_type is BigInteger:
+        return int(text)
+    if sql_type is Float:
+        return float(text)
+    if sql_type is Boolean:
+        if text.lower() in _true_strings:
+            return True
+        if text.lower() in _false_strings:
+            return False
+        raise ValueError(f"invalid boolean {text!r}")
+    return text
+
+
+def _import_record(
+    line: int,
+    row: Mapping[str, Any],
+    paths: dict,
+    from_text: bool,
+) -> Tuple[int, str, str, str]:
+    item = {"properties": {}}
+    for key, value in row.items():
+        path, field = paths[key]
+        if from_text:
+            if value == "":
+                continue
+            try:
+                value = parse_text_value(field, value)
+            except ValueError as error:
+                raise InvalidQueryError(f"Line {line}, {key!r}: {error}.")
+
+        *parents, last = path.split(".")
+        if parents[:1] != ["properties"] and path not in ("name", "title"):
+            # Like `id`, which can not be imported.
+            continue
+        target = item
+        for parent in parents:
+            target = target.setdefault(parent, {})
+            if not isinstance(target, dict):
+                raise InvalidQueryError(
+                    f"Line {line}: conflicting paths for {path!r}.")
+        target[last] = value
+
+    name = item.get("name")
+    if not isinstance(name, str) or not name:
+        raise InvalidQueryError(f"Line {line}: missing item name.")
+    title = item.get("title", name)
+    if not isinstance(title, str):
+        raise InvalidQueryError(f"Line {line}: invalid title.")
+
+    return line, name, title, json.dumps(item["properties"])
+
+
+async def import_items(
+    database: Database,
+    collection_id: int,
+    rows: AsyncIterable[Mapping[str, Any]],
+    *,
+    from_text: bool = False,
+) -> ImportResult:
+    """Creates or updates the items of a collection from flat rows.
+
+    Rows are copied to a staging table by batches as they come, then merged
+    into the items in a single statement: new items are created, existing
+    ones are updated, their properties being merged with the imported ones,
+    and deleted ones are restored with the imported properties only. If a
+    name appears more than once, the last row wins.
+
+    If `from_text` is True, the values are strings (like CSV cells) which
+    are converted to the types of the fields, empty strings being ignored.
+    """
+
+    fields = await get_fields(database, collection_id)
+
+    async def batches():
+        paths = {}
+        line = 0
+        batch = []
+        async for row in rows:
+            line += 1
+            for key in row:
+                if key not in paths:
+                    paths[key] = column_paths(fields, [key])[0]
+            batch.append(_import_record(line, row, paths, from_text))
+            if len(batch) == IMPORT_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async with database.connection() as connection:
+        async with connection.transaction():
+            raw_connection = connection.raw_connection
+            await raw_connection.execute(
+                f"CREATE TEMPORARY TABLE {IMPORT_TABLE} ("
+                "line bigint, name text, title text, properties text"
+                ") ON COMMIT DROP"
+            )
+            # asyncpg only copies from a synchronous iterable, so the rows
+            # are buffered and copied by batches.
+            async for batch in batches():
+                await raw_connection.copy_records_to_table(
+                    IMPORT_TABLE,
+                    records = batch,
+                )
+
+            result = await _merge_import(database, collection_id)
+
+            # Dropped now in case of another import in the same transaction.
+            await raw_connection.execute(f"DROP TABLE {IMPORT_TABLE}")
+            # Many rows may have changed, update the statistics of the
+            # planner instead of waiting for autovacuum.
+            await raw_connection.execute("ANALYZE items")
+
+    return result
+
+
+async def _merge_import(
+    database: Database,
+    collection_id: int,
+) -> ImportResult:
+    staged = (
+        select([
+            import_table.c.name,
+            import_table.c.title,
+            cast(import_table.c.properties, items.c.properties.type)
+                .label("properties"),
+        ])
+        .distinct(import_table.c.name)
+        .order_by(import_table.c.name, import_table.c.line.desc())
+        .alias("staged")
+    )
+
+    await lock_collection(database, collection_id)
+
+    # The versions replaced by the import, for the history. The rows are
+    # locked so that they do not change before the merge.
+    previous = (
+        select([items.c.id] + [
+            items.c[key]
+            for key in ["name", "title", "properties", "deleted", "revision"]
+        ])
+        .where(and_(
+            items.c.collection == collection_id,
+            items.c.name.in_(select([import_table.c.name])),
+        ))
+        .with_for_update()
+    )
+    previous = {
+        row["id"]: row
+        for row in await database.fetch_all(previous)
+    }
+
+    query = insert(items).from_select(
+        ["collection", "name", "title", "properties", "deleted",
+         "search_vector"],
+        select([
+            literal(collection_id, Integer),
+            staged.c.name,
+            staged.c.title,
+            staged.c.properties,
+            false(),
+            item_search_vector(
+                staged.c.name,
+                staged.c.title,
+                staged.c.properties,
+            ),
+        ]),
+    )
+    # Deleted items are replaced, their old properties must not reappear.
+    properties = case(
+        [(items.c.deleted, query.excluded.properties)],
+        else_ = items.c.properties.op("||")(query.excluded.properties),
+    )
+    query = (
+        query
+        .on_conflict_do_update(
+            index_elements = ["collection", "name"],
+            set_ = dict(
+                title = query.excluded.title,
+                properties = properties,
+                deleted = false(),
+                deleted_at = null(),
+                search_vector = item_search_vector(
+                    items.c.name,
+                    query.excluded.title,
+                    properties,
+                ),
+                revision = revision_sequence.next_value(),
+            ),
+        )
+        .returning(
+            items.c.id,
+            items.c.name,
+            items.c.title,
+            items.c.properties,
+            items.c.deleted,
+        )
+    )
+
+    result = ImportResult()
+    updated = []
+    for row in await database.fetch_all(query):
+        old = previous.get(row["id"])
+        if old is None:
+            result.created += 1
+        else:
+            result.updated += 1
+            updated.append(dict(
+                row,
+                **{
+                    f"old_{key}": value
+                    for key, value in old.items()
+                },
+            ))
+
+    await record_item_history(database, updated)
+    if result.created or result.updated:
+        await bump_collection_version(database, collection_id)
+
+    return result
+
+
+def export_columns(fields: List[FieldDb]) -> List[Tuple[str, str]]:
+    """Returns the name and the item path of the columns of an export: the
+    name and title of the items, then the fields of the collection.
+
+    This is the mapping used by imports, so that an export can be imported
+    back.
+    """
+
+    columns = [("name", "name"), ("title", "title")]
+    names = {"name", "title"}
+    for field in fields:
+        if field.field in names or field.name in names:
+            continue
+        columns.append((field.name, field.field))
+        names.add(field.name)
+
+    return columns
+
+
+async def export_items(
+    database: Database,
+    collection_id: int,
+) -> Tuple[List[str], AsyncIterator[tuple]]:
+    """Returns the column names of an export of the items of a collection,
+    and an iterator over the rows, as tuples of values.
+
+    Rows are fetched through a server-side cursor, ordered by id. JSON values
+    are extracted by Postgres, so that only the exported values are
+    transferred.
+    """
+
+    fields = await get_fields(database, collection_id)
+    columns = export_columns(fields)
+    paths = [path for _, path in columns]
+
+    query = (
+        select(projection_columns(items, paths, item_columns))
+        .where(and_(
+            items.c.collection == collection_id,
+            ~items.c.deleted,
+        ))
+        .order_by(items.c.id)
+    )
+
+    def values(row):
+        return tuple(row[index] for index in range(len(columns)))
+
+    return (
+        [name for name, _ in columns],
+        database.stream(query, values),
+    )
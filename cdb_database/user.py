@@ -18,7 +18,7 @@
 from typing import List, Union
 from pydantic import BaseModel, SecretStr
 
-from sqlalchemy import select
+from sqlalchemy import select, bindparam
 from databases import Database
 
 from .tables import (
@@ -95,18 +95,25 @@ async def get_user(
     if arg_sum != 1:
         raise TypeError("get_user: invalid arguments")
 
-    query = get_user_query(
-        include_disabled = include_disabled,
-    )
-
     if user_id is not None:
-        query = query.where(users.c.id == user_id)
+        column, value = users.c.id, user_id
     elif username is not None:
-        query = query.where(users.c.username == username)
+        column, value = users.c.username, username
     else:
-        query = query.where(users.c.email == email)
-
-    return await database.one(query, UserDb.from_row)
+        column, value = users.c.email, email
+
+    def build():
+        return (
+            get_user_query(include_disabled=include_disabled)
+            .where(column == bindparam("value"))
+        )
+
+    return await database.one_cached(
+        ("get_user", column.name, include_disabled),
+        build,
+        dict(value=value),
+        UserDb.from_row,
+    )
 
 
 async def get_users(
@@ -116,11 +123,19 @@ async def get_users(
     order_by_username: bool = True,
 ) -> List[UserDb]:
 
-    query = get_user_query(
-        include_disabled = include_disabled,
-    )
+    def build():
+        query = get_user_query(
+            include_disabled = include_disabled,
+        )
 
-    if order_by_username:
-        query = query.order_by(users.c.username)
+        if order_by_username:
+            query = query.order_by(users.c.username)
 
-    return await database.all(query, UserDb.from_row)
+        return query
+
+    return await database.all_cached(
+        ("get_users", include_disabled, order_by_username),
+        build,
+        {},
+        UserDb.from_row,
+    )
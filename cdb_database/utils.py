@@ -15,6 +15,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from sqlalchemy import text, bindparam, column
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import ARRAY
+
 
 def print_query(query):
     compiled = query.compile()
@@ -28,3 +32,43 @@ def raise_if_all_none(**kwargs):
             return
     arg_list = ", ".join(kwargs.keys())
     raise TypeError(f"One of the following argument must be set: {arg_list}")
+
+
+def unnest(name: str, arrays: dict):
+    """Returns a subquery called `name` whose rows are built by zipping
+    arrays, like `unnest(...)` does in Postgres.
+
+    `arrays` maps column names to `(type, values)` tuples. Each array is
+    sent as a single parameter, which is much cheaper than a VALUES list
+    when there are many rows.
+    """
+
+    dialect = postgresql.dialect()
+
+    params = []
+    casts = []
+    columns = []
+    for column_name, (type_, values) in arrays.items():
+        param = bindparam(
+            f"{name}_{column_name}",
+            value = list(values),
+            type_ = ARRAY(type_),
+        )
+        params.append(param)
+        casts.append(
+            f"CAST(:{param.key} AS {ARRAY(type_).compile(dialect=dialect)})"
+        )
+        columns.append(column(column_name, type_))
+
+    statement = "SELECT * FROM unnest({}) AS {}({})".format(
+        ", ".join(casts),
+        name,
+        ", ".join(arrays),
+    )
+
+    return (
+        text(statement)
+        .bindparams(*params)
+        .columns(*columns)
+        .alias(name)
+    )
@@ -224,6 +224,34 @@ def test_get_other_collections(client, user_headers):
     assert response.json() == expected
 
 
+def test_get_projected_collections(client, user_headers):
+    response = client.get(
+        "/users/admin/collections",
+        params = dict(fields="name,can_edit"),
+        headers = user_headers,
+    )
+
+    expected = [
+        dict(name=admin_public_col.name, can_edit=False),
+        dict(name=admin_shared_col.name, can_edit=False),
+        dict(name=admin_shared_edit_col.name, can_edit=True),
+    ]
+
+    assert response.status_code == 200
+    assert response.json() == expected
+
+
+def test_get_projected_collections_invalid(client, user_headers):
+    response = client.get(
+        "/users/admin/collections",
+        params = dict(fields="name,owner.foo"),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 400
+    assert "detail" in response.json()
+
+
 def test_get_deleted_user_collections(client, user_headers):
     response = client.get(
         "/users/deleted/collections",
@@ -952,3 +980,28 @@ def test_delete_inexistant_collection_as_admin(client, admin_headers):
 
     assert response.status_code == 404
     assert "detail" in response.json()
+
+
+def test_get_collection_not_modified(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test",
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = client.get(
+        "/users/test/collections/test",
+        headers = {**user_headers, "If-None-Match": f"W/{etag}"},
+    )
+
+    assert response.status_code == 304
+
+    response = client.get(
+        "/users/test/collections/test",
+        headers = {**user_headers, "If-None-Match": '"other"'},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] == etag
@@ -0,0 +1,260 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+
+import pytest
+from asyncpg.exceptions import ReadOnlySQLTransactionError
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.testclient import TestClient
+from fastapi import APIRouter, FastAPI
+
+import cdb_api
+from cdb_database import Database
+from cdb_api.db import (
+    RequestDatabase, DatabaseRoute, transaction, transaction_policy,
+    CONSISTENCY_TOKEN_HEADER,
+)
+
+
+TRANSACTION_SETTINGS = """
+    SELECT
+        current_setting('transaction_read_only') AS read_only,
+        current_setting('transaction_isolation') AS isolation
+"""
+
+
+def run(coroutine):
+    # On the loop of the client, which owns the connection pool.
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+def test_read_only_transaction(client_no_rollback):
+    async def test():
+        db = RequestDatabase(cdb_api.db.database, read_only=True)
+        assert not db.in_transaction
+
+        row = await db.fetch_one(TRANSACTION_SETTINGS)
+        assert db.in_transaction
+        assert row["read_only"] == "on"
+        assert row["isolation"] == "serializable"
+
+        with pytest.raises(ReadOnlySQLTransactionError):
+            await db.execute("UPDATE users SET email = email WHERE false")
+
+        await db.release(commit=False)
+        assert not db.in_transaction
+
+        # Queries after the release run in their own transaction.
+        row = await db.fetch_one(TRANSACTION_SETTINGS)
+        assert not db.in_transaction
+        assert row["read_only"] == "off"
+
+    run(test())
+
+
+def test_read_write_transaction(client_no_rollback):
+    async def test():
+        db = RequestDatabase(cdb_api.db.database)
+
+        first = await db.fetch_val("SELECT now() AS now", column="now")
+        await asyncio.sleep(0.01)
+        second = await db.fetch_val("SELECT now() AS now", column="now")
+        assert first == second
+
+        row = await db.fetch_one(TRANSACTION_SETTINGS)
+        assert row["read_only"] == "off"
+
+        await db.release()
+        await db.release()
+
+        third = await db.fetch_val("SELECT now() AS now", column="now")
+        assert third > first
+
+    run(test())
+
+
+def test_no_transaction(client_no_rollback):
+    async def test():
+        db = RequestDatabase(cdb_api.db.database, use_transaction=False)
+
+        await db.fetch_one("SELECT 1 AS one")
+        assert not db.in_transaction
+
+    run(test())
+
+
+def test_isolation(client_no_rollback):
+    async def test():
+        db = RequestDatabase(
+            cdb_api.db.database,
+            read_only = True,
+            isolation = "REPEATABLE READ",
+        )
+        row = await db.fetch_one(TRANSACTION_SETTINGS)
+        assert row["isolation"] == "repeatable read"
+        assert row["read_only"] == "on"
+        await db.release()
+
+    run(test())
+
+
+def test_snapshot_policy():
+    endpoint = next(
+        route.endpoint
+        for route in cdb_api.app.routes
+        if route.path.endswith("/snapshot")
+    )
+
+    assert endpoint.read_only
+    assert endpoint.isolation == "REPEATABLE READ"
+
+
+def test_replica(client_no_rollback):
+    # A second pool on the test database stands for the replica. As it is
+    # not in recovery, it has "replayed" everything written so far.
+    async def test():
+        replica = Database(cdb_api.db.database_url)
+        await replica.connect()
+        try:
+            db = RequestDatabase(
+                cdb_api.db.database,
+                replica = replica,
+                read_only = True,
+                min_lsn = "0/0",
+            )
+            row = await db.fetch_one(TRANSACTION_SETTINGS)
+            assert db.on_replica
+            assert row["isolation"] == "repeatable read"
+            assert row["read_only"] == "on"
+            await db.release()
+
+            db = RequestDatabase(
+                cdb_api.db.database,
+                replica = replica,
+                read_only = True,
+                min_lsn = "FFFFFFFF/FFFFFFFF",
+            )
+            row = await db.fetch_one(TRANSACTION_SETTINGS)
+            assert not db.on_replica
+            assert row["isolation"] == "serializable"
+            await db.release()
+        finally:
+            await replica.disconnect()
+
+    run(test())
+
+
+def test_consistency_token(client_no_rollback):
+    async def test():
+        response = Response()
+        db = RequestDatabase(
+            cdb_api.db.database,
+            track_lsn = True,
+            response = response,
+        )
+        await db.fetch_one(TRANSACTION_SETTINGS)
+        await db.release()
+
+        token = db.consistency_token
+        assert token is not None
+        assert response.headers[CONSISTENCY_TOKEN_HEADER] == token
+
+        db = RequestDatabase(
+            cdb_api.db.database,
+            read_only = True,
+            track_lsn = True,
+        )
+        await db.fetch_one(TRANSACTION_SETTINGS)
+        await db.release()
+        assert db.consistency_token is None
+
+    run(test())
+
+
+def test_invalid_consistency_token(client, user_headers_no_rollback):
+    response = client.get(
+        "/users/test/collections",
+        headers = {
+            **user_headers_no_rollback,
+            CONSISTENCY_TOKEN_HEADER: "not a token",
+        },
+    )
+
+    assert response.status_code == 400
+
+
+def test_transaction_policy():
+    @transaction_policy(read_only=True)
+    async def endpoint(value: int):
+        return value
+
+    route = DatabaseRoute("/test", endpoint, methods=["POST"])
+
+    assert route.endpoint.read_only
+    assert route.endpoint.__wrapped__ is endpoint
+    assert run(route.endpoint(value=42)) == 42
+
+    with pytest.raises(ValueError):
+        transaction_policy(read_only=True, isolation="CHAOS")
+
+
+def test_release_before_serialization(client_no_rollback, monkeypatch):
+    # Requests of the test mode have no transaction.
+    monkeypatch.setattr(cdb_api.settings, "test", False)
+
+    router = APIRouter(route_class=DatabaseRoute)
+    databases = []
+    in_transaction = []
+
+    class CheckedResponse(JSONResponse):
+        def render(self, content):
+            in_transaction.append(databases[-1].in_transaction)
+            return super().render(content)
+
+    @router.get("/value", response_class=CheckedResponse)
+    async def get_value(db: Database = transaction):
+        databases.append(db)
+        return await db.fetch_val("SELECT 42 AS value", column="value")
+
+    @router.get("/stream")
+    async def get_stream(db: Database = transaction):
+        databases.append(db)
+        await db.fetch_one("SELECT 1 AS one")
+
+        async def content():
+            for value in range(2):
+                in_transaction.append(db.in_transaction)
+                yield str(value).encode()
+
+        return StreamingResponse(content())
+
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+
+    response = client.get("/value")
+    assert response.json() == 42
+    # Serialized once the connection is back in the pool.
+    assert in_transaction == [False]
+
+    in_transaction.clear()
+    response = client.get("/stream")
+    assert response.content == b"01"
+    # Streamed bodies are read in the transaction of the request.
+    assert in_transaction == [True, True]
+    assert not databases[-1].in_transaction
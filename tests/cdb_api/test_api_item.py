@@ -16,6 +16,8 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import json
+
 import pytest
 
 from cdb_database.test_db import (
@@ -39,6 +41,7 @@ from cdb_database.test_db import (
     test_public_items,
     test_deleted_items,
     disabled_public_items,
+    test_test_fields,
 )
 
 
@@ -181,6 +184,335 @@ def test_get_items_in_other_public_collection(client, user_headers):
     assert response.json() == expected
 
 
+def test_get_items_paginated(client, user_headers):
+    expected = [
+        item.dict()
+        for item in sorted(test_test_items, key=lambda i: (i.title, i.id))
+    ]
+
+    result = []
+    params = dict(limit=3)
+    while True:
+        response = client.get(
+            "/users/test/collections/test/items",
+            params = params,
+            headers = user_headers,
+        )
+
+        assert response.status_code == 200
+        assert len(response.json()) <= 3
+        result += response.json()
+
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+
+    assert result == expected
+
+
+def test_get_items_invalid_cursor(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(limit=3, cursor="foobar"),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 400
+    assert "detail" in response.json()
+
+
+def test_search_items(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(q="item_05"),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json() == [test_test_items[4].dict()]
+
+
+def test_filter_items(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(filter="index >= 9"),
+        headers = user_headers,
+    )
+
+    expected = [
+        item.dict()
+        for item in sorted(test_test_items[8:], key=lambda i: i.title)
+    ]
+
+    assert response.status_code == 200
+    assert response.json() == expected
+
+
+def test_filter_items_invalid(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(filter="index >"),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 400
+    assert "detail" in response.json()
+
+
+def test_sort_items(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(sort="-index"),
+        headers = user_headers,
+    )
+
+    expected = [
+        item.dict()
+        for item in reversed(test_test_items)
+    ]
+
+    assert response.status_code == 200
+    assert response.json() == expected
+
+
+def test_get_projected_items(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(fields="title,properties", limit=3),
+        headers = user_headers,
+    )
+
+    expected = [
+        item.dict(include={"title", "properties"})
+        for item in sorted(test_test_items, key=lambda i: i.title)[:3]
+    ]
+
+    assert response.status_code == 200
+    assert response.json() == expected
+    assert "X-Next-Cursor" in response.headers
+
+
+def test_stream_items_ndjson(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(stream="ndjson"),
+        headers = user_headers,
+    )
+
+    expected = [
+        item.dict()
+        for item in sorted(test_test_items, key=lambda i: i.title)
+    ]
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [
+        json.loads(line)
+        for line in response.text.splitlines()
+    ] == expected
+
+
+def test_stream_items_json(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(stream="json", fields="name", filter="index > 8"),
+        headers = user_headers,
+    )
+
+    expected = [
+        dict(name=item.name)
+        for item in sorted(test_test_items[8:], key=lambda i: i.title)
+    ]
+
+    assert response.status_code == 200
+    assert response.json() == expected
+
+
+def test_stream_items_invalid_filter(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(stream="json", filter="index >"),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 400
+    assert "detail" in response.json()
+
+
+def test_get_collection_snapshot(client, user_headers):
+    collection = client.get(
+        "/users/test/collections/test",
+        headers = user_headers,
+    ).json()
+
+    response = client.get(
+        "/users/test/collections/test/snapshot",
+        params = dict(limit=3),
+        headers = user_headers,
+    )
+
+    items = sorted(test_test_items, key=lambda i: i.title)
+
+    assert response.status_code == 200
+    snapshot = response.json()
+    assert snapshot["collection"] == collection
+    assert snapshot["fields"] == [
+        field.dict()
+        for field in sorted(test_test_fields, key=lambda f: f.sort_index)
+    ]
+    assert snapshot["items"] == [item.dict() for item in items[:3]]
+
+    response = client.get(
+        "/users/test/collections/test/snapshot",
+        params = dict(limit=3, cursor=snapshot["next_cursor"]),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json()["items"] == [item.dict() for item in items[3:6]]
+
+
+def test_get_collection_snapshot_other_private(client, user_headers):
+    response = client.get(
+        "/users/admin/collections/private/snapshot",
+        headers = user_headers,
+    )
+
+    assert response.status_code == 404
+    assert "detail" in response.json()
+
+
+def test_get_items_not_modified(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items",
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert response.headers["Vary"] == "Authorization"
+
+    response = client.get(
+        "/users/test/collections/test/items",
+        headers = {**user_headers, "If-None-Match": etag},
+    )
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    response = client.put(
+        f"/users/test/collections/test/items/{test_test_items[0].name}",
+        json = dict(test_test_items[0].dict(), title="New title"),
+        headers = user_headers,
+    )
+    assert response.status_code == 200
+
+    for path in ("items", "fields", "snapshot"):
+        response = client.get(
+            f"/users/test/collections/test/{path}",
+            headers = {**user_headers, "If-None-Match": etag},
+        )
+
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+
+def test_get_items_since(client, user_headers, admin_headers):
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(since=0),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    delta = response.json()
+    assert delta["items"] == [item.dict() for item in test_test_items]
+
+    item = test_test_items[4]
+    response = client.delete(
+        f"/users/test/collections/test/items/{item.name}",
+        headers = user_headers,
+    )
+    assert response.status_code == 200
+
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(since=delta["revision"]),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    revision = response.json()["revision"]
+    assert revision > delta["revision"]
+    # Only admins see the content of deleted items.
+    assert response.json()["items"] == [dict(
+        id = item.id,
+        collection = item.collection,
+        name = item.name,
+        deleted = True,
+        revision = revision,
+    )]
+
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(since=delta["revision"]),
+        headers = admin_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json()["items"] == [dict(item.dict(), deleted=True)]
+
+    response = client.get(
+        "/users/test/collections/test/fields",
+        params = dict(since=0),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json()["fields"] == [
+        field.dict()
+        for field in test_test_fields
+    ]
+
+
+def test_get_items_since_invalid(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items",
+        params = dict(since=0, q="foo"),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 400
+    assert "detail" in response.json()
+
+
+def test_get_item_facets(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items:facets",
+        params = dict(field=["index", "title"], filter="index > 8", size=1),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    index, title = response.json()
+    assert index["count"] == 2
+    assert (index["min"], index["max"], index["avg"]) == (9, 10, 9.5)
+    assert sum(bucket["count"] for bucket in index["histogram"]) == 2
+    assert title["values"] == [dict(value="Item #10", count=1)]
+
+
+def test_get_item_facets_invalid_field(client, user_headers):
+    response = client.get(
+        "/users/test/collections/test/items:facets",
+        params = dict(field="foo"),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 400
+    assert "detail" in response.json()
+
+
 def test_get_items_in_other_private_collection(client, user_headers):
     response = client.get(
         "/users/admin/collections/private/items",
@@ -336,6 +668,73 @@ def test_create_item_in_other_shared_edit_collection(client, user_headers):
     assert response.json() == expected
 
 
+def test_create_items_in_owned_collection(client, user_headers):
+    response = client.post(
+        "/users/test/collections/test/items:bulk",
+        json = [
+            dict(name="new-1", title="New 1", properties=dict(stuff="foo")),
+            dict(name=test_test_items[3].name, title="Dup", properties={}),
+            dict(title="No name", properties={}),
+            dict(name="new-2", title="New 2", properties={}),
+        ],
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 2
+    assert [error["index"] for error in result["errors"]] == [1, 2]
+    assert result["errors"][0]["name"] == test_test_items[3].name
+
+    response = client.get(
+        "/users/test/collections/test/items/new-2",
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json()["title"] == "New 2"
+
+
+def test_create_items_ndjson(client, user_headers):
+    response = client.post(
+        "/users/test/collections/test/items:bulk",
+        data = "\n".join([
+            json.dumps(dict(name="new-1", title="New 1", properties={})),
+            "",
+            "{not json",
+            json.dumps(dict(name="new-2", title="New 2", properties={})),
+        ]),
+        headers = {**user_headers, "Content-Type": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 2
+    assert [error["index"] for error in result["errors"]] == [1]
+
+
+def test_create_items_invalid_body(client, user_headers):
+    response = client.post(
+        "/users/test/collections/test/items:bulk",
+        json = dict(name="new-1", title="New 1"),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 400
+    assert "detail" in response.json()
+
+
+def test_create_items_in_other_shared_collection(client, user_headers):
+    response = client.post(
+        "/users/admin/collections/shared/items:bulk",
+        json = [dict(name="new-1", title="New 1")],
+        headers = user_headers,
+    )
+
+    assert response.status_code == 403
+    assert "detail" in response.json()
+
+
 def test_update_item_in_owned_private_collection(client, user_headers):
     item_dict = dict(
         name = "new-item",
@@ -483,6 +882,139 @@ def test_update_item_in_other_shared_edit_collection(client, user_headers):
     assert response.json() == expected
 
 
+def test_patch_item_in_owned_collection(client, user_headers):
+    item = test_test_items[2]
+
+    response = client.patch(
+        f"/users/test/collections/test/items/{item.name}",
+        data = json.dumps(dict(properties=dict(index=None, stuff="foo"))),
+        headers = {
+            **user_headers,
+            "Content-Type": "application/merge-patch+json",
+        },
+    )
+
+    expected = dict(item.dict(), properties=dict(stuff="foo"))
+
+    assert response.status_code == 200
+    assert response.json() == expected
+
+
+def test_patch_inexistant_item(client, user_headers):
+    response = client.patch(
+        "/users/test/collections/test/items/does-not-exist",
+        json = dict(title="Foo"),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 404
+    assert "detail" in response.json()
+
+
+def test_patch_item_in_other_shared_collection(client, user_headers):
+    response = client.patch(
+        f"/users/admin/collections/shared/items/{admin_shared_items[0].name}",
+        json = dict(title="Foo"),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 403
+    assert "detail" in response.json()
+
+
+def test_update_items_in_owned_collection(client, user_headers):
+    response = client.patch(
+        "/users/test/collections/test/items:bulk",
+        json = [
+            dict(
+                name = test_test_items[0].name,
+                changes = dict(title="New title"),
+            ),
+            dict(
+                name = test_test_items[1].name,
+                changes = dict(properties=dict(stuff="foobar")),
+            ),
+        ],
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    assert sorted(response.json(), key=lambda i: i["id"]) == [
+        dict(test_test_items[0].dict(), title="New title"),
+        dict(test_test_items[1].dict(), properties=dict(stuff="foobar")),
+    ]
+
+
+def test_update_items_duplicate(client, user_headers):
+    response = client.patch(
+        "/users/test/collections/test/items:bulk",
+        json = [
+            dict(name=test_test_items[0].name, changes=dict(title="A")),
+            dict(name=test_test_items[0].name, changes=dict(title="B")),
+        ],
+        headers = user_headers,
+    )
+
+    assert response.status_code == 400
+    assert "detail" in response.json()
+
+
+def test_update_items_in_other_shared_collection(client, user_headers):
+    response = client.patch(
+        "/users/admin/collections/shared/items:bulk",
+        json = [
+            dict(name=admin_shared_items[0].name, changes=dict(title="A")),
+        ],
+        headers = user_headers,
+    )
+
+    assert response.status_code == 403
+    assert "detail" in response.json()
+
+
+def test_delete_items_owned_collection(client, user_headers):
+    response = client.post(
+        "/users/test/collections/test/items:delete",
+        json = dict(
+            names = [test_test_items[0].name],
+            filter = "index < 3",
+        ),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json() == dict(deleted=1)
+
+    response = client.get(
+        f"/users/test/collections/test/items/{test_test_items[0].name}",
+        headers = user_headers,
+    )
+
+    assert response.status_code == 404
+
+
+def test_delete_items_no_selection(client, user_headers):
+    response = client.post(
+        "/users/test/collections/test/items:delete",
+        json = dict(),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 400
+    assert "detail" in response.json()
+
+
+def test_delete_items_other_shared_collection(client, user_headers):
+    response = client.post(
+        "/users/admin/collections/shared/items:delete",
+        json = dict(filter="true"),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 403
+    assert "detail" in response.json()
+
+
 def test_delete_item_owned_private_collection(client, user_headers):
     response = client.delete(
         "/users/test/collections/test/items/item_03",
@@ -543,4 +1075,31 @@ def test_delete_item_other_shared_edit_collection(client, user_headers):
     assert "detail" in response.json()
 
 
+def test_get_item_history(client, user_headers):
+    item = test_test_items[2]
+    url = f"/users/test/collections/test/items/{item.name}"
+
+    response = client.patch(url, json=dict(title="Foo"), headers=user_headers)
+    assert response.status_code == 200
+
+    response = client.get(f"{url}/history", headers=user_headers)
+
+    assert response.status_code == 200
+    history = response.json()
+    assert len(history) == 2
+    assert history[0]["replaced_at"] is None
+
+    response = client.get(
+        f"{url}/history/{history[1]['revision']}",
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json() == item.dict()
+
+    response = client.get(f"{url}/history/0", headers=user_headers)
+
+    assert response.status_code == 404
+
+
 # Admin tests -----------------------------------------------------------------
@@ -0,0 +1,197 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+import json
+
+import pytest
+
+from concurrent.futures import ProcessPoolExecutor
+
+from cdb_api.stream import csv_records
+from cdb_api.transfer import attachment_disposition, export_stream
+from cdb_database.test_db import test_test_items
+
+
+def run(coroutine):
+    # Not asyncio.run, which would unset the loop used by the client.
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_csv_records():
+    async def chunks():
+        yield b'\xef\xbb\xbfname,title\r\nfoo,"multi\r\nline'
+        yield b' ""title"""\r\n\r\nb'
+        yield b"ar,Bar"
+
+    async def records():
+        return [record async for record in csv_records(chunks())]
+
+    assert run(records()) == [
+        ["name", "title"],
+        ["foo", 'multi\r\nline "title"'],
+        ["bar", "Bar"],
+    ]
+
+
+def test_import_csv(client, user_headers):
+    item = test_test_items[0]
+    response = client.post(
+        "/users/test/collections/test/import",
+        data = f"name,title,index\nnew,New,1\n{item.name},Updated,2\n",
+        headers = {**user_headers, "Content-Type": "text/csv"},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == dict(created=1, updated=1)
+
+    response = client.get(
+        "/users/test/collections/test/items/new",
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json()["properties"] == dict(index=1)
+
+
+def test_import_ndjson(client, user_headers):
+    response = client.post(
+        "/users/test/collections/test/import?format=ndjson",
+        data = "\n".join(json.dumps(row) for row in [
+            dict(name="a", index=1),
+            dict(name="b", title="B", index=2),
+        ]),
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json() == dict(created=2, updated=0)
+
+
+@pytest.mark.parametrize("data, content_type", [
+    ("name,title\nfoo\n", "text/csv"),
+    ("[1, 2]", "application/x-ndjson"),
+    ("name\nfoo\n", "text/plain"),
+])
+def test_import_invalid(client, user_headers, data, content_type):
+    response = client.post(
+        "/users/test/collections/test/import",
+        data = data,
+        headers = {**user_headers, "Content-Type": content_type},
+    )
+
+    assert response.status_code == 400
+    assert "detail" in response.json()
+
+
+def test_import_in_other_shared_collection(client, user_headers):
+    response = client.post(
+        "/users/admin/collections/shared/import",
+        data = "name\nfoo\n",
+        headers = {**user_headers, "Content-Type": "text/csv"},
+    )
+
+    assert response.status_code == 403
+    assert "detail" in response.json()
+
+
+@pytest.mark.parametrize("format, expected", [
+    ("csv", "a,b\r\n" + "".join(f"{i},\r\n" for i in range(10))),
+    ("ndjson", "".join(f'{{"a":{i}}}\n' for i in range(10))),
+])
+def test_export_stream_pool(format, expected):
+    async def rows():
+        for i in range(10):
+            yield (i, None)
+
+    async def export(pool):
+        chunks = export_stream(
+            format,
+            ["a", "b"],
+            rows(),
+            pool = pool,
+            batch_size = 3,
+        )
+        return b"".join([chunk async for chunk in chunks]).decode()
+
+    assert run(export(None)) == expected
+    with ProcessPoolExecutor(2) as pool:
+        assert run(export(pool)) == expected
+
+
+@pytest.mark.parametrize("format, content_type", [
+    ("csv", "text/csv"),
+    ("ndjson", "application/x-ndjson"),
+])
+def test_export(client, user_headers, format, content_type):
+    response = client.get(
+        f"/users/test/collections/test/export?format={format}",
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith(content_type)
+
+    response = client.post(
+        f"/users/test/collections/test/import?format={format}",
+        data = response.content,
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json() == dict(
+        created = 0,
+        updated = len(test_test_items),
+    )
+
+
+def test_attachment_disposition():
+    assert attachment_disposition('Café "1".csv') == (
+        "attachment; filename=\"Caf_ _1_.csv\"; "
+        "filename*=UTF-8''Caf%C3%A9%20%221%22.csv"
+    )
+
+
+def test_export_unicode_name(client, user_headers):
+    response = client.post(
+        "/users/test/collections",
+        json = dict(name="œuvre", title="Œuvre"),
+        headers = user_headers,
+    )
+    assert response.status_code == 201
+
+    response = client.get(
+        "/users/test/collections/œuvre/export",
+        headers = user_headers,
+    )
+
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"] == (
+        "attachment; filename=\"_uvre.csv\"; filename*=UTF-8''%C5%93uvre.csv"
+    )
+
+
+def test_export_private_collection(client, user_headers):
+    response = client.get(
+        "/users/admin/collections/private/export",
+        headers = user_headers,
+    )
+
+    assert response.status_code == 404
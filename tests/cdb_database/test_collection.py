@@ -33,6 +33,7 @@ from cdb_database.collection import (
     update_collection,
     delete_collection,
     link_user_to_collection,
+    get_collection_version,
 )
 from cdb_database.test_db import (
     admin_user,
@@ -351,3 +352,22 @@ async def test_delete_collection(database):
                 user_id = test_user.id,
                 collection_name = test_test_col.name
             )
+
+
+async def test_collection_version(database):
+    async with database.transaction(force_rollback=True):
+        version = await get_collection_version(database, test_test_col.id)
+
+        await update_collection(
+            database,
+            test_test_col.id,
+            value = CollectionIn(name="updated", title="Updated"),
+        )
+
+        assert await get_collection_version(database, test_test_col.id) \
+            == version + 1
+
+
+async def test_inexistant_collection_version(database):
+    with pytest.raises(NotFoundError):
+        await get_collection_version(database, 123456)
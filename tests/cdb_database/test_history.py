@@ -0,0 +1,120 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+
+import pytest
+
+from cdb_database.error import NotFoundError
+from cdb_database.item import (
+    ItemUpdate,
+    ItemPatch,
+    ItemSelection,
+    get_item,
+    update_item,
+    patch_item,
+    delete_items,
+)
+from cdb_database.history import (
+    KEYFRAME_INTERVAL,
+    json_diff,
+    apply_delta,
+    get_item_history,
+    get_item_version,
+)
+from cdb_database.tables import item_history
+from cdb_database.test_db import test_test_col, test_test_items
+
+
+@pytest.mark.parametrize("source, target", [
+    ({}, {}),
+    (dict(a=1), dict(a=1)),
+    (dict(a=1), dict(a=2)),
+    (dict(a=1), dict(b=1)),
+    (dict(a=1), dict(a=None)),
+    (dict(a=None), dict(a=0)),
+    (dict(a=1), dict(a=True)),
+    (dict(a=dict(b=1, c=2)), dict(a=dict(b=1, d=[1, 2]))),
+    (dict(a=dict(b=1)), dict(a=[1])),
+    ({"a/b": 1, "c~d": 2}, {"a/b": 3}),
+    (dict(a=1), [1, 2]),
+])
+def test_json_diff(source, target):
+    delta = json_diff(source, target)
+
+    assert apply_delta(source, delta) == target
+    if json.dumps(source) == json.dumps(target):
+        assert delta == dict(set={}, unset=[])
+
+
+@pytest.mark.asyncio
+async def test_item_history(database):
+    async with database.transaction(force_rollback=True):
+        item = test_test_items[0]
+        versions = [await get_item(database, test_test_col.id, item.name)]
+        for index in range(2 * KEYFRAME_INTERVAL + 3):
+            versions.append(await update_item(database, item.id, ItemUpdate(
+                name = item.name,
+                title = f"Title {index % 3}",
+                properties = dict(item.properties, index=index),
+            )))
+        versions.append(await patch_item(
+            database,
+            test_test_col.id,
+            item.name,
+            ItemPatch(properties=dict(index=None)),
+        ))
+        await delete_items(database, test_test_col.id, ItemSelection(
+            names = [item.name],
+        ))
+        versions.append(versions[-1].copy(update=dict(deleted=True)))
+
+        history = await get_item_history(database, item.id)
+
+        assert len(history) == len(versions)
+        assert history[0].replaced_at is None
+        assert all(revision.replaced_at for revision in history[1:])
+        revisions = [revision.revision for revision in reversed(history)]
+        assert revisions == sorted(revisions)
+
+        for revision, version in zip(revisions, versions):
+            assert await get_item_version(database, item.id, revision) \
+                == version
+
+        page = await get_item_history(
+            database,
+            item.id,
+            before = history[3].revision,
+            limit = 2,
+        )
+        assert page == history[4:6]
+
+        # Most versions are stored as deltas.
+        keyframes = await database.fetch_val(
+            item_history.select()
+            .with_only_columns([item_history.c.id])
+            .where(item_history.c.item == item.id)
+            .where(item_history.c.keyframe)
+            .count()
+        )
+        assert 0 < keyframes <= len(versions) // KEYFRAME_INTERVAL + 1
+
+
+@pytest.mark.asyncio
+async def test_get_item_version_inexistant(database):
+    item = test_test_items[0]
+    with pytest.raises(NotFoundError):
+        await get_item_version(database, item.id, 0)
@@ -15,12 +15,20 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+
 import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from cdb_database.tables import FieldDb, items
+from cdb_database.filter import compile_filter
 
 from cdb_database.error import (
     AlreadyExistsError,
     NotFoundError,
     ForbiddenError,
+    InvalidQueryError,
 )
 from cdb_database.collection import (
     CollectionCreate,
@@ -33,16 +41,37 @@ from cdb_database.collection import (
     update_collection,
     delete_collection,
     link_user_to_collection,
+    get_collection_version,
 )
 from cdb_database.item import (
     ItemDb,
+    ItemIn,
+    ItemDelta,
+    ItemTombstone,
+    Facet,
+    FacetValue,
+    FacetBucket,
+    ItemChanges,
+    ItemBatchUpdate,
+    ItemSelection,
+    ItemPatch,
     ItemCreate,
     ItemUpdate,
     get_items,
+    get_item_page,
+    get_projected_item_page,
+    iterate_items,
+    get_item_delta,
+    get_item_facets,
     get_item,
     create_item,
+    create_items,
+    create_sort_index,
     update_item,
+    update_items,
+    patch_item,
     delete_item,
+    delete_items,
 )
 from cdb_database.test_db import (
     builder,
@@ -57,6 +86,7 @@ from cdb_database.test_db import (
     test_deleted_col,
     disabled_public_col,
     test_test_items,
+    test_test_fields,
 )
 
 
@@ -72,6 +102,316 @@ async def test_get_items(database):
     assert items == sorted(test_test_items, key=lambda i: i.title)
 
 
+async def test_get_item_pages(database):
+    expected = sorted(test_test_items, key=lambda i: (i.title, i.id))
+
+    result = []
+    cursor = None
+    while True:
+        page = await get_item_page(
+            database,
+            test_test_col.id,
+            cursor = cursor,
+            limit = 4,
+        )
+        assert len(page.items) <= 4
+        result += page.items
+
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+
+    assert result == expected
+
+
+async def test_get_item_page_without_limit(database):
+    page = await get_item_page(
+        database,
+        test_test_col.id,
+    )
+
+    assert page.items == sorted(test_test_items, key=lambda i: i.title)
+    assert page.next_cursor is None
+
+
+async def test_get_item_page_invalid_cursor(database):
+    with pytest.raises(InvalidQueryError):
+        await get_item_page(
+            database,
+            test_test_col.id,
+            cursor = "foobar",
+            limit = 4,
+        )
+
+
+async def test_search_items_by_name(database):
+    page = await get_item_page(
+        database,
+        test_test_col.id,
+        search = test_test_items[2].name,
+    )
+
+    assert page.items == [test_test_items[2]]
+
+
+async def test_search_items_by_property(database):
+    async with database.transaction(force_rollback=True):
+        item = await create_item(database, ItemCreate(
+            collection = test_test_col.id,
+            name = "foo",
+            title = "Bar",
+            properties = dict(publisher="Foobar Editions", year=1984),
+        ))
+
+        page = await get_item_page(
+            database,
+            test_test_col.id,
+            search = "editions foobar",
+        )
+
+        assert page.items == [item]
+
+        updated = await update_item(database, item.id, ItemUpdate(
+            name = "foo",
+            title = "Bar",
+            properties = dict(publisher="Baz"),
+        ))
+
+        page = await get_item_page(
+            database,
+            test_test_col.id,
+            search = "foobar",
+        )
+
+        assert page.items == []
+
+
+async def test_filter_items(database):
+    page = await get_item_page(
+        database,
+        test_test_col.id,
+        filter = "index > 5 and not index = 8",
+    )
+
+    expected = sorted(
+        (
+            item
+            for item in test_test_items
+            if item.properties["index"] > 5
+                and item.properties["index"] != 8
+        ),
+        key = lambda i: i.title,
+    )
+
+    assert page.items == expected
+
+
+async def test_filter_items_contains(database):
+    page = await get_item_page(
+        database,
+        test_test_col.id,
+        filter = 'title ~ "#1" or (index <= 2.5 and index != null)',
+    )
+
+    expected = sorted(
+        test_test_items[:2] + test_test_items[9:],
+        key = lambda i: i.title,
+    )
+
+    assert page.items == expected
+
+
+@pytest.mark.parametrize("filter, uses_containment", [
+    ("index = 3", True),
+    ("publisher = Foo", True),
+    ('publisher = "3"', False),
+    ("title = Foo", False),
+    ("index > 3", False),
+])
+def test_filter_equality_containment(filter, uses_containment):
+    fields = test_test_fields + [
+        FieldDb(
+            id = 0,
+            collection = test_test_col.id,
+            name = "publisher",
+            field = "properties.publisher",
+            label = "Publisher",
+            type = "string",
+            sort_index = 3,
+        ),
+    ]
+    condition = compile_filter(filter, items, fields)
+    sql = str(condition.compile(dialect=postgresql.dialect()))
+
+    assert ("@>" in sql) == uses_containment
+
+
+@pytest.mark.parametrize("filter", [
+    "index >",
+    "index > 5 and",
+    "(index > 5",
+    "foo = 3",
+    'index = "abc"',
+    "title ~ 3",
+    "index $ 3",
+])
+async def test_filter_items_invalid(database, filter):
+    with pytest.raises(InvalidQueryError):
+        await get_item_page(
+            database,
+            test_test_col.id,
+            filter = filter,
+        )
+
+
+async def test_sort_items(database):
+    expected = sorted(
+        test_test_items,
+        key = lambda i: i.properties["index"],
+        reverse = True,
+    )
+
+    result = []
+    cursor = None
+    while True:
+        page = await get_item_page(
+            database,
+            test_test_col.id,
+            sort = "-index",
+            cursor = cursor,
+            limit = 3,
+        )
+        result += page.items
+
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+
+    assert result == expected
+
+
+async def test_sort_items_missing_values(database):
+    async with database.transaction(force_rollback=True):
+        item = await create_item(database, ItemCreate(
+            collection = test_test_col.id,
+            name = "foo",
+            title = "Bar",
+            properties = dict(index="not a number"),
+        ))
+
+        expected = sorted(
+            test_test_items,
+            key = lambda i: i.properties["index"],
+        ) + [item]
+
+        result = []
+        cursor = None
+        while True:
+            page = await get_item_page(
+                database,
+                test_test_col.id,
+                sort = "index",
+                cursor = cursor,
+                limit = 4,
+            )
+            result += page.items
+
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+
+        assert result == expected
+
+
+async def test_sort_items_invalid(database):
+    with pytest.raises(InvalidQueryError):
+        await get_item_page(
+            database,
+            test_test_col.id,
+            sort = "index,foo",
+        )
+
+
+async def test_create_sort_index(database):
+    async with database.transaction(force_rollback=True):
+        await create_sort_index(database, test_test_fields[1])
+        # Creating it twice is a no-op.
+        await create_sort_index(database, test_test_fields[1])
+
+        count = await database.fetch_val(
+            "SELECT count(*) AS count FROM pg_indexes "
+            "WHERE tablename = 'items' AND indexname LIKE 'ix_items_sort_%'",
+            column = "count",
+        )
+
+        assert count == 1
+
+
+async def test_get_projected_items(database):
+    page = await get_projected_item_page(
+        database,
+        test_test_col.id,
+        ["name", "properties.index", "name"],
+        sort = "index",
+        limit = 3,
+    )
+
+    expected = [
+        dict(
+            name = item.name,
+            properties = dict(index=item.properties["index"]),
+        )
+        for item in test_test_items[:3]
+    ]
+
+    assert page.items == expected
+    assert page.next_cursor is not None
+
+
+@pytest.mark.parametrize("projection", [
+    [],
+    ["foo"],
+    ["search_vector"],
+    ["title.foo"],
+    ["properties."],
+])
+async def test_get_projected_items_invalid(database, projection):
+    with pytest.raises(InvalidQueryError):
+        await get_projected_item_page(
+            database,
+            test_test_col.id,
+            projection,
+        )
+
+
+async def test_iterate_items(database):
+    rows = await iterate_items(
+        database,
+        test_test_col.id,
+        sort = "index",
+    )
+
+    assert [row async for row in rows] == [
+        item.dict()
+        for item in test_test_items
+    ]
+
+
+async def test_iterate_projected_items(database):
+    rows = await iterate_items(
+        database,
+        test_test_col.id,
+        projection = ["name"],
+        filter = "index <= 2",
+        sort = "-index",
+    )
+
+    assert [row async for row in rows] == [
+        dict(name=item.name)
+        for item in reversed(test_test_items[:2])
+    ]
+
+
 async def test_get_item(database):
     item = await get_item(
         database,
@@ -122,6 +462,39 @@ async def test_create_duplicate_item(database):
             await create_item(database, item)
 
 
+async def test_create_items(database):
+    async with database.transaction(force_rollback=True):
+        new_items = [
+            ItemIn(name="foo", title="Foo", properties=dict(stuff="foobar")),
+            ItemIn(name=test_test_items[7].name, title="Bar", properties={}),
+            ItemIn(name="baz", title="Baz", properties=dict(count=3)),
+            ItemIn(name="foo", title="Foo again", properties={}),
+        ]
+        ids = await create_items(database, test_test_col.id, new_items)
+
+        assert ids[0] is not None
+        assert ids[1] is None
+        assert ids[2] is not None
+        assert ids[3] is None
+
+        for index in (0, 2):
+            item = new_items[index]
+            result = await get_item(database, test_test_col.id, item.name)
+            assert result == ItemDb(
+                id = ids[index],
+                collection = test_test_col.id,
+                deleted = False,
+                **item.dict(),
+            )
+
+        page = await get_item_page(database, test_test_col.id, search="foobar")
+        assert [item.name for item in page.items] == ["foo"]
+
+
+async def test_create_items_empty(database):
+    assert await create_items(database, test_test_col.id, []) == []
+
+
 async def test_update_item(database):
     async with database.transaction(force_rollback=True):
         item = ItemUpdate(
@@ -155,6 +528,123 @@ async def test_update_item(database):
         assert result == expected
 
 
+@pytest.mark.parametrize("properties, patch, expected", [
+    (
+        dict(a=1, b=2),
+        dict(b=None, c="foo"),
+        dict(a=1, c="foo"),
+    ),
+    (
+        dict(a=dict(x=1, y=2), b=[1, 2]),
+        dict(a=dict(y=None, z=dict(w=True)), b=[3]),
+        dict(a=dict(x=1, z=dict(w=True)), b=[3]),
+    ),
+    (
+        dict(a="scalar"),
+        dict(a=dict(b=None, c=1)),
+        dict(a=dict(c=1)),
+    ),
+    (
+        dict(a=1),
+        dict(),
+        dict(a=1),
+    ),
+])
+async def test_patch_item(database, properties, patch, expected):
+    async with database.transaction(force_rollback=True):
+        item = test_test_items[0]
+        await update_item(database, item.id, ItemUpdate(
+            name = item.name,
+            title = item.title,
+            properties = properties,
+        ))
+
+        result = await patch_item(
+            database,
+            test_test_col.id,
+            item.name,
+            ItemPatch(title="Patched", properties=patch),
+        )
+
+        assert result == item.copy(update=dict(
+            title = "Patched",
+            properties = expected,
+        ))
+        assert await get_item(database, test_test_col.id, item.name) \
+            == result
+
+
+async def test_patch_inexistant_item(database):
+    with pytest.raises(NotFoundError):
+        await patch_item(
+            database,
+            test_test_col.id,
+            "does-not-exist",
+            ItemPatch(title="Patched"),
+        )
+
+
+async def test_update_items(database):
+    async with database.transaction(force_rollback=True):
+        first, second = test_test_items[0], test_test_items[1]
+        updates = [
+            ItemBatchUpdate(
+                name = first.name,
+                changes = ItemChanges(title="New title"),
+            ),
+            ItemBatchUpdate(
+                name = second.name,
+                changes = ItemChanges(
+                    name = "renamed",
+                    properties = dict(stuff="foobar"),
+                ),
+            ),
+            ItemBatchUpdate(
+                name = "does-not-exist",
+                changes = ItemChanges(title="Nope"),
+            ),
+        ]
+        results = await update_items(database, test_test_col.id, updates)
+
+        expected = [
+            first.copy(update=dict(title="New title")),
+            second.copy(update=dict(
+                name = "renamed",
+                properties = dict(stuff="foobar"),
+            )),
+        ]
+        assert sorted(results, key=lambda i: i.id) == expected
+
+        assert await get_item(database, test_test_col.id, "renamed") \
+            == expected[1]
+
+        page = await get_item_page(database, test_test_col.id, search="foobar")
+        assert [item.name for item in page.items] == ["renamed"]
+
+
+async def test_update_items_conflict(database):
+    async with database.transaction(force_rollback=True):
+        updates = [
+            ItemBatchUpdate(
+                name = test_test_items[0].name,
+                changes = ItemChanges(name=test_test_items[1].name),
+            ),
+        ]
+
+        with pytest.raises(AlreadyExistsError):
+            await update_items(database, test_test_col.id, updates)
+
+
+async def test_update_items_duplicate(database):
+    updates = [
+        ItemBatchUpdate(name="foo", changes=ItemChanges(title="Foo")),
+        ItemBatchUpdate(name="foo", changes=ItemChanges(title="Bar")),
+    ]
+
+    with pytest.raises(InvalidQueryError):
+        await update_items(database, test_test_col.id, updates)
+
+
 async def test_delete_item(database):
     async with database.transaction(force_rollback=True):
         await delete_item(
@@ -168,3 +658,234 @@ async def test_delete_item(database):
                 test_test_col.id,
                 test_test_items[6].name,
             )
+
+
+async def test_delete_items_by_names(database):
+    async with database.transaction(force_rollback=True):
+        names = [item.name for item in test_test_items[:3]]
+        count = await delete_items(
+            database,
+            test_test_col.id,
+            ItemSelection(names=names + ["does-not-exist"]),
+        )
+
+        assert count == 3
+
+        remaining = await get_items(database, test_test_col.id)
+        assert remaining == sorted(test_test_items[3:], key=lambda i: i.title)
+
+        # Already deleted items are not counted twice.
+        count = await delete_items(
+            database,
+            test_test_col.id,
+            ItemSelection(names=names),
+        )
+        assert count == 0
+
+
+async def test_delete_items_by_filter(database):
+    async with database.transaction(force_rollback=True):
+        count = await delete_items(
+            database,
+            test_test_col.id,
+            ItemSelection(filter="index > 5"),
+        )
+
+        expected = [
+            item
+            for item in test_test_items
+            if item.properties["index"] <= 5
+        ]
+        assert count == len(test_test_items) - len(expected)
+
+        remaining = await get_items(database, test_test_col.id)
+        assert remaining == sorted(expected, key=lambda i: i.title)
+
+
+async def test_delete_items_no_selection(database):
+    with pytest.raises(InvalidQueryError):
+        await delete_items(database, test_test_col.id, ItemSelection())
+
+
+async def test_item_writes_bump_collection_version(database):
+    async with database.transaction(force_rollback=True):
+        version = await get_collection_version(database, test_test_col.id)
+
+        item = await create_item(database, ItemCreate(
+            collection = test_test_col.id,
+            name = "foo",
+            title = "Foo",
+            properties = {},
+        ))
+        await patch_item(
+            database,
+            test_test_col.id,
+            item.name,
+            ItemPatch(title="Bar"),
+        )
+        await delete_item(database, item.id)
+
+        # Writes that change nothing do not bump the version.
+        await delete_items(
+            database,
+            test_test_col.id,
+            ItemSelection(names=["does-not-exist"]),
+        )
+
+        assert await get_collection_version(database, test_test_col.id) \
+            == version + 3
+
+
+async def test_get_item_delta(database):
+    async with database.transaction(force_rollback=True):
+        delta = await get_item_delta(database, test_test_col.id, 0)
+        assert delta.items == test_test_items
+
+        revision = delta.revision
+        delta = await get_item_delta(database, test_test_col.id, revision)
+        assert delta == ItemDelta(revision=revision, items=[])
+
+        first, second = test_test_items[:2]
+        await patch_item(
+            database,
+            test_test_col.id,
+            second.name,
+            ItemPatch(title="Patched"),
+        )
+        await delete_item(database, first.id)
+
+        delta = await get_item_delta(database, test_test_col.id, revision)
+        assert delta.items == [
+            second.copy(update=dict(title="Patched")),
+            first.copy(update=dict(deleted=True)),
+        ]
+
+        limited = await get_item_delta(
+            database,
+            test_test_col.id,
+            revision,
+            limit = 1,
+        )
+        assert limited.items == delta.items[:1]
+
+        rest = await get_item_delta(
+            database,
+            test_test_col.id,
+            limited.revision,
+        )
+        assert rest == ItemDelta(
+            revision = delta.revision,
+            items = delta.items[1:],
+        )
+
+        redacted = await get_item_delta(
+            database,
+            test_test_col.id,
+            revision,
+            redact_deleted = True,
+        )
+        assert redacted.items == [
+            delta.items[0],
+            ItemTombstone(
+                id = first.id,
+                collection = first.collection,
+                name = first.name,
+                revision = delta.revision,
+            ),
+        ]
+
+
+async def test_revisions_in_commit_order(database):
+    first, second = test_test_items[:2]
+    locked = asyncio.Event()
+
+    async def revision(item):
+        query = select([items.c.revision]).where(items.c.id == item.id)
+        return await database.fetch_val(query)
+
+    async def patch(item, title):
+        await patch_item(
+            database,
+            test_test_col.id,
+            item.name,
+            ItemPatch(title=title),
+        )
+        return await revision(item)
+
+    # Each writer runs in its own task, with its own connection.
+    async def first_writer():
+        async with database.transaction(force_rollback=True):
+            await patch(first, "First")
+            locked.set()
+            await asyncio.sleep(0.1)
+            return await patch(first, "First again")
+
+    async def second_writer():
+        await locked.wait()
+        async with database.transaction(force_rollback=True):
+            return await patch(second, "Second")
+
+    first_revision, second_revision = await asyncio.gather(
+        first_writer(),
+        second_writer(),
+    )
+
+    # The second writer waits for the first one to end before taking a
+    # revision, so a delta seeing the first one cannot miss the second.
+    assert second_revision > first_revision
+
+
+async def test_get_item_facets(database):
+    title, index = await get_item_facets(
+        database,
+        test_test_col.id,
+        ["title", "index"],
+        filter = "index <= 5",
+        size = 2,
+        buckets = 2,
+    )
+
+    assert title == Facet(
+        field = "title",
+        count = 5,
+        values = [
+            FacetValue(value="Item #1", count=1),
+            FacetValue(value="Item #2", count=1),
+        ],
+    )
+    assert index == Facet(
+        field = "index",
+        count = 5,
+        min = 1,
+        max = 5,
+        avg = 3,
+        histogram = [
+            FacetBucket(min=1, max=3, count=2),
+            FacetBucket(min=3, max=5, count=3),
+        ],
+    )
+
+
+async def test_get_item_facets_search(database):
+    facets = await get_item_facets(
+        database,
+        test_test_col.id,
+        ["index"],
+        search = test_test_items[2].name,
+    )
+
+    assert facets == [
+        Facet(
+            field = "index",
+            count = 1,
+            min = 3,
+            max = 3,
+            avg = 3,
+            histogram = [FacetBucket(min=3, max=3, count=1)],
+        ),
+    ]
+
+
+async def test_get_item_facets_invalid(database):
+    with pytest.raises(InvalidQueryError):
+        await get_item_facets(database, test_test_col.id, ["foo"])
@@ -0,0 +1,135 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import asyncio
+
+import pytest
+
+from cdb_database.error import NotFoundError
+from cdb_database.loader import BatchLoader, Loader
+from cdb_database.test_db import (
+    admin_user,
+    test_user,
+    disabled_user,
+    test_test_items,
+)
+
+
+pytestmark = pytest.mark.asyncio
+
+
+class CountingDatabase:
+    def __init__(self, database):
+        self.database = database
+        self.queries = 0
+
+    async def all(self, query, wrapper):
+        self.queries += 1
+        return await self.database.all(query, wrapper)
+
+    async def fetch_one(self, query):
+        self.queries += 1
+        return await self.database.fetch_one(query)
+
+    async def fetch_cached(self, key, build, values):
+        self.queries += 1
+        return await self.database.fetch_cached(key, build, values)
+
+
+async def test_load_users(database):
+    counting = CountingDatabase(database)
+    loader = Loader(counting)
+
+    users = await asyncio.gather(
+        loader.user(admin_user.id),
+        loader.user(test_user.id),
+        loader.user(admin_user.id),
+        loader.user_by_name("test"),
+    )
+
+    assert [user.id for user in users] \
+        == [admin_user.id, test_user.id, admin_user.id, test_user.id]
+    # One query by id for both ids, one by name.
+    assert counting.queries == 2
+
+    assert await loader.user_by_name("admin") is users[0]
+    assert await loader.user(test_user.id) is users[1]
+    assert counting.queries == 2
+
+
+async def test_load_missing_users(database):
+    counting = CountingDatabase(database)
+    loader = Loader(counting)
+
+    for _ in range(2):
+        with pytest.raises(NotFoundError):
+            await loader.user_by_name("does-not-exist")
+        with pytest.raises(NotFoundError):
+            await loader.user(disabled_user.id)
+
+    user = await loader.user(disabled_user.id, include_disabled=True)
+    assert user.username == disabled_user.username
+    assert counting.queries == 2
+
+
+async def test_batch_loader_cancelled():
+    batches = []
+
+    async def load_many(keys):
+        batches.append(keys)
+        return {key: key * 2 for key in keys}
+
+    loader = BatchLoader(load_many)
+
+    first = asyncio.ensure_future(loader.load(1))
+    second = asyncio.ensure_future(loader.load(2))
+    # Both loads join the batch, then the one dispatching it is cancelled.
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await asyncio.wait_for(second, 1) == 4
+    assert await asyncio.wait_for(loader.load(1), 1) == 2
+    assert batches == [[2], [1]]
+
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+async def test_resolve_path(database):
+    counting = CountingDatabase(database)
+    loader = Loader(counting)
+    item = test_test_items[0]
+
+    resolved = await loader.resolve_path(
+        test_user,
+        "test",
+        "test",
+        item_name = item.name,
+    )
+    assert resolved.item == item
+
+    assert await loader.resolve_path(
+        test_user,
+        "test",
+        "test",
+        item_name = item.name,
+    ) is resolved
+
+    collection = await loader.resolve_path(test_user, "test", "test")
+    assert collection.collection == resolved.collection
+    assert collection.item is None
+
+    assert counting.queries == 1
@@ -0,0 +1,125 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import JSONB
+
+from cdb_database.expression import field_expression
+from cdb_database.item import sort_index_name
+from cdb_database.migration import (
+    upgrade_tables,
+    json_items,
+    sort_index_names,
+)
+from cdb_database.test_db import test_test_fields
+
+
+def test_upgrade_tables(setup_database):
+    engine = create_engine(os.getenv("CDB_TEST_DATABASE"))
+
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            # Revert items to its initial schema.
+            connection.execute("""
+                DROP INDEX ix_items_properties_gin;
+                DROP INDEX ix_items_search_vector;
+                ALTER TABLE items DROP COLUMN search_vector;
+                ALTER TABLE items DROP COLUMN revision;
+                ALTER TABLE items
+                    ALTER COLUMN properties TYPE JSON USING properties::JSON;
+                ALTER TABLE collections DROP COLUMN version;
+                DROP INDEX ix_items_collection_title_id_live;
+                CREATE INDEX ix_items_collection_title_id
+                    ON items (collection, title, id);
+            """)
+
+            applied = upgrade_tables(connection)
+
+            assert "ALTER TABLE items ALTER COLUMN properties TYPE JSONB " \
+                "USING properties::JSONB" in applied
+            assert "DROP INDEX ix_items_collection_title_id" in applied
+
+            inspector = inspect(connection)
+            columns = {
+                column["name"]: column
+                for column in inspector.get_columns("items")
+            }
+            assert isinstance(columns["properties"]["type"], JSONB)
+            assert "revision" in columns
+            index_names = {
+                index["name"]
+                for index in inspector.get_indexes("items")
+            }
+            assert "ix_items_properties_gin" in index_names
+            assert "ix_items_collection_title_id_live" in index_names
+            assert "ix_items_collection_title_id" not in index_names
+
+            missing = connection.execute(
+                "SELECT count(*) FROM items WHERE search_vector IS NULL"
+            ).scalar()
+            assert missing == 0
+
+            assert upgrade_tables(connection) == []
+
+        finally:
+            transaction.rollback()
+
+
+def test_upgrade_sort_indexes(setup_database):
+    engine = create_engine(os.getenv("CDB_TEST_DATABASE"))
+    field = test_test_fields[1]
+    legacy_items = json_items()
+
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            connection.execute("""
+                DROP INDEX ix_items_properties_gin;
+                ALTER TABLE items
+                    ALTER COLUMN properties TYPE JSON USING properties::JSON;
+            """)
+
+            # A sort index created by `sort_index` before the conversion, and
+            # one no field uses anymore.
+            expression = field_expression(legacy_items, field).compile(
+                dialect = postgresql.dialect(),
+                compile_kwargs = {"literal_binds": True},
+            )
+            old_index = sort_index_name(field, table=legacy_items)
+            connection.execute(
+                f"CREATE INDEX {old_index} "
+                f"ON items (collection, ({expression}), id)"
+            )
+            connection.execute(
+                "CREATE INDEX ix_items_sort_0000000000000000 "
+                "ON items ((json_typeof(properties -> 'gone')))"
+            )
+
+            applied = upgrade_tables(connection)
+
+            assert f"DROP INDEX {old_index}" in applied
+            assert "-- Dropped the sort index ix_items_sort_0000000000000000, " \
+                "used by no field" in applied
+
+            assert sort_index_names(connection) == [sort_index_name(field)]
+
+        finally:
+            transaction.rollback()
@@ -0,0 +1,92 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import timedelta
+
+import pytest
+
+from cdb_database.error import NotFoundError
+from cdb_database.collection import delete_collection, get_collection
+from cdb_database.item import get_item, get_item_delta, delete_item
+from cdb_database.purge import purge
+from cdb_database.test_db import (
+    test_user,
+    test_test_col,
+    test_public_col,
+    test_test_items,
+    test_public_items,
+    test_public_fields,
+)
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_purge(database):
+    async with database.transaction(force_rollback=True):
+        item = test_test_items[0]
+        await delete_item(database, item.id)
+        await delete_collection(database, test_public_col.id)
+
+        # Nothing has been deleted for long enough.
+        counts = await purge(database, timedelta(days=1))
+        assert set(counts.values()) == {0}
+
+        progress = []
+        counts = await purge(
+            database,
+            timedelta(0),
+            batch_size = 3,
+            progress = lambda table, count: progress.append((table, count)),
+        )
+
+        assert counts == dict(
+            item_history = 1,
+            items = 1 + len(test_public_items),
+            fields = len(test_public_fields),
+            user_collections = 1,
+            collections = 1,
+        )
+        # Tombstones and the rows of purged collections are separate steps.
+        assert progress[:6] == [
+            ("item_history", 1),
+            ("items", 1),
+            ("items", 4),
+            ("items", 7),
+            ("items", 10),
+            ("items", 11),
+        ]
+
+        with pytest.raises(NotFoundError):
+            await get_item(
+                database,
+                test_test_col.id,
+                item.name,
+                include_deleted = True,
+            )
+
+        with pytest.raises(NotFoundError):
+            await get_collection(
+                database,
+                test_user,
+                user_id = test_user.id,
+                collection_name = test_public_col.name,
+                include_deleted = True,
+            )
+
+        delta = await get_item_delta(database, test_test_col.id, 0)
+        assert delta.items == test_test_items[1:]
@@ -0,0 +1,121 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+
+from cdb_database.error import NotFoundError
+from cdb_database.collection import get_collection_version
+from cdb_database.item import delete_item
+from cdb_database.resolver import resolve_path
+from cdb_database.test_db import (
+    admin_user,
+    test_user,
+    admin_private_col,
+    admin_shared_col,
+    admin_shared_edit_col,
+    admin_public_col,
+    test_test_col,
+    test_deleted_col,
+    disabled_public_col,
+    test_test_items,
+)
+
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.mark.parametrize("logged_user, username, collection, can_edit", [
+    (test_user, "test", test_test_col, True),
+    (test_user, "admin", admin_public_col, False),
+    (test_user, "admin", admin_shared_col, False),
+    (test_user, "admin", admin_shared_edit_col, True),
+    (admin_user, "admin", admin_private_col, True),
+    (admin_user, "test", test_test_col, True),
+    (admin_user, "test", test_deleted_col, True),
+    (admin_user, "disabled", disabled_public_col, True),
+])
+async def test_resolve_collection(
+    database,
+    logged_user,
+    username,
+    collection,
+    can_edit,
+):
+    resolved = await resolve_path(
+        database,
+        logged_user,
+        username,
+        collection.name,
+    )
+
+    assert resolved.collection.id == collection.id
+    assert resolved.collection.can_edit == can_edit
+    assert resolved.version \
+        == await get_collection_version(database, collection.id)
+    assert resolved.item is None
+
+
+@pytest.mark.parametrize("logged_user, username, collection_name", [
+    (test_user, "admin", "private"),
+    (test_user, "test", "deleted"),
+    (test_user, "disabled", "public"),
+    (test_user, "test", "does-not-exist"),
+    (test_user, "does-not-exist", "test"),
+])
+async def test_resolve_invisible_collection(
+    database,
+    logged_user,
+    username,
+    collection_name,
+):
+    with pytest.raises(NotFoundError):
+        await resolve_path(database, logged_user, username, collection_name)
+
+
+async def test_resolve_item(database):
+    async with database.transaction(force_rollback=True):
+        item = test_test_items[0]
+
+        resolved = await resolve_path(
+            database,
+            test_user,
+            "test",
+            "test",
+            item_name = item.name,
+        )
+
+        assert resolved.collection.id == test_test_col.id
+        assert resolved.item == item
+
+        await delete_item(database, item.id)
+
+        with pytest.raises(NotFoundError):
+            await resolve_path(
+                database,
+                test_user,
+                "test",
+                "test",
+                item_name = item.name,
+            )
+
+        resolved = await resolve_path(
+            database,
+            admin_user,
+            "test",
+            "test",
+            item_name = item.name,
+        )
+        assert resolved.item == item.copy(update=dict(deleted=True))
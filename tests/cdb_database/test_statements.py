@@ -0,0 +1,77 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from sqlalchemy import select, bindparam
+
+from cdb_database.error import NotFoundError
+from cdb_database.tables import users
+from cdb_database.statements import StatementCache, statement_cache
+from cdb_database.user import get_user
+from cdb_database.test_db import admin_user, test_user
+
+
+pytestmark = pytest.mark.asyncio
+
+
+def test_statement_cache(database):
+    cache = StatementCache()
+    dialect = database._backend._dialect
+    built = []
+
+    def build():
+        built.append(True)
+        return (
+            select([users.c.id])
+            .where(users.c.username == bindparam("username"))
+            .where(~users.c.disabled)
+        )
+
+    statement = cache.get("key", build, dialect)
+    assert cache.get("key", build, dialect) is statement
+    assert len(built) == 1
+    assert cache.stats() == dict(size=1, hits=1, misses=1)
+
+    assert "$1" in statement.sql
+    assert statement.arguments(dict(username="test")) == ["test"]
+
+    cache.clear()
+    assert cache.stats() == dict(size=0, hits=0, misses=0)
+
+
+async def test_get_user_cached(database):
+    statement_cache.clear()
+
+    for user in (admin_user, test_user, admin_user):
+        result = await get_user(database, username=user.username)
+        assert result.id == user.id
+        assert result.username == user.username
+
+    stats = statement_cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 2
+
+    with pytest.raises(NotFoundError):
+        await get_user(database, username="does_not_exist")
+
+    result = await get_user(database, user_id=test_user.id)
+    assert result.username == test_user.username
+
+    stats = statement_cache.stats()
+    assert stats["misses"] == 2
+    assert stats["hits"] == 3
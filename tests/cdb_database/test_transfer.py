@@ -0,0 +1,141 @@
+# This file is part of cdb.
+#
+# Copyright (C) 2019  the authors (see AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import pytest
+
+from cdb_database.error import InvalidQueryError
+from cdb_database.item import get_item, delete_item
+from cdb_database.history import get_item_history
+from cdb_database.collection import get_collection_version
+from cdb_database import transfer
+from cdb_database.transfer import ImportResult, import_items, export_items
+from cdb_database.test_db import test_test_col, test_test_items
+
+
+pytestmark = pytest.mark.asyncio
+
+
+async def rows_of(*rows):
+    for row in rows:
+        yield row
+
+
+async def test_import_items(database):
+    async with database.transaction(force_rollback=True):
+        version = await get_collection_version(database, test_test_col.id)
+        item = test_test_items[0]
+
+        result = await import_items(
+            database,
+            test_test_col.id,
+            rows_of(
+                dict(name="new", title="New", index="42", color="red"),
+                dict(name=item.name, title="", index="7", color="blue"),
+                dict(name="new", title="Newer", index="", color=""),
+            ),
+            from_text = True,
+        )
+
+        assert result == ImportResult(created=1, updated=1)
+
+        new = await get_item(database, test_test_col.id, "new")
+        assert new.title == "Newer"
+        assert new.properties == {}
+
+        updated = await get_item(database, test_test_col.id, item.name)
+        assert updated.title == item.name
+        assert updated.properties == dict(index=7, color="blue")
+
+        history = await get_item_history(database, item.id)
+        assert len(history) == 2
+
+        assert await get_collection_version(database, test_test_col.id) \
+            > version
+
+
+async def test_import_items_over_deleted(database):
+    async with database.transaction(force_rollback=True):
+        item = test_test_items[0]
+        await delete_item(database, item.id)
+
+        result = await import_items(
+            database,
+            test_test_col.id,
+            rows_of(dict(name=item.name, color="red")),
+        )
+
+        assert result == ImportResult(updated=1)
+
+        restored = await get_item(database, test_test_col.id, item.name)
+        assert not restored.deleted
+        # The properties of the deleted item are not merged.
+        assert restored.properties == dict(color="red")
+
+
+async def test_import_items_json(database):
+    async with database.transaction(force_rollback=True):
+        result = await import_items(
+            database,
+            test_test_col.id,
+            rows_of(dict(name="new", index=1.5, tags=["a", "b"])),
+        )
+
+        assert result == ImportResult(created=1)
+
+        new = await get_item(database, test_test_col.id, "new")
+        assert new.properties == dict(index=1.5, tags=["a", "b"])
+
+
+async def test_import_items_batches(database, monkeypatch):
+    monkeypatch.setattr(transfer, "IMPORT_BATCH_SIZE", 2)
+
+    async with database.transaction(force_rollback=True):
+        result = await import_items(
+            database,
+            test_test_col.id,
+            rows_of(*(dict(name=f"new{i}", index=i) for i in range(5))),
+        )
+
+        assert result == ImportResult(created=5)
+
+        for i in range(5):
+            new = await get_item(database, test_test_col.id, f"new{i}")
+            assert new.properties == dict(index=i)
+
+
+@pytest.mark.parametrize("row", [
+    dict(title="No name"),
+    dict(name="bad", index="not a number"),
+])
+async def test_import_items_invalid(database, row):
+    async with database.transaction(force_rollback=True):
+        with pytest.raises(InvalidQueryError):
+            await import_items(
+                database,
+                test_test_col.id,
+                rows_of(dict(name="ok"), row),
+                from_text = True,
+            )
+
+
+async def test_export_items(database):
+    columns, rows = await export_items(database, test_test_col.id)
+
+    assert columns == ["name", "title", "index"]
+    assert [row async for row in rows] == [
+        (item.name, item.title, item.properties["index"])
+        for item in test_test_items
+    ]
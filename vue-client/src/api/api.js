@@ -104,8 +104,16 @@ export class Api {
 		})
 	}
 
-	getItems(username, collectionName) {
-		return this.fetchJson(`/users/${username}/collections/${collectionName}/items`)
+	getItems(username, collectionName, params={}) {
+		const query = new URLSearchParams(params).toString()
+		const path = `/users/${username}/collections/${collectionName}/items`
+		return this.fetchJson(query? `${path}?${query}`: path)
+	}
+
+	getCollectionSnapshot(username, collectionName, params={}) {
+		const query = new URLSearchParams(params).toString()
+		const path = `/users/${username}/collections/${collectionName}/snapshot`
+		return this.fetchJson(query? `${path}?${query}`: path)
 	}
 
 	getFields(username, collectionName) {
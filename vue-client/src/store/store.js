@@ -11,6 +11,9 @@ export class Store {
 		this.users = {}
 		this.usersByUsername = {}
 		this.collections = {}
+		// Maps "username/collectionName" to collection ids, so that a
+		// collection can be found without fetching its owner.
+		this.collectionsByPath = {}
 
 		this.tryGetSavedUser()
 	}
@@ -24,11 +27,7 @@ export class Store {
 	}
 
 	getCollection(username, collectionName) {
-		const user = this.getUser(username)
-		if (!user)
-			return null
-
-		const colId = user.collectionsByName[collectionName]
+		const colId = this.collectionsByPath[`${username}/${collectionName}`]
 		if (!colId)
 			return null
 
@@ -97,6 +96,8 @@ export class Store {
 		for(const collection of collections) {
 			Vue.set(this.collections, collection.id, collection)
 
+			Vue.set(this.collectionsByPath, `${username}/${collection.name}`, collection.id)
+
 			collectionsIds.push(collection.id)
 			collectionsByName[collection.name] = collection.id
 		}
@@ -108,16 +109,25 @@ export class Store {
 	async fetchCollection(username, collectionName) {
 		console.log(`fetchCollection(${username}, ${collectionName})`)
 
-		await this.fetchCollections(username)
+		const snapshot = await api.getCollectionSnapshot(username, collectionName)
+
+		const collection = snapshot.collection
+		collection.items = snapshot.items
+		collection.fields = snapshot.fields
+
+		Vue.set(this.collections, collection.id, collection)
+		Vue.set(this.collectionsByPath, `${username}/${collectionName}`, collection.id)
+	}
+
+	async searchItems(username, collectionName, query) {
+		console.log(`searchItems(${username}, ${collectionName}, ${query})`)
+
 		const collection = this.getCollection(username, collectionName)
+		const params = query? { q: query }: {}
 
-		const [items, fields] = await Promise.all([
-			api.getItems(username, collectionName),
-			api.getFields(username, collectionName),
-		])
+		const items = await api.getItems(username, collectionName, params)
 
 		Vue.set(collection, "items", items)
-		Vue.set(collection, "fields", fields)
 	}
 
 	async createCollection(collection) {